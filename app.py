@@ -1,7 +1,8 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 import json
 import os
+import re
 import sys
 from dotenv import load_dotenv
 
@@ -11,17 +12,37 @@ load_dotenv()
 # Add current directory to Python path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+from conversation_store import DEFAULT_DB_FILE, ConversationStore, new_conversation_id
+from http_utils import compress_body, etag_for, etag_matches, optional_float, optional_int, page_limit
+from metrics import CONTENT_TYPE, default_service_metrics, note_error, note_route, record_fallback, track_request
+from tracing import annotate, default_tracer, traced
+from usage_ledger import default_usage_ledger
+
 app = Flask(__name__)
 CORS(app)
 
-# File to store conversation history
+# Former conversation history file, imported once into the SQLite conversation store
 CONVERSATIONS_FILE = 'conversations.json'
+conversation_store = ConversationStore(DEFAULT_DB_FILE, legacy_json=CONVERSATIONS_FILE)
+
+# Page sizes of the conversation list / message endpoints (?limit= up to MAX_PAGE_SIZE)
+CONVERSATION_PAGE_SIZE = 50
+MESSAGE_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+# The page sends a random per-browser id in this header; new conversations are owned by it
+# and the conversation list only shows the requesting client's own conversations
+CLIENT_ID_HEADER = 'X-Client-Id'
+CLIENT_ID_RE = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+MAX_TITLE_LENGTH = 200
+# ?day= of the usage endpoint (UTC day)
+DAY_RE = re.compile(r'^\d{4}-\d{2}-\d{2}$')
 
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY", "your_api_key")
 
 # Attempt to initialize TA Agent system
 try:
-    from ta_agents_history import TeachingAssistant
+    from session_registry import SessionRegistry
     # Check if API key exists
     api_key = DEEPSEEK_API_KEY
     if not api_key:
@@ -30,55 +51,96 @@ try:
     print(f"🔑 API Key Length: {len(api_key)}")
     print("🔄 Initializing TA Agent...")
     
-    ta_system = TeachingAssistant(materials_folder="course_materials", session_id="web_session")
+    # One knowledge base + API client per process, shared by all conversations
+    ta_registry = SessionRegistry(
+        materials_folder="course_materials",
+        max_sessions=int(os.getenv("TA_MAX_SESSIONS", "256")),
+        idle_timeout=float(os.getenv("TA_SESSION_IDLE_SECONDS", "1800")),
+    )
+    ta_registry.warm_up()
     TA_AGENT_AVAILABLE = True
     print("✅ TA Agent system initialized successfully")
 except Exception as e:
     print(f"❌ TA Agent system initialization failed: {e}")
     TA_AGENT_AVAILABLE = False
-    ta_system = None
+    ta_registry = None
+
+# Token usage per session / agent / route, shared with the DeepSeek clients (see usage_ledger.py)
+usage_ledger = default_usage_ledger()
+
+# Prometheus metrics (GET /metrics): request counters / latency here, TA component stats at scrape time
+service_metrics = default_service_metrics()
+if ta_registry is not None:
+    service_metrics.attach(ta_registry)
 
 # Initialize conversation history
 def init_conversations():
-    if not os.path.exists(CONVERSATIONS_FILE):
-        initial_conversations = {
-            'current': {
-                'title': 'Current Conversation',
-                'messages': []
-            }
-        }
-        with open(CONVERSATIONS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(initial_conversations, f, ensure_ascii=False, indent=2)
+    """Create the conversation database (importing an old conversations.json once)"""
+    conversation_store.init()
+
+def client_id(headers):
+    """The X-Client-Id of a request (ValueError if missing or malformed)"""
+    value = headers.get(CLIENT_ID_HEADER)
+    if not value:
+        raise ValueError(f"Missing {CLIENT_ID_HEADER}")
+    if not CLIENT_ID_RE.match(value):
+        raise ValueError(f"Invalid {CLIENT_ID_HEADER}")
+    return value
+
+def web_session_id(conversation_id):
+    """TeachingAssistant session of a web conversation (its own history file and registry slot)"""
+    return f"web_{conversation_id}"
+
+def create_conversation(data, owner):
+    """Create a conversation with a fresh id; returns its summary"""
+    data = data if isinstance(data, dict) else {}
+    title = str(data.get('title') or 'New Conversation')[:MAX_TITLE_LENGTH]
+    conv_id = new_conversation_id()
+    conversation_store.create(conv_id, title, owner=owner)
+    print(f"💬 New conversation {conv_id} (client {owner})")
+    return conversation_store.summary(conv_id)
 
-# Load conversation history
-def load_conversations():
-    if not os.path.exists(CONVERSATIONS_FILE):
-        init_conversations()
-    with open(CONVERSATIONS_FILE, 'r', encoding='utf-8') as f:
-        return json.load(f)
+def conversations_page(args, owner):
+    """Payload of GET /api/conversations for the query args (ValueError on bad parameters)"""
+    limit = page_limit(args.get('limit'), CONVERSATION_PAGE_SIZE, MAX_PAGE_SIZE)
+    conversations, next_cursor, sync = conversation_store.summaries(
+        limit, cursor=args.get('cursor') or None, since=optional_float(args.get('since')), owner=owner
+    )
+    return {'conversations': conversations, 'next_cursor': next_cursor, 'sync': sync}
 
-# Save conversation history
-def save_conversations(conversations):
-    with open(CONVERSATIONS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(conversations, f, ensure_ascii=False, indent=2)
+def messages_page(conv_id, args):
+    """Payload of GET /api/conversations/<id>/messages, None if the conversation does not exist"""
+    limit = page_limit(args.get('limit'), MESSAGE_PAGE_SIZE, MAX_PAGE_SIZE)
+    return conversation_store.messages_page(
+        conv_id, limit, after=optional_int(args.get('after')), before=optional_int(args.get('before'))
+    )
+
+def conversations_etag(query_string, owner, conv_id=None):
+    """ETag of a read of owner's conversations (None if conv_id is not theirs); changes with every write"""
+    version = conversation_store.version(conv_id, owner=owner)
+    if version is None:
+        return None
+    return etag_for(conv_id, version, query_string, owner)
 
 # Get AI response using TA Agent
+@track_request('message')
 def get_ai_response_ta_agent(message, conversation_id="current"):
     """Generate AI response using TA Agent system"""
-    if not TA_AGENT_AVAILABLE or ta_system is None:
+    if not TA_AGENT_AVAILABLE or ta_registry is None:
         print("⚠️ Using fallback response system")
         return get_ai_response_fallback(message)
     
     try:
         print(f"🤖 Processing message with TA Agent: {message[:50]}...")
         
-        # Create separate TA instance for each conversation to maintain context
-        session_id = f"web_{conversation_id}"
-        ta = TeachingAssistant(materials_folder="course_materials", session_id=session_id)
-        
-        # Process user message
-        result = ta.handle_question(message)
+        # Each conversation gets its own lightweight session (history only),
+        # backed by the shared knowledge base and client
+        session_id = web_session_id(conversation_id)
+        with ta_registry.session(session_id) as ta:
+            # Process user message
+            result = ta.handle_question(message)
         print(f"📊 Router decision: {result['router']}")
+        note_route(result['router'])
         
         if result.get('ai_answer'):
             return result['ai_answer']
@@ -91,79 +153,266 @@ def get_ai_response_ta_agent(message, conversation_id="current"):
         traceback.print_exc()
         return get_ai_response_fallback(message)
 
+# Stream AI response using TA Agent
+@track_request('stream')
+def stream_ai_response_ta_agent(message, conversation_id="current"):
+    """
+    Streaming variant of get_ai_response_ta_agent. Yields TeachingAssistant.handle_question_stream
+    events ("router", "delta", "done"); the answer text only arrives as "delta" events.
+    """
+    if not TA_AGENT_AVAILABLE or ta_registry is None:
+        print("⚠️ Using fallback response system")
+        yield {'type': 'delta', 'content': get_ai_response_fallback(message)}
+        yield {'type': 'done', 'result': None, 'ttft': None}
+        return
+
+    streamed = False
+    try:
+        print(f"🤖 Streaming message with TA Agent: {message[:50]}...")
+        session_id = web_session_id(conversation_id)
+        with ta_registry.session(session_id) as ta:
+            for event in ta.handle_question_stream(message):
+                if event['type'] == 'delta':
+                    streamed = True
+                elif event['type'] == 'done':
+                    result = event['result']
+                    print(f"📊 Router decision: {result['router']}")
+                    note_route(result['router'], event['ttft'])
+                    if event['ttft'] is not None:
+                        print(f"⏱️  Time to first token: {event['ttft']:.2f}s")
+                    if not result.get('ai_answer'):
+                        streamed = True
+                        yield {'type': 'delta', 'content': result.get('message', 'AI Teaching Assistant is thinking...')}
+                yield event
+    except Exception as e:
+        print(f"❌ TA Agent processing error: {e}")
+        import traceback
+        traceback.print_exc()
+        if not streamed:
+            yield {'type': 'delta', 'content': get_ai_response_fallback(message)}
+        else:
+            note_error()
+            yield {'type': 'error', 'message': 'The answer was interrupted, please try again.'}
+        yield {'type': 'done', 'result': None, 'ttft': None}
+
 # Fallback response function
 def get_ai_response_fallback(message):
     """Fallback response when TA Agent is unavailable"""
+    record_fallback()
     return f"I am the AI Teaching Assistant for Data Structures and Algorithms. You asked: {message}\n\nThe TA Agent system is currently initializing, please try again later."
 
+@app.after_request
+def compress_response(response):
+    """Compress JSON / HTML responses per Accept-Encoding (SSE streams are left alone)"""
+    if response.is_streamed or response.direct_passthrough or response.status_code in (204, 304) \
+            or 'Content-Encoding' in response.headers:
+        return response
+    body, encoding = compress_body(response.get_data(), response.content_type, request.headers.get('Accept-Encoding'))
+    if encoding:
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+    return response
+
+def conditional_json(etag, payload):
+    """304 if the client's If-None-Match already names etag, else payload() as JSON"""
+    if etag_matches(request.headers.get('If-None-Match'), etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(payload())
+    response.headers['ETag'] = etag
+    return response
+
 # API endpoints
 @app.route('/api/conversations', methods=['GET'])
 def get_conversations():
-    """Get all conversations"""
-    conversations = load_conversations()
-    return jsonify(conversations)
+    """
+    List conversations, most recently updated first: {"conversations": [{"id", "title", "created",
+    "updated", "message_count"}], "next_cursor", "sync"} of the X-Client-Id client's conversations.
+    ?limit=, ?cursor=<next_cursor> pages; ?since=<sync> returns only conversations changed since
+    that response. Messages are fetched per conversation (GET /api/conversations/<id>/messages).
+    """
+    try:
+        owner = client_id(request.headers)
+        etag = conversations_etag(request.query_string, owner)
+        return conditional_json(etag, lambda: conversations_page(request.args, owner))
+    except ValueError:
+        return jsonify({'error': 'Invalid limit, cursor, since or client id'}), 400
+
+@app.route('/api/conversations', methods=['POST'])
+def post_conversation():
+    """Create a conversation ({"title"} optional), owned by the X-Client-Id client"""
+    try:
+        owner = client_id(request.headers)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(create_conversation(request.get_json(silent=True), owner)), 201
 
 @app.route('/api/conversations/<conv_id>', methods=['GET'])
 def get_conversation(conv_id):
-    """Get specific conversation"""
-    conversations = load_conversations()
-    if conv_id in conversations:
-        return jsonify(conversations[conv_id])
+    """Get specific conversation (404 unless it belongs to the X-Client-Id client)"""
+    try:
+        owner = client_id(request.headers)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    etag = conversations_etag(request.query_string, owner, conv_id)
+    conversation = conversation_store.get(conv_id) if etag is not None else None
+    if conversation is not None:
+        return conditional_json(etag, lambda: conversation)
     else:
         return jsonify({'error': 'Conversation not found'}), 404
 
+@app.route('/api/conversations/<conv_id>/messages', methods=['GET'])
+def get_messages(conv_id):
+    """
+    One page of a conversation's messages, oldest first: {"id", "title", "updated", "messages":
+    [{"id", "sender", "content", "created"}], "next_cursor"}. Without a cursor the latest ?limit=
+    messages; ?before=<next_cursor> pages back; ?after=<last message id> fetches only newer ones.
+    404 unless the conversation belongs to the X-Client-Id client.
+    """
+    try:
+        owner = client_id(request.headers)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    etag = conversations_etag(request.query_string, owner, conv_id)
+    if etag is None:
+        return jsonify({'error': 'Conversation not found'}), 404
+    try:
+        return conditional_json(etag, lambda: messages_page(conv_id, request.args))
+    except ValueError:
+        return jsonify({'error': 'Invalid limit, after or before'}), 400
+
+@app.route('/api/conversations/<conv_id>/usage', methods=['GET'])
+def get_conversation_usage(conv_id):
+    """Token usage of a conversation's session: totals, by day / agent / route, and its quota"""
+    try:
+        owner = client_id(request.headers)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not conversation_store.exists(conv_id, owner):
+        return jsonify({'error': 'Conversation not found'}), 404
+    return jsonify(usage_ledger.session_usage(web_session_id(conv_id)))
+
+@app.route('/api/usage', methods=['GET'])
+def get_usage():
+    """Token usage per day, or for ?day=YYYY-MM-DD (UTC) per session / agent / route"""
+    day = request.args.get('day') or None
+    if day is not None and not DAY_RE.match(day):
+        return jsonify({'error': 'Invalid day, expected YYYY-MM-DD'}), 400
+    return jsonify(usage_ledger.daily_usage(day))
+
 @app.route('/api/conversations/<conv_id>/messages', methods=['POST'])
+@traced("add_message")
 def add_message(conv_id):
     """Add message to conversation"""
+    annotate(conversation_id=conv_id)
+    try:
+        owner = client_id(request.headers)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     data = request.get_json()
     if not data or 'content' not in data:
         return jsonify({'error': 'Message content is required'}), 400
     
-    conversations = load_conversations()
-    if conv_id not in conversations:
+    if not conversation_store.exists(conv_id, owner):
         return jsonify({'error': 'Conversation not found'}), 404
     
     user_message_content = data['content']
     print(f"👤 User message: {user_message_content}")
     
-    # Add user message
-    user_message = {
-        'sender': 'user',
-        'content': user_message_content
-    }
-    conversations[conv_id]['messages'].append(user_message)
-    
-    # Update conversation title (if it's a new conversation)
-    if conversations[conv_id]['title'] in ['New Conversation', 'Current Conversation'] and user_message_content:
-        conversations[conv_id]['title'] = user_message_content[:20] + '...' if len(user_message_content) > 20 else user_message_content
-    
     # Generate AI response - using TA Agent system
     print("🔄 Generating AI response...")
     ai_response_content = get_ai_response_ta_agent(user_message_content, conv_id)
     print(f"🤖 AI Response: {ai_response_content[:100]}...")
     
-    ai_response = {
-        'sender': 'ai',
-        'content': ai_response_content
-    }
-    conversations[conv_id]['messages'].append(ai_response)
-    
-    # Save conversation
-    save_conversations(conversations)
+    # Save the exchange (only this conversation's rows are written)
+    user_message, ai_response = conversation_store.append_exchange(conv_id, user_message_content, ai_response_content)
+    if user_message is None:
+        return jsonify({'error': 'Conversation not found'}), 404
     
     return jsonify({
         'user_message': user_message,
         'ai_response': ai_response
     })
 
+@app.route('/api/conversations/<conv_id>/messages/stream', methods=['POST'])
+def add_message_stream(conv_id):
+    """Add message to conversation, streaming the AI response as Server-Sent Events"""
+    try:
+        owner = client_id(request.headers)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    data = request.get_json()
+    if not data or 'content' not in data:
+        return jsonify({'error': 'Message content is required'}), 400
+    
+    if not conversation_store.exists(conv_id, owner):
+        return jsonify({'error': 'Conversation not found'}), 404
+    
+    user_message_content = data['content']
+    print(f"👤 User message (stream): {user_message_content}")
+    user_message = {
+        'sender': 'user',
+        'content': user_message_content
+    }
+
+    def sse(event, payload):
+        return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+    @traced("add_message", stream=True)
+    def generate():
+        annotate(conversation_id=conv_id)
+        yield sse('user_message', user_message)
+        parts = []
+        ttft = None
+        for event in stream_ai_response_ta_agent(user_message_content, conv_id):
+            if event['type'] == 'delta':
+                parts.append(event['content'])
+                yield sse('delta', {'content': event['content']})
+            elif event['type'] == 'router':
+                yield sse('router', event['router'])
+            elif event['type'] == 'error':
+                yield sse('error', {'message': event['message']})
+            elif event['type'] == 'done':
+                ttft = event['ttft']
+
+        _, ai_response = conversation_store.append_exchange(conv_id, user_message_content, ''.join(parts))
+        yield sse('done', {'ai_response': ai_response, 'ttft': ttft})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check"""
     return jsonify({
         'status': 'healthy', 
-        'ta_agent': 'available' if TA_AGENT_AVAILABLE else 'unavailable'
+        'ta_agent': 'available' if TA_AGENT_AVAILABLE else 'unavailable',
+        'sessions': ta_registry.stats() if ta_registry is not None else None,
+        'router': ta_registry.fast_router.stats() if ta_registry is not None else None,
+        'router_cache': ta_registry.router_cache.stats() if ta_registry is not None and ta_registry.router_cache is not None else None,
+        'answer_cache': ta_registry.answer_cache.stats() if ta_registry is not None and ta_registry.answer_cache is not None else None,
+        'speculation': ta_registry.speculation_stats.stats() if ta_registry is not None else None,
+        'history': ta_registry.history_persister.stats() if ta_registry is not None else None,
+        'llm_resilience': ta_registry.client.resilience_stats() if ta_registry is not None else None,
+        'llm_usage': ta_registry.client.usage_stats() if ta_registry is not None else None,
+        'llm_config': ta_registry.client.config.to_dict() if ta_registry is not None else None,
+        'usage_ledger': usage_ledger.stats()
     })
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics (text exposition format)"""
+    return Response(service_metrics.render(), content_type=CONTENT_TYPE)
+
+@app.route('/api/traces/summary', methods=['GET'])
+def traces_summary():
+    """Latency percentiles (p50 / p95 / p99) per request stage, from the trace spans"""
+    return jsonify(default_tracer().summary())
+
 @app.route('/')
 def index():
     """Serve frontend page"""
@@ -826,6 +1075,9 @@ def index():
             const sendBtn = document.getElementById('sendBtn');
             const statusText = document.getElementById('statusText');
             const statusDot = document.getElementById('statusDot');
+            const historyList = document.querySelector('.history-list');
+            const emptyHistoryHtml = historyList.innerHTML;
+            const greetingHtml = chatMessages.innerHTML;
             
             // Configure marked options
             marked.setOptions({
@@ -850,6 +1102,91 @@ def index():
 
             // Status variables
             let isThinking = false;
+
+            // Conversations: this browser's client id, the open conversation (created on the
+            // first message) and the sidebar list, kept up to date with ?since= deltas
+            const clientId = localStorage.getItem('ta_client_id') ||
+                (crypto.randomUUID ? crypto.randomUUID() : String(Date.now()) + '-' + Math.random().toString(36).slice(2));
+            localStorage.setItem('ta_client_id', clientId);
+            let currentConversationId = localStorage.getItem('ta_conversation_id');
+            let conversations = {};
+            let syncToken = null;
+
+            function apiFetch(url, options) {
+                options = options || {};
+                options.headers = Object.assign({ 'X-Client-Id': clientId }, options.headers || {});
+                return fetch(url, options);
+            }
+
+            // Fetch the conversation list (only what changed since the last fetch) and redraw it
+            async function loadConversations() {
+                let url = '/api/conversations?limit=100';
+                if (syncToken !== null) url += '&since=' + syncToken;
+                const response = await apiFetch(url);
+                if (!response.ok) throw new Error('HTTP error: ' + response.status);
+                const data = await response.json();
+                data.conversations.forEach(conv => { conversations[conv.id] = conv; });
+                syncToken = data.sync;
+                renderConversationList();
+            }
+
+            function renderConversationList() {
+                const items = Object.values(conversations).sort((a, b) => b.updated - a.updated);
+                if (!items.length) {
+                    historyList.innerHTML = emptyHistoryHtml;
+                    return;
+                }
+                historyList.innerHTML = '';
+                items.forEach(conv => {
+                    const item = document.createElement('div');
+                    item.className = 'history-item' + (conv.id === currentConversationId ? ' active' : '');
+                    item.textContent = conv.title;
+                    item.title = conv.message_count + ' messages';
+                    item.addEventListener('click', () => openConversation(conv.id));
+                    historyList.appendChild(item);
+                });
+            }
+
+            // Show a conversation: its latest messages, oldest first
+            async function openConversation(convId) {
+                if (isThinking || sendBtn.disabled) return;
+                const response = await apiFetch('/api/conversations/' + encodeURIComponent(convId) + '/messages?limit=100');
+                if (!response.ok) {
+                    debug('Failed to open conversation ' + convId + ': ' + response.status);
+                    if (response.status === 404) startNewConversation();
+                    return;
+                }
+                const data = await response.json();
+                currentConversationId = convId;
+                localStorage.setItem('ta_conversation_id', convId);
+                chatMessages.innerHTML = greetingHtml;
+                data.messages.forEach(m => addMessage(m.content, m.sender === 'user' ? 'user' : 'ai'));
+                renderConversationList();
+            }
+
+            // Back to the greeting; the conversation itself is created with the first message
+            function startNewConversation() {
+                currentConversationId = null;
+                localStorage.removeItem('ta_conversation_id');
+                chatMessages.innerHTML = greetingHtml;
+                renderConversationList();
+            }
+
+            async function ensureConversation() {
+                if (currentConversationId) return currentConversationId;
+                const response = await apiFetch('/api/conversations', {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({})
+                });
+                if (!response.ok) throw new Error('HTTP error: ' + response.status);
+                const conv = await response.json();
+                conversations[conv.id] = conv;
+                currentConversationId = conv.id;
+                localStorage.setItem('ta_conversation_id', conv.id);
+                renderConversationList();
+                return conv.id;
+            }
             
             // Check system status
             function checkSystemStatus() {
@@ -902,26 +1239,10 @@ def index():
                 // Show thinking state
                 showThinking();
                 
-                // Send to backend
-                fetch('/api/conversations/current/messages', {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json'
-                    },
-                    body: JSON.stringify({ content: message })
-                })
-                .then(response => {
-                    debug('Received response, status: ' + response.status);
-                    if (!response.ok) {
-                        throw new Error('HTTP error: ' + response.status);
-                    }
-                    return response.json();
-                })
-                .then(data => {
-                    debug('Successfully obtained AI response');
-                    removeThinking();
-                    addMessage(data.ai_response.content, 'ai');
-                })
+                // Send to backend, streaming the answer as Server-Sent Events
+                ensureConversation()
+                .then(convId => streamResponse('/api/conversations/' + encodeURIComponent(convId) + '/messages/stream', message))
+                .then(() => loadConversations())
                 .catch(error => {
                     debug('Failed to send message: ' + error);
                     removeThinking();
@@ -933,6 +1254,81 @@ def index():
                 });
             }
             
+            // POST a message and render the SSE response token by token
+            async function streamResponse(url, message) {
+                const response = await apiFetch(url, {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json',
+                        'Accept': 'text/event-stream'
+                    },
+                    body: JSON.stringify({ content: message })
+                });
+                debug('Received response, status: ' + response.status);
+                if (!response.ok) {
+                    throw new Error('HTTP error: ' + response.status);
+                }
+                
+                const reader = response.body.getReader();
+                const decoder = new TextDecoder();
+                let buffer = '';
+                let answer = '';
+                let contentDiv = null;
+                let renderPending = false;
+                const startTime = performance.now();
+                
+                function render() {
+                    renderPending = false;
+                    contentDiv.innerHTML = renderMarkdown(answer);
+                    chatMessages.scrollTop = chatMessages.scrollHeight;
+                }
+                
+                function handleEvent(event, data) {
+                    if (event === 'delta') {
+                        if (!contentDiv) {
+                            debug('Time to first token: ' + Math.round(performance.now() - startTime) + 'ms');
+                            removeThinking();
+                            contentDiv = addMessage('', 'ai');
+                        }
+                        answer += data.content;
+                        // Re-render at most once per frame
+                        if (!renderPending) {
+                            renderPending = true;
+                            requestAnimationFrame(render);
+                        }
+                    } else if (event === 'error') {
+                        answer += '\\n\\n*' + data.message + '*';
+                    } else if (event === 'done') {
+                        debug('Successfully obtained AI response');
+                    }
+                }
+                
+                while (true) {
+                    const { done, value } = await reader.read();
+                    if (done) break;
+                    buffer += decoder.decode(value, { stream: true });
+                    let sep;
+                    while ((sep = buffer.indexOf('\\n\\n')) !== -1) {
+                        const frame = buffer.slice(0, sep);
+                        buffer = buffer.slice(sep + 2);
+                        let event = 'message';
+                        let data = '';
+                        frame.split('\\n').forEach(line => {
+                            if (line.startsWith('event: ')) event = line.slice(7);
+                            else if (line.startsWith('data: ')) data += line.slice(6);
+                        });
+                        if (data) handleEvent(event, JSON.parse(data));
+                    }
+                }
+                
+                if (!contentDiv) {
+                    removeThinking();
+                    contentDiv = addMessage(answer, 'ai');
+                } else {
+                    render();
+                }
+            }
+            
             // Add message to chat area
             function addMessage(message, sender) {
                 debug('Adding message: ' + sender + ' - ' + message.substring(0, 50));
@@ -970,6 +1366,7 @@ def index():
                 
                 // Scroll to bottom
                 chatMessages.scrollTop = chatMessages.scrollHeight;
+                return bubble.firstChild;
             }
             
             // Show thinking state
@@ -1038,20 +1435,9 @@ def index():
                 
                 // New conversation button
                 document.querySelector('.new-chat-btn').addEventListener('click', function() {
+                    if (isThinking || sendBtn.disabled) return;
                     if (confirm('Are you sure you want to start a new conversation? The current conversation will be saved to history.')) {
-                        // Add logic to start new conversation here
-                        chatMessages.innerHTML = `
-                            <div class="message ai-message">
-                                <div class="message-avatar ai-avatar">
-                                    <i class="fas fa-robot"></i>
-                                </div>
-                                <div class="message-bubble ai-bubble">
-                                    <div class="markdown-content">
-                                        Hello! I'm the AI Teaching Assistant for the Data Structures and Algorithms course. I can help you with course-related questions. How can I assist you today?
-                                    </div>
-                                </div>
-                            </div>
-                        `;
+                        startNewConversation();
                     }
                 });
             }
@@ -1061,6 +1447,11 @@ def index():
                 debug('Initializing application');
                 setupEventListeners();
                 checkSystemStatus();
+                loadConversations()
+                    .then(() => {
+                        if (currentConversationId) openConversation(currentConversationId);
+                    })
+                    .catch(error => debug('Failed to load conversations: ' + error));
                 messageInput.focus();
                 debug('Initialization complete');
             }
@@ -0,0 +1,382 @@
+"""
+Async (ASGI) serving mode for the AI Teaching Assistant.
+
+Serves the same page and API as app.py, but the message endpoints await the router and
+agent calls on the AsyncDeepSeekClient instead of blocking a worker thread for the whole
+LLM round trip, so one process can hold hundreds of in-flight questions. Conversation store
+(SQLite) reads and writes run in Starlette's threadpool so they do not stall the event loop.
+
+Run with:
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+
+The knowledge base and the sync client are shared with app.py's registry; the conversation
+store and the HTML page are reused from app.py unchanged.
+"""
+
+import json
+import os
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+import app as flask_app
+from app import (
+    DAY_RE,
+    client_id,
+    conversation_store,
+    conversations_etag,
+    conversations_page,
+    create_conversation,
+    get_ai_response_fallback,
+    init_conversations,
+    messages_page,
+    usage_ledger,
+    web_session_id,
+)
+from deepseek_client import close_async_http_client
+from http_utils import compress_body, etag_matches
+from metrics import MEDIA_TYPE, default_service_metrics, note_error, note_route, track_request
+from session_registry import SessionRegistry
+from tracing import annotate, default_tracer, traced
+
+if flask_app.ta_registry is not None:
+    # Same knowledge base and sync client as app.py, plus the process-wide AsyncDeepSeekClient
+    ta_registry = SessionRegistry(
+        materials_folder="course_materials",
+        max_sessions=int(os.getenv("TA_MAX_SESSIONS", "256")),
+        idle_timeout=float(os.getenv("TA_SESSION_IDLE_SECONDS", "1800")),
+        client=flask_app.ta_registry.client,
+        kb=flask_app.ta_registry.kb,
+        use_async=True,
+    )
+    ta_registry.warm_up()
+    TA_AGENT_AVAILABLE = True
+    # /metrics reports this registry's clients (incl. the async one) instead of app.py's
+    default_service_metrics().attach(ta_registry)
+    print("✅ Async TA Agent system initialized successfully")
+else:
+    ta_registry = None
+    TA_AGENT_AVAILABLE = False
+
+
+# Get AI response using TA Agent (async)
+@track_request('message')
+async def get_ai_response_ta_agent(message, conversation_id="current"):
+    """Async variant of app.get_ai_response_ta_agent"""
+    if not TA_AGENT_AVAILABLE or ta_registry is None:
+        print("⚠️ Using fallback response system")
+        return get_ai_response_fallback(message)
+
+    try:
+        print(f"🤖 Processing message with TA Agent: {message[:50]}...")
+        async with ta_registry.session_async(web_session_id(conversation_id)) as ta:
+            result = await ta.handle_question_async(message)
+        print(f"📊 Router decision: {result['router']}")
+        note_route(result['router'])
+
+        if result.get('ai_answer'):
+            return result['ai_answer']
+        else:
+            return f"{result.get('message', 'AI Teaching Assistant is thinking...')}"
+
+    except Exception as e:
+        print(f"❌ TA Agent processing error: {e}")
+        import traceback
+        traceback.print_exc()
+        return get_ai_response_fallback(message)
+
+
+# Stream AI response using TA Agent (async)
+@track_request('stream')
+async def stream_ai_response_ta_agent(message, conversation_id="current"):
+    """Async variant of app.stream_ai_response_ta_agent (same events)"""
+    if not TA_AGENT_AVAILABLE or ta_registry is None:
+        print("⚠️ Using fallback response system")
+        yield {'type': 'delta', 'content': get_ai_response_fallback(message)}
+        yield {'type': 'done', 'result': None, 'ttft': None}
+        return
+
+    streamed = False
+    try:
+        print(f"🤖 Streaming message with TA Agent: {message[:50]}...")
+        async with ta_registry.session_async(web_session_id(conversation_id)) as ta:
+            async for event in ta.handle_question_stream_async(message):
+                if event['type'] == 'delta':
+                    streamed = True
+                elif event['type'] == 'done':
+                    result = event['result']
+                    print(f"📊 Router decision: {result['router']}")
+                    note_route(result['router'], event['ttft'])
+                    if event['ttft'] is not None:
+                        print(f"⏱️  Time to first token: {event['ttft']:.2f}s")
+                    if not result.get('ai_answer'):
+                        streamed = True
+                        yield {'type': 'delta', 'content': result.get('message', 'AI Teaching Assistant is thinking...')}
+                yield event
+    except Exception as e:
+        print(f"❌ TA Agent processing error: {e}")
+        import traceback
+        traceback.print_exc()
+        if not streamed:
+            yield {'type': 'delta', 'content': get_ai_response_fallback(message)}
+        else:
+            note_error()
+            yield {'type': 'error', 'message': 'The answer was interrupted, please try again.'}
+        yield {'type': 'done', 'result': None, 'ttft': None}
+
+
+async def read_message_content(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not isinstance(data, dict) or 'content' not in data:
+        return None
+    return data['content']
+
+
+def compressed(request: Request, response: Response) -> Response:
+    """Compress a JSON / HTML response per Accept-Encoding (app.compress_response)"""
+    body, encoding = compress_body(response.body, response.media_type, request.headers.get('accept-encoding'))
+    if encoding:
+        response.body = body
+        response.headers['content-length'] = str(len(body))
+        response.headers['content-encoding'] = encoding
+        response.headers['vary'] = 'Accept-Encoding'
+    return response
+
+
+async def conditional_json(request: Request, etag, payload):
+    """304 if the client's If-None-Match already names etag, else payload() (run in the threadpool) as JSON"""
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers={'ETag': etag})
+    return compressed(request, JSONResponse(await run_in_threadpool(payload), headers={'ETag': etag}))
+
+
+# API endpoints
+async def get_conversations(request: Request):
+    """List conversations (same pagination / since / ETag parameters as app.get_conversations)"""
+    try:
+        owner = client_id(request.headers)
+        etag = await run_in_threadpool(conversations_etag, request.url.query.encode(), owner)
+        return await conditional_json(request, etag, lambda: conversations_page(request.query_params, owner))
+    except ValueError:
+        return JSONResponse({'error': 'Invalid limit, cursor, since or client id'}, status_code=400)
+
+
+async def post_conversation(request: Request):
+    """Create a conversation ({"title"} optional), owned by the X-Client-Id client"""
+    try:
+        owner = client_id(request.headers)
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    conversation = await run_in_threadpool(create_conversation, data if isinstance(data, dict) else None, owner)
+    return JSONResponse(conversation, status_code=201)
+
+
+async def get_conversation(request: Request):
+    """Get specific conversation (404 unless it belongs to the X-Client-Id client)"""
+    conv_id = request.path_params['conv_id']
+    try:
+        owner = client_id(request.headers)
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+    etag = await run_in_threadpool(conversations_etag, request.url.query.encode(), owner, conv_id)
+    if etag is not None and etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers={'ETag': etag})
+    conversation = await run_in_threadpool(conversation_store.get, conv_id) if etag is not None else None
+    if conversation is not None:
+        return compressed(request, JSONResponse(conversation, headers={'ETag': etag}))
+    else:
+        return JSONResponse({'error': 'Conversation not found'}, status_code=404)
+
+
+async def get_messages(request: Request):
+    """One page of a conversation's messages (see app.get_messages)"""
+    conv_id = request.path_params['conv_id']
+    try:
+        owner = client_id(request.headers)
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+    etag = await run_in_threadpool(conversations_etag, request.url.query.encode(), owner, conv_id)
+    if etag is None:
+        return JSONResponse({'error': 'Conversation not found'}, status_code=404)
+    try:
+        return await conditional_json(request, etag, lambda: messages_page(conv_id, request.query_params))
+    except ValueError:
+        return JSONResponse({'error': 'Invalid limit, after or before'}, status_code=400)
+
+
+async def get_conversation_usage(request: Request):
+    """Token usage of a conversation's session (see app.get_conversation_usage)"""
+    conv_id = request.path_params['conv_id']
+    try:
+        owner = client_id(request.headers)
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+    if not await run_in_threadpool(conversation_store.exists, conv_id, owner):
+        return JSONResponse({'error': 'Conversation not found'}, status_code=404)
+    return JSONResponse(usage_ledger.session_usage(web_session_id(conv_id)))
+
+
+async def get_usage(request: Request):
+    """Token usage per day, or for ?day=YYYY-MM-DD per session / agent / route"""
+    day = request.query_params.get('day') or None
+    if day is not None and not DAY_RE.match(day):
+        return JSONResponse({'error': 'Invalid day, expected YYYY-MM-DD'}, status_code=400)
+    return JSONResponse(usage_ledger.daily_usage(day))
+
+
+@traced("add_message")
+async def add_message(request: Request):
+    """Add message to conversation"""
+    conv_id = request.path_params['conv_id']
+    annotate(conversation_id=conv_id)
+    try:
+        owner = client_id(request.headers)
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+    user_message_content = await read_message_content(request)
+    if user_message_content is None:
+        return JSONResponse({'error': 'Message content is required'}, status_code=400)
+    if not await run_in_threadpool(conversation_store.exists, conv_id, owner):
+        return JSONResponse({'error': 'Conversation not found'}, status_code=404)
+
+    print(f"👤 User message: {user_message_content}")
+    print("🔄 Generating AI response...")
+    ai_response_content = await get_ai_response_ta_agent(user_message_content, conv_id)
+    print(f"🤖 AI Response: {ai_response_content[:100]}...")
+
+    user_message, ai_response = await run_in_threadpool(
+        conversation_store.append_exchange, conv_id, user_message_content, ai_response_content
+    )
+    if user_message is None:
+        return JSONResponse({'error': 'Conversation not found'}, status_code=404)
+    return JSONResponse({
+        'user_message': user_message,
+        'ai_response': ai_response
+    })
+
+
+async def add_message_stream(request: Request):
+    """Add message to conversation, streaming the AI response as Server-Sent Events"""
+    conv_id = request.path_params['conv_id']
+    try:
+        owner = client_id(request.headers)
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+    user_message_content = await read_message_content(request)
+    if user_message_content is None:
+        return JSONResponse({'error': 'Message content is required'}, status_code=400)
+    if not await run_in_threadpool(conversation_store.exists, conv_id, owner):
+        return JSONResponse({'error': 'Conversation not found'}, status_code=404)
+
+    print(f"👤 User message (stream): {user_message_content}")
+
+    def sse(event, payload):
+        return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+    @traced("add_message", stream=True)
+    async def generate():
+        annotate(conversation_id=conv_id)
+        yield sse('user_message', {'sender': 'user', 'content': user_message_content})
+        parts = []
+        ttft = None
+        async for event in stream_ai_response_ta_agent(user_message_content, conv_id):
+            if event['type'] == 'delta':
+                parts.append(event['content'])
+                yield sse('delta', {'content': event['content']})
+            elif event['type'] == 'router':
+                yield sse('router', event['router'])
+            elif event['type'] == 'error':
+                yield sse('error', {'message': event['message']})
+            elif event['type'] == 'done':
+                ttft = event['ttft']
+
+        _, ai_response = await run_in_threadpool(
+            conversation_store.append_exchange, conv_id, user_message_content, ''.join(parts)
+        )
+        yield sse('done', {'ai_response': ai_response, 'ttft': ttft})
+
+    return StreamingResponse(
+        generate(),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+async def health_check(request: Request):
+    """Health check"""
+    return JSONResponse({
+        'status': 'healthy',
+        'ta_agent': 'available' if TA_AGENT_AVAILABLE else 'unavailable',
+        'serving': 'asgi',
+        'sessions': ta_registry.stats() if ta_registry is not None else None,
+        'router': ta_registry.fast_router.stats() if ta_registry is not None else None,
+        'router_cache': ta_registry.router_cache.stats() if ta_registry is not None and ta_registry.router_cache is not None else None,
+        'answer_cache': ta_registry.answer_cache.stats() if ta_registry is not None and ta_registry.answer_cache is not None else None,
+        'speculation': ta_registry.speculation_stats.stats() if ta_registry is not None else None,
+        'history': ta_registry.history_persister.stats() if ta_registry is not None else None,
+        'llm_resilience': ta_registry.async_client.resilience_stats() if ta_registry is not None else None,
+        'llm_usage': ta_registry.async_client.usage_stats() if ta_registry is not None else None,
+        'llm_config': ta_registry.async_client.config.to_dict() if ta_registry is not None else None,
+        'usage_ledger': usage_ledger.stats()
+    })
+
+
+async def metrics(request: Request):
+    """Prometheus metrics (text exposition format)"""
+    # Starlette appends the charset to text/* media types itself
+    return compressed(request, Response(default_service_metrics().render(), media_type=MEDIA_TYPE))
+
+
+async def traces_summary(request: Request):
+    """Latency percentiles (p50 / p95 / p99) per request stage, from the trace spans"""
+    return JSONResponse(default_tracer().summary())
+
+
+async def index(request: Request):
+    """Serve frontend page"""
+    return compressed(request, HTMLResponse(flask_app.index()))
+
+
+app = Starlette(
+    routes=[
+        Route('/', index),
+        Route('/api/conversations', get_conversations, methods=['GET']),
+        Route('/api/conversations', post_conversation, methods=['POST']),
+        Route('/api/conversations/{conv_id}', get_conversation, methods=['GET']),
+        Route('/api/conversations/{conv_id}/messages', get_messages, methods=['GET']),
+        Route('/api/conversations/{conv_id}/messages', add_message, methods=['POST']),
+        Route('/api/conversations/{conv_id}/messages/stream', add_message_stream, methods=['POST']),
+        Route('/api/conversations/{conv_id}/usage', get_conversation_usage, methods=['GET']),
+        Route('/api/usage', get_usage, methods=['GET']),
+        Route('/api/health', health_check, methods=['GET']),
+        Route('/metrics', metrics, methods=['GET']),
+        Route('/api/traces/summary', traces_summary, methods=['GET']),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+    on_startup=[init_conversations],
+    on_shutdown=[close_async_http_client],
+)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    init_conversations()
+    print("=" * 60)
+    print("🚀 AI Teaching Assistant System Starting (async)...")
+    print("📚 Access URL: http://localhost:5000")
+    print("🤖 TA Agent Status:", "Available" if TA_AGENT_AVAILABLE else "Unavailable")
+    print("=" * 60)
+    uvicorn.run(app, host='0.0.0.0', port=5000)
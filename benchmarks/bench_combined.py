@@ -0,0 +1,124 @@
+"""
+Two-call pipeline (LLM router, then the routed agent) vs the single-call combined
+route + answer mode (TA_COMBINED_MODE, see ta_agents_history.CombinedAgent).
+
+    python benchmarks/bench_combined.py [--questions 30] [--materials course_materials]
+                                        [--fake-latency 1.0] [--base-url URL]
+
+Without --base-url an in-process fake LLM server (fake_llm_server.py) answers every call after
+--fake-latency seconds, so the difference is the saved round trip; token counts then come from
+the fake server's len/4 estimate. Pass --base-url https://api.deepseek.com (and DEEPSEEK_API_KEY)
+to measure the real API.
+
+The fast path, router cache, answer cache and speculation are switched off so that every
+question goes through the LLM router (two-call) or one combined call (single-call); questions
+are the first --questions of router_labels.jsonl, each asked as a first-turn question.
+Reports per mode: end-to-end latency (mean / p50 / p95), time to the first answer text, and
+LLM calls, prompt tokens and completion tokens per question.
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+for _name in ("TA_FAST_ROUTER", "TA_ROUTER_CACHE", "TA_ANSWER_CACHE", "TA_SPECULATIVE"):
+    os.environ[_name] = "off"
+
+
+def percentile(values: List[float], pct: float) -> float:
+    values = sorted(values)
+    if not values:
+        return 0.0
+    k = min(len(values) - 1, max(0, int(round(pct / 100 * len(values) + 0.5)) - 1))
+    return values[k]
+
+
+def run_mode(combined: bool, questions: List[str], client, kb) -> Dict:
+    from ta_agents_history import TeachingAssistant
+
+    ta = TeachingAssistant(session_id="bench_combined", client=client, kb=kb, combined=combined)
+    before = dict(client.usage_totals)
+    latencies, ttfts = [], []
+    for question in questions:
+        ta.conversation_history = []
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for event in ta.handle_question_stream(question):
+                if event["type"] == "done" and event["ttft"] is not None:
+                    ttfts.append(event["ttft"])
+        latencies.append(time.perf_counter() - start)
+    n = len(questions)
+    return {
+        "mode": "single-call" if combined else "two-call",
+        "mean": statistics.mean(latencies),
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "ttft_p50": percentile(ttfts, 50),
+        "calls": (client.usage_totals["calls"] - before["calls"]) / n,
+        "prompt_tokens": (client.usage_totals["prompt_tokens"] - before["prompt_tokens"]) / n,
+        "completion_tokens": (client.usage_totals["completion_tokens"] - before["completion_tokens"]) / n,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=30)
+    parser.add_argument("--materials", default=os.path.join(ROOT, "course_materials"))
+    parser.add_argument("--base-url", default="", help="OpenAI-compatible API (default: in-process fake server)")
+    parser.add_argument("--fake-latency", type=float, default=1.0, help="seconds per call of the fake server")
+    parser.add_argument("--fake-port", type=int, default=9110)
+    args = parser.parse_args()
+
+    server = None
+    if args.base_url:
+        os.environ["DEEPSEEK_BASE_URL"] = args.base_url
+    else:
+        from fake_llm_server import start_server
+
+        server = start_server(args.fake_port, latency=args.fake_latency, chunks=20, chunk_delay=0.01)
+        os.environ["DEEPSEEK_BASE_URL"] = f"http://127.0.0.1:{args.fake_port}"
+        os.environ.setdefault("DEEPSEEK_API_KEY", "fake")
+
+    from deepseek_client import DeepSeekClient
+    from fast_router import DEFAULT_LABELS_FILE, load_labeled
+    from ta_agents_history import CourseKnowledgeBase
+
+    questions = [ex["question"] for ex in load_labeled(DEFAULT_LABELS_FILE)][:args.questions]
+    materials = os.path.abspath(args.materials)
+    with contextlib.redirect_stdout(io.StringIO()):
+        kb = CourseKnowledgeBase(materials)
+        client = DeepSeekClient()
+
+    # Session history files go to a scratch directory
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as scratch:
+        os.chdir(scratch)
+        try:
+            rows = [run_mode(False, questions, client, kb), run_mode(True, questions, client, kb)]
+        finally:
+            os.chdir(cwd)
+    if server is not None:
+        server.shutdown()
+
+    print(f"{len(questions)} first-turn questions, {'fake server' if server else os.environ['DEEPSEEK_BASE_URL']}\n")
+    print(f"{'mode':>11} | {'mean':>6} | {'p50':>6} | {'p95':>6} | {'TTFT p50':>8} | {'calls/q':>7} | "
+          f"{'prompt tok/q':>12} | {'completion tok/q':>16}")
+    print("-" * 95)
+    for row in rows:
+        print(f"{row['mode']:>11} | {row['mean']:>5.2f}s | {row['p50']:>5.2f}s | {row['p95']:>5.2f}s | "
+              f"{row['ttft_p50']:>7.2f}s | {row['calls']:>7.2f} | {row['prompt_tokens']:>12.0f} | "
+              f"{row['completion_tokens']:>16.0f}")
+
+
+if __name__ == "__main__":
+    main()
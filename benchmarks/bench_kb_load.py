@@ -0,0 +1,64 @@
+"""
+Cold vs. warm knowledge base load time.
+
+    python benchmarks/bench_kb_load.py [--folder course_materials] [--repeat 3] [--workers N]
+
+cold : empty parse cache, every deck is parsed with python-pptx / PyPDF2
+warm : parse cache already populated, nothing is parsed
+none : cache disabled (the pre-cache behavior), for reference
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from kb_cache import MaterialCache  # noqa: E402
+from ta_agents_history import CourseKnowledgeBase  # noqa: E402
+
+
+def _load(folder: str, cache_dir, workers=None):
+    start = time.perf_counter()
+    # The knowledge base prints one line per file; keep the benchmark output readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        kb = CourseKnowledgeBase(folder, cache_dir=cache_dir, workers=workers)
+    return time.perf_counter() - start, kb
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--folder", default="course_materials")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=None, help="parser processes for uncached files")
+    args = parser.parse_args()
+
+    results = {"none": [], "cold": [], "warm": []}
+    with tempfile.TemporaryDirectory() as tmp:
+        cache_dir = os.path.join(tmp, "kb_cache")
+        for _ in range(args.repeat):
+            t, reference = _load(args.folder, None, args.workers)
+            results["none"].append(t)
+
+            MaterialCache(cache_dir).clear()
+            t, _ = _load(args.folder, cache_dir, args.workers)
+            results["cold"].append(t)
+
+            t, kb = _load(args.folder, cache_dir)
+            results["warm"].append(t)
+            assert kb.global_context == reference.global_context, "warm load differs from a fresh parse"
+
+    print(f"Materials: {args.folder} ({len(reference.chunks)} chunks, {len(reference.global_context)} chars)")
+    print(f"{'mode':<6} {'median (s)':>11} {'min (s)':>9}")
+    for mode, times in results.items():
+        print(f"{mode:<6} {statistics.median(times):>11.4f} {min(times):>9.4f}")
+    print(f"warm speedup vs. no cache: {statistics.median(results['none']) / statistics.median(results['warm']):.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,381 @@
+"""
+Offline end-to-end benchmark: replays student questions through TeachingAssistant.handle_question
+and through the Flask endpoints against the deterministic fake LLM server (fake_llm_server.py),
+so throughput can be tracked run to run without calling api.deepseek.com.
+
+    python benchmarks/bench_offline.py [--targets ta,flask,flask-stream] [--questions 90] [--turns 3]
+                                       [--concurrency 8] [--latency 0.2] [--token-rate 400]
+                                       [--error-rate 0] [--error-status 500,429] [--seed 0]
+                                       [--json-out run.json] [--baseline previous.json]
+                                       [--base-url URL] [--tracemalloc]
+
+The questions of router_labels.jsonl (--labels) are split into conversations of --turns
+questions each; --concurrency conversations run at a time, the turns of one conversation one
+after another, so later turns carry history like a real session.
+Targets:
+    ta            TeachingAssistant.handle_question, one session per conversation, sharing one
+                  knowledge base and client (like session_registry)
+    flask         POST /api/conversations/<id>/messages through app.py's test client
+    flask-stream  POST /api/conversations/<id>/messages/stream (also time to the first delta)
+
+Everything the run writes (conversation DB, history files, caches, pending list) goes to a
+scratch directory and every target starts with empty router / answer caches, so the same
+options give the same LLM traffic run after run (caches can be switched off with the usual
+TA_ROUTER_CACHE / TA_ANSWER_CACHE variables).
+Without --base-url an in-process fake server answers; with it, prompt sizes per call are not
+available (only the per-question token totals from the usage ledger).
+
+Per target it reports: throughput, latency p50 / p95 / p99 / max, errors (exceptions, non-200
+responses, fallback answers, interrupted streams), LLM calls / retries and prompt / completion
+tokens per question, prompt tokens per LLM call (p50 / p95 / max), RSS before / after / peak
+(and the Python heap peak with --tracemalloc), and the slowest stages from the tracer.
+--json-out saves the report; --baseline prints the change of each headline number against a
+saved report.
+"""
+
+import argparse
+import atexit
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+TARGETS = ("ta", "flask", "flask-stream")
+# Headline numbers compared with --baseline, and whether higher is better
+HEADLINE = [
+    ("throughput", True),
+    ("p50", False),
+    ("p95", False),
+    ("p99", False),
+    ("errors", False),
+    ("llm_calls_per_question", False),
+    ("prompt_tokens_per_question", False),
+    ("prompt_tokens_per_call_p95", False),
+    ("rss_peak_mb", False),
+]
+
+
+def percentile(values: List[float], pct: float) -> float:
+    values = sorted(values)
+    if not values:
+        return 0.0
+    k = min(len(values) - 1, max(0, int(round(pct / 100 * len(values) + 0.5)) - 1))
+    return values[k]
+
+
+def rss_mb() -> float:
+    """Current resident set size (Linux /proc), else the peak from getrusage."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError, IndexError):
+        return peak_rss_mb()
+
+
+def peak_rss_mb() -> float:
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024
+
+
+def conversations(questions: List[str], turns: int) -> List[List[str]]:
+    turns = max(1, turns)
+    return [questions[i:i + turns] for i in range(0, len(questions), turns)]
+
+
+# ---------- targets ----------
+
+def run_ta(convs: List[List[str]], concurrency: int, shared) -> List[Dict]:
+    from ta_agents_history import TeachingAssistant
+
+    kb, client = shared
+
+    def conversation(n: int, turns: List[str]) -> List[Dict]:
+        ta = TeachingAssistant(session_id=f"bench_ta_{n}", client=client, kb=kb)
+        results = []
+        for question in turns:
+            start = time.perf_counter()
+            try:
+                result = ta.handle_question(question)
+                ok = bool(result.get("ai_answer") or result["router"].get("need_human_TA"))
+            except Exception as e:
+                print(f"[Bench] ta conversation {n}: {type(e).__name__}: {e}", file=sys.stderr)
+                ok = False
+            results.append({"ok": ok, "latency": time.perf_counter() - start, "ttfd": None})
+        return results
+
+    return _replay(convs, concurrency, conversation)
+
+
+def run_flask(convs: List[List[str]], concurrency: int, stream: bool) -> List[Dict]:
+    import app as web
+
+    def conversation(n: int, turns: List[str]) -> List[Dict]:
+        client = web.app.test_client()
+        headers = {web.CLIENT_ID_HEADER: f"bench-{n}"}
+        resp = client.post("/api/conversations", json={"title": f"Bench {n}"}, headers=headers)
+        if resp.status_code != 201 and resp.status_code != 200:
+            return [{"ok": False, "latency": None, "ttfd": None} for _ in turns]
+        conv_id = resp.get_json()["id"]
+        results = []
+        for question in turns:
+            fallbacks = web.service_metrics.fallbacks.value()
+            start = time.perf_counter()
+            ttfd = None
+            if stream:
+                resp = client.post(f"/api/conversations/{conv_id}/messages/stream", json={"content": question},
+                                   headers=headers, buffered=False)
+                ok = resp.status_code == 200
+                for chunk in resp.response:
+                    if ttfd is None and b"event: delta" in chunk:
+                        ttfd = time.perf_counter() - start
+                    ok = ok and b"event: error" not in chunk
+                resp.close()
+            else:
+                resp = client.post(f"/api/conversations/{conv_id}/messages", json={"content": question},
+                                   headers=headers)
+                ok = resp.status_code == 200
+            # Fallback answers are 200s too; other threads' fallbacks can only make this stricter
+            ok = ok and web.service_metrics.fallbacks.value() == fallbacks
+            results.append({"ok": ok, "latency": time.perf_counter() - start, "ttfd": ttfd})
+        return results
+
+    return _replay(convs, concurrency, conversation)
+
+
+def _replay(convs: List[List[str]], concurrency: int, conversation) -> List[Dict]:
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        futures = [pool.submit(conversation, n, turns) for n, turns in enumerate(convs)]
+        return [r for f in futures for r in f.result()]
+
+
+# ---------- measurement ----------
+
+def measure(target: str, convs: List[List[str]], args, server, shared) -> Dict:
+    from caching import default_answer_cache, default_router_cache
+    from resilience import default_call_guard
+    from ta_agents_history import CourseKnowledgeBase, RouterAgent
+    from tracing import default_tracer
+    from usage_ledger import default_usage_ledger
+
+    # The router / answer caches are process-wide: every target starts with empty ones
+    router = RouterAgent(shared[1] if shared else None)
+    for cache in (default_router_cache(CourseKnowledgeBase._tokenize, router.prompt_version()),
+                  default_answer_cache(CourseKnowledgeBase._tokenize)):
+        if cache is not None:
+            cache.clear()
+    ledger = default_usage_ledger()
+    guard = default_call_guard()
+    tracer = default_tracer()
+    tracer.reset()
+    if server is not None:
+        server.stats.reset()
+    usage_before = ledger.daily_usage()["total"]
+    retries_before = guard.stats()["retries"]
+    rss_before = rss_mb()
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    start = time.perf_counter()
+    # The app and the agents print a few lines per question
+    with contextlib.redirect_stdout(io.StringIO()):
+        if target == "ta":
+            results = run_ta(convs, args.concurrency, shared)
+        else:
+            results = run_flask(convs, args.concurrency, stream=target == "flask-stream")
+    elapsed = time.perf_counter() - start
+
+    heap_peak = None
+    if args.tracemalloc:
+        heap_peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    usage_after = ledger.daily_usage()["total"]
+    n = len(results) or 1
+    latencies = [r["latency"] for r in results if r["ok"]]
+    ttfds = [r["ttfd"] for r in results if r["ok"] and r["ttfd"] is not None]
+    report = {
+        "target": target,
+        "questions": len(results),
+        "conversations": len(convs),
+        "errors": sum(1 for r in results if not r["ok"]),
+        "elapsed": round(elapsed, 3),
+        "throughput": round(len(latencies) / elapsed, 3) if elapsed else 0.0,
+        "p50": round(percentile(latencies, 50), 4),
+        "p95": round(percentile(latencies, 95), 4),
+        "p99": round(percentile(latencies, 99), 4),
+        "max": round(max(latencies), 4) if latencies else 0.0,
+        "ttfd_p50": round(percentile(ttfds, 50), 4) if ttfds else None,
+        "llm_calls_per_question": round((usage_after["calls"] - usage_before["calls"]) / n, 3),
+        "retries": guard.stats()["retries"] - retries_before,
+        "prompt_tokens_per_question": round((usage_after["prompt_tokens"] - usage_before["prompt_tokens"]) / n, 1),
+        "completion_tokens_per_question": round(
+            (usage_after["completion_tokens"] - usage_before["completion_tokens"]) / n, 1),
+        "rss_before_mb": round(rss_before, 1),
+        "rss_after_mb": round(rss_mb(), 1),
+        "rss_peak_mb": round(peak_rss_mb(), 1),
+        "heap_peak_mb": round(heap_peak, 1) if heap_peak is not None else None,
+        "stages": {name: {k: s[k] for k in ("count", "p50_ms", "p95_ms")}
+                   for name, s in tracer.summary()["stages"].items()},
+    }
+    if server is not None:
+        served = server.stats.snapshot()
+        report.update({
+            "prompt_tokens_per_call_p50": percentile(served["prompt_tokens"], 50),
+            "prompt_tokens_per_call_p95": percentile(served["prompt_tokens"], 95),
+            "prompt_tokens_per_call_max": max(served["prompt_tokens"], default=0),
+            "injected_errors": served["errors"],
+        })
+    return report
+
+
+# ---------- output ----------
+
+def print_report(report: Dict, baseline: Optional[Dict]):
+    print(f"\n== {report['target']}: {report['questions']} questions in {report['conversations']} conversations, "
+          f"{report['elapsed']:.1f}s ({report['errors']} errors)")
+    print(f"throughput   {report['throughput']:.2f} questions/s")
+    print(f"latency      p50 {report['p50']:.3f}s  p95 {report['p95']:.3f}s  p99 {report['p99']:.3f}s  "
+          f"max {report['max']:.3f}s")
+    if report["ttfd_p50"] is not None:
+        print(f"first delta  p50 {report['ttfd_p50']:.3f}s")
+    print(f"LLM          {report['llm_calls_per_question']:.2f} calls/question, {report['retries']} retries")
+    print(f"tokens       {report['prompt_tokens_per_question']:.0f} prompt + "
+          f"{report['completion_tokens_per_question']:.0f} completion per question")
+    if "prompt_tokens_per_call_p50" in report:
+        print(f"prompt/call  p50 {report['prompt_tokens_per_call_p50']}  p95 {report['prompt_tokens_per_call_p95']}  "
+              f"max {report['prompt_tokens_per_call_max']} tokens ({report['injected_errors']} injected errors)")
+    heap = f", Python heap peak {report['heap_peak_mb']:.1f} MB" if report["heap_peak_mb"] is not None else ""
+    print(f"memory       RSS {report['rss_before_mb']:.1f} -> {report['rss_after_mb']:.1f} MB, "
+          f"peak {report['rss_peak_mb']:.1f} MB{heap}")
+    slowest = sorted(report["stages"].items(), key=lambda kv: -kv[1]["p95_ms"])[:5]
+    if slowest:
+        print("stages       " + "  ".join(f"{name} p95 {s['p95_ms']:.0f}ms" for name, s in slowest))
+    if baseline:
+        changes = []
+        for key, higher_is_better in HEADLINE:
+            old, new = baseline.get(key), report.get(key)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = change < 0 if higher_is_better else change > 0
+            mark = " (worse)" if worse and abs(change) >= 0.05 else ""
+            changes.append(f"{key} {change:+.1%}{mark}")
+        if changes:
+            print("vs baseline  " + ", ".join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--targets", default=",".join(TARGETS), help=f"comma-separated, from {', '.join(TARGETS)}")
+    parser.add_argument("--labels", default=os.path.join(ROOT, "router_labels.jsonl"), help="question corpus")
+    parser.add_argument("--questions", type=int, default=0, help="use the first N questions (default all)")
+    parser.add_argument("--turns", type=int, default=3, help="questions per conversation")
+    parser.add_argument("--concurrency", type=int, default=8, help="conversations at a time")
+    parser.add_argument("--materials", default=os.path.join(ROOT, "course_materials"))
+    parser.add_argument("--base-url", default="", help="OpenAI-compatible API (default: in-process fake server)")
+    parser.add_argument("--latency", type=float, default=0.2, help="fake server: seconds before each answer")
+    parser.add_argument("--token-rate", type=float, default=400.0, help="fake server: completion tokens per second")
+    parser.add_argument("--words", type=int, default=120, help="fake server: words per answer")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fake server: share of failing requests")
+    parser.add_argument("--error-status", default="500,429", help="fake server: statuses of injected failures")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tracemalloc", action="store_true", help="also report the Python heap peak (slower)")
+    parser.add_argument("--json-out", default="", help="write the report to this JSON file")
+    parser.add_argument("--baseline", default="", help="compare with a report written by --json-out")
+    args = parser.parse_args()
+
+    targets = [t.strip() for t in args.targets.split(",") if t.strip()]
+    unknown = set(targets) - set(TARGETS)
+    if unknown:
+        sys.exit(f"Unknown targets: {', '.join(sorted(unknown))}")
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = {r["target"]: r for r in json.load(f)["targets"]}
+
+    from fast_router import load_labeled
+
+    questions = [ex["question"] for ex in load_labeled(args.labels)]
+    if args.questions:
+        questions = questions[:args.questions]
+    convs = conversations(questions, args.turns)
+
+    server = None
+    if args.base_url:
+        base_url = args.base_url
+    else:
+        from fake_llm_server import start_server
+
+        server = start_server(0, latency=args.latency, chunks=20, chunk_delay=0.0, token_rate=args.token_rate,
+                              words=args.words, error_rate=args.error_rate, seed=args.seed,
+                              error_statuses=[int(s) for s in args.error_status.split(",") if s.strip()])
+        base_url = f"http://127.0.0.1:{server.server_address[1]}"
+        os.environ.setdefault("DEEPSEEK_API_KEY", "fake")
+    os.environ["DEEPSEEK_BASE_URL"] = base_url
+
+    json_out = os.path.abspath(args.json_out) if args.json_out else ""
+    # app.py and the session files use paths relative to the working directory, and the caches /
+    # history persister / usage ledger save at exit; the scratch directory is removed after them
+    # (atexit runs handlers in reverse order of registration)
+    scratch = tempfile.mkdtemp(prefix="bench_offline_")
+    atexit.register(shutil.rmtree, scratch, True)
+    os.environ["TA_CONVERSATION_DB"] = os.path.join(scratch, "conversations.db")
+    os.environ["TA_USAGE_LEDGER_FILE"] = ""
+    os.environ["TA_TRACE_EXPORT"] = ""
+    os.symlink(os.path.abspath(args.materials), os.path.join(scratch, "course_materials"))
+    os.chdir(scratch)
+
+    from deepseek_client import DeepSeekClient
+    from ta_agents_history import CourseKnowledgeBase
+
+    shared = None
+    load_seconds = None
+    if "ta" in targets:
+        with contextlib.redirect_stdout(io.StringIO()):
+            kb = CourseKnowledgeBase("course_materials")
+            shared = (kb, DeepSeekClient(base_url=base_url))
+        load_seconds = kb.load_seconds
+    if any(t.startswith("flask") for t in targets):
+        # app.py builds its knowledge base and clients on import, outside the timed runs
+        with contextlib.redirect_stdout(io.StringIO()):
+            import app  # noqa: F401
+    reports = [measure(t, convs, args, server, shared) for t in targets]
+    if server is not None:
+        server.shutdown()
+
+    print(f"{len(questions)} questions from {args.labels}, "
+          f"{'fake server' if server else base_url}, concurrency {args.concurrency}")
+    if load_seconds is not None:
+        print(f"knowledge base loaded in {load_seconds:.2f}s (cold parse cache)")
+    for report in reports:
+        print_report(report, baseline.get(report["target"]))
+
+    if args.json_out:
+        payload = {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "options": {k: v for k, v in vars(args).items() if k not in ("json_out", "baseline")},
+            "kb_load_seconds": load_seconds,
+            "targets": reports,
+        }
+        with open(json_out, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, indent=2)
+        print(f"\nReport written to {json_out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Query latency of CourseKnowledgeBase.search (posting-list index) vs. the previous
+implementation that re-tokenized every chunk per query, at 1x / 10x / 100x the corpus.
+
+    python benchmarks/bench_search.py [--folder course_materials] [--scales 1,10,100] [--queries 20]
+
+Larger corpora are made by replicating the loaded chunks under distinct file names.
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import sys
+import time
+from typing import Dict, List, Tuple
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ta_agents_history import CourseKnowledgeBase  # noqa: E402
+
+QUERIES = [
+    "what is an AVL rotation",
+    "explain quicksort pivot selection",
+    "B+ tree split on insert",
+    "heap sort time complexity",
+    "linked list insert delete",
+    "stack vs queue",
+    "merge sort recursion",
+    "解释一下快速排序的pivot",
+    "二叉搜索树 删除节点",
+    "insertion sort best case",
+]
+
+
+def legacy_search(kb: CourseKnowledgeBase, query: str, top_k: int = 4) -> List[Dict]:
+    """The pre-index implementation, O(corpus) tokenization per query."""
+    q_tokens = set(kb._tokenize(query))
+    scored: List[Tuple[float, Dict]] = []
+    for chunk in kb.chunks:
+        d_tokens = set(kb._tokenize(chunk["text"]))
+        name_tokens = set(kb._tokenize(os.path.basename(chunk["path"])))
+        all_tokens = d_tokens | name_tokens
+        overlap = len(q_tokens & all_tokens)
+        if overlap == 0:
+            continue
+        scored.append((overlap / (len(all_tokens) ** 0.5 + 1e-6) + len(q_tokens & name_tokens) * 0.5, chunk))
+    scored.sort(key=lambda x: x[0], reverse=True)
+    return [c for _, c in scored[:top_k]]
+
+
+def _time_queries(fn, queries: List[str]) -> float:
+    """Median per-query latency in milliseconds."""
+    times = []
+    for q in queries:
+        start = time.perf_counter()
+        fn(q)
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--folder", default="course_materials")
+    parser.add_argument("--scales", default="1,10,100")
+    parser.add_argument("--queries", type=int, default=20, help="queries timed per scale")
+    parser.add_argument("--legacy-queries", type=int, default=3, help="queries timed for the legacy scan")
+    args = parser.parse_args()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        kb = CourseKnowledgeBase(args.folder)
+    base_chunks = list(kb.chunks)
+    queries = (QUERIES * (args.queries // len(QUERIES) + 1))[: args.queries]
+
+    print(f"{'scale':>5} {'chunks':>7} {'index build (ms)':>17} {'indexed (ms/q)':>15} {'legacy (ms/q)':>14} {'speedup':>8}")
+    for scale in (int(s) for s in args.scales.split(",")):
+        kb.chunks = [
+            {"path": f"{c['path']}" if i == 0 else f"{os.path.splitext(c['path'])[0]} copy{i}.pptx", "text": c["text"]}
+            for i in range(scale)
+            for c in base_chunks
+        ]
+        start = time.perf_counter()
+        kb._build_index()
+        build_ms = (time.perf_counter() - start) * 1000
+
+        for q in QUERIES:
+            assert [id(c) for c in kb.search(q)] == [id(c) for c in legacy_search(kb, q)], q
+            if scale > 1:
+                break
+
+        indexed = _time_queries(kb.search, queries)
+        legacy = _time_queries(lambda q: legacy_search(kb, q), queries[: args.legacy_queries])
+        print(f"{scale:>5} {len(kb.chunks):>7} {build_ms:>17.1f} {indexed:>15.3f} {legacy:>14.1f} {legacy / indexed:>7.0f}x")
+
+
+if __name__ == "__main__":
+    main()
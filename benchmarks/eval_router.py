@@ -0,0 +1,122 @@
+"""
+Offline evaluation of the local fast-path router (fast_router.py) against the LLM router.
+
+    python benchmarks/eval_router.py [--labels router_labels.jsonl] [--reference labels|llm]
+                                     [--thresholds 0.5,0.7,0.8,0.9,0.95] [--save-llm llm_labels.jsonl]
+
+--reference labels  compare with the labels stored in the file (no API calls)
+--reference llm     ask RouterAgent (DeepSeek API) for every question and compare with its
+                    decisions; --save-llm writes them out so they can be reused as labels
+
+The naive Bayes model is evaluated with leave-one-out cross-validation over the same file,
+so a question is never classified by a model that was trained on it.
+For every threshold it reports:
+    coverage   share of questions answered by the fast path (LLM router calls saved)
+    agreement  share of fast-path decisions whose route_to (and need_human_TA) match the reference
+    type       share of fast-path decisions whose type matches the reference
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+from typing import Dict, List
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fast_router import DEFAULT_LABELS_FILE, FastRouter, load_labeled  # noqa: E402
+from ta_agents_history import CourseKnowledgeBase  # noqa: E402
+
+
+def llm_reference(examples: List[Dict], save_path: str = "") -> List[Dict]:
+    from deepseek_client import DeepSeekClient
+    from ta_agents_history import RouterAgent
+
+    router = RouterAgent(DeepSeekClient())
+    reference = []
+    for i, ex in enumerate(examples, 1):
+        with contextlib.redirect_stdout(io.StringIO()):
+            decision = router.route(ex["question"])
+        reference.append({
+            "question": ex["question"],
+            "type": decision.type,
+            "route_to": decision.route_to,
+            "need_human_TA": decision.need_human_TA,
+        })
+        print(f"\r[Eval] LLM router {i}/{len(examples)}", end="", flush=True)
+    print()
+    if save_path:
+        with open(save_path, "w", encoding="utf-8") as f:
+            for ref in reference:
+                f.write(json.dumps(ref, ensure_ascii=False) + "\n")
+    return reference
+
+
+def leave_one_out_guesses(examples: List[Dict]):
+    """Fast router guess for every example, from a model trained on all the other examples."""
+    guesses = []
+    for i, ex in enumerate(examples):
+        router = FastRouter(CourseKnowledgeBase._tokenize, examples[:i] + examples[i + 1:], threshold=0.0)
+        guesses.append(router.classify(ex["question"]))
+    return guesses
+
+
+def evaluate(guesses, reference: List[Dict], thresholds: List[float]) -> List[Dict]:
+    rows = []
+    n = len(reference)
+    for t in thresholds:
+        covered = agree = type_agree = 0
+        for guess, ref in zip(guesses, reference):
+            if guess is None or guess.confidence < t:
+                continue
+            covered += 1
+            agree += guess.route_to == ref["route_to"] and guess.need_human_TA == bool(ref["need_human_TA"])
+            type_agree += guess.type == ref["type"]
+        rows.append({
+            "threshold": t,
+            "coverage": covered / n if n else 0.0,
+            "agreement": agree / covered if covered else 1.0,
+            "type_agreement": type_agree / covered if covered else 1.0,
+            "llm_calls_saved": covered,
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--labels", default=DEFAULT_LABELS_FILE)
+    parser.add_argument("--reference", choices=("labels", "llm"), default="labels")
+    parser.add_argument("--thresholds", default="0.5,0.7,0.8,0.9,0.95")
+    parser.add_argument("--save-llm", default="", help="write the LLM router decisions to this JSONL file")
+    parser.add_argument("--show-errors", action="store_true", help="list disagreements at the highest threshold")
+    args = parser.parse_args()
+
+    examples = load_labeled(args.labels)
+    if not examples:
+        sys.exit(f"No labeled questions in {args.labels}")
+    reference = examples if args.reference == "labels" else llm_reference(examples, args.save_llm)
+    thresholds = [float(t) for t in args.thresholds.split(",")]
+
+    guesses = leave_one_out_guesses(examples)
+    print(f"{len(examples)} questions, reference = {args.reference}, leave-one-out naive Bayes + rules\n")
+    print(f"{'threshold':>9} | {'coverage':>8} | {'agreement':>9} | {'type':>6} | {'LLM calls saved':>15}")
+    print("-" * 60)
+    for row in evaluate(guesses, reference, thresholds):
+        print(f"{row['threshold']:>9.2f} | {row['coverage']:>8.1%} | {row['agreement']:>9.1%} | "
+              f"{row['type_agreement']:>6.1%} | {row['llm_calls_saved']:>15}")
+
+    if args.show_errors:
+        t = max(thresholds)
+        print(f"\nDisagreements at threshold {t}:")
+        for guess, ref in zip(guesses, reference):
+            if guess is not None and guess.confidence >= t and (
+                guess.route_to != ref["route_to"] or guess.need_human_TA != bool(ref["need_human_TA"])
+            ):
+                print(f"  {ref['question'][:60]!r}: fast={guess.route_to}/{guess.need_human_TA} "
+                      f"({guess.reason}, {guess.confidence:.2f}) ref={ref['route_to']}/{ref['need_human_TA']}")
+
+
+if __name__ == "__main__":
+    main()
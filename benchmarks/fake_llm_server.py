@@ -0,0 +1,295 @@
+"""
+Local fake OpenAI-compatible chat completions server, for load tests without a real LLM.
+
+    python benchmarks/fake_llm_server.py [--port 9100] [--latency 2.0] [--chunks 20] [--chunk-delay 0.05]
+                                         [--token-rate 0] [--words 120]
+                                         [--error-rate 0] [--error-status 500,429] [--seed 0]
+
+Point the app at it with DEEPSEEK_BASE_URL=http://127.0.0.1:9100 (or DeepSeekClient(base_url=...));
+any DEEPSEEK_API_KEY works.
+
+POST /chat/completions (and /v1/chat/completions) answers after --latency seconds:
+- router prompts get a routing decision JSON picked from keywords in the question
+- combined route + answer prompts (TA_COMBINED_MODE) get that JSON, the answer marker and
+  the answer in one reply
+- every other prompt gets a --words long answer derived from the question text
+With "stream": true the answer is sent as --chunks SSE chunks, --chunk-delay seconds apart,
+followed by a usage chunk (stream_options.include_usage).
+--token-rate N generates N completion tokens per second instead: the reply takes
+latency + completion_tokens / N seconds, streamed chunks are spread over that time.
+
+Replies are deterministic: same request, same answer and timing. --error-rate injects failures
+(a status picked from --error-status; 0 drops the connection, 429 carries Retry-After: 0) for
+that share of requests, chosen by hashing --seed, the request body and how many times the same
+body has been seen, so a retried request can succeed and a run is reproducible whatever the
+order in which concurrent requests arrive.
+
+GET /stats returns the requests, injected errors and per-call prompt / completion tokens served
+so far; POST /stats/reset clears them.
+"""
+
+import argparse
+import hashlib
+import json
+import threading
+import time
+from typing import Dict, List, Sequence
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ANSWER_MARKER = "===ANSWER==="
+
+ROUTES = [
+    (("code", "bug", "error", "compile", "代码", "报错"), "code_debug", "CodeAgent"),
+    (("practice", "exercise", "quiz me", "练习"), "practice", "PracticeAgent"),
+    (("review", "summary", "summarize", "复习", "总结"), "review", "ReviewAgent"),
+]
+
+
+def route_for(question: str) -> dict:
+    lower_q = question.lower()
+    for keywords, qtype, agent in ROUTES:
+        if any(k in lower_q for k in keywords):
+            return {"type": qtype, "difficulty": "medium", "need_human_TA": False, "route_to": agent, "notes_for_TA": ""}
+    return {"type": "concept", "difficulty": "easy", "need_human_TA": False, "route_to": "ConceptAgent", "notes_for_TA": ""}
+
+
+def answer_for(question: str, words: int = 120) -> str:
+    digest = hashlib.sha256(question.encode("utf-8")).hexdigest()
+    return " ".join(f"w{digest[i % len(digest)]}{i}" for i in range(words))
+
+
+def usage_for(messages, completion: str) -> dict:
+    prompt_tokens = sum(len(m.get("content") or "") for m in messages) // 4
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": len(completion) // 4,
+        "total_tokens": prompt_tokens + len(completion) // 4,
+        "prompt_cache_hit_tokens": 0,
+        "prompt_cache_miss_tokens": prompt_tokens,
+    }
+
+
+class FakeStats:
+    """What the server has answered so far (GET /stats)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._seen: Dict[str, int] = {}
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._seen.clear()
+            self.requests = 0
+            self.streams = 0
+            self.errors = 0
+            self.prompt_tokens: List[int] = []
+            self.completion_tokens: List[int] = []
+
+    def attempt(self, body: bytes) -> int:
+        """How many times this exact request body has been seen before."""
+        digest = hashlib.sha256(body).hexdigest()
+        with self._lock:
+            self.requests += 1
+            n = self._seen.get(digest, 0)
+            self._seen[digest] = n + 1
+            return n
+
+    def served(self, usage: dict, stream: bool):
+        with self._lock:
+            self.streams += stream
+            self.prompt_tokens.append(usage["prompt_tokens"])
+            self.completion_tokens.append(usage["completion_tokens"])
+
+    def failed(self):
+        with self._lock:
+            self.errors += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "streams": self.streams,
+                "errors": self.errors,
+                "prompt_tokens": list(self.prompt_tokens),
+                "completion_tokens": list(self.completion_tokens),
+            }
+
+
+def injected_error(seed: int, body: bytes, attempt: int, rate: float, statuses: Sequence[int]):
+    """The status to fail this request with (0: drop the connection), or None."""
+    if rate <= 0 or not statuses:
+        return None
+    h = hashlib.sha256(f"{seed}:{attempt}:".encode("utf-8") + body).digest()
+    if int.from_bytes(h[:8], "big") / 2 ** 64 >= rate:
+        return None
+    return statuses[h[8] % len(statuses)]
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency = 2.0
+    chunks = 20
+    chunk_delay = 0.05
+    token_rate = 0.0
+    words = 120
+    error_rate = 0.0
+    error_statuses = (500,)
+    seed = 0
+    stats: FakeStats = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.rstrip("/") != "/stats":
+            self.send_error(404)
+            return
+        self._send_json(self.stats.snapshot())
+
+    def do_POST(self):
+        if self.path.rstrip("/") == "/stats/reset":
+            self.stats.reset()
+            self._send_json({"ok": True})
+            return
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_error(404)
+            return
+        raw = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        body = json.loads(raw or b"{}")
+        messages = body.get("messages", [])
+        system = next((m.get("content", "") for m in messages if m.get("role") == "system"), "")
+        question = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+        if ANSWER_MARKER in system:
+            content = f"{json.dumps(route_for(question))}\n{ANSWER_MARKER}\n{answer_for(question, self.words)}"
+        elif "Router" in system:
+            content = json.dumps(route_for(question))
+        else:
+            content = answer_for(question, self.words)
+
+        time.sleep(self.latency)
+        status = injected_error(self.seed, raw, self.stats.attempt(raw), self.error_rate, self.error_statuses)
+        if status is not None:
+            self.stats.failed()
+            self._fail(status)
+            return
+        usage = usage_for(messages, content)
+        self.stats.served(usage, bool(body.get("stream")))
+        if body.get("stream"):
+            self._stream(body.get("model", "fake"), messages, content)
+        else:
+            if self.token_rate > 0:
+                time.sleep(usage["completion_tokens"] / self.token_rate)
+            self._send_json({
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "fake"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+
+    def _fail(self, status: int):
+        if status == 0:
+            # Connection error on the client side
+            self.close_connection = True
+            return
+        data = json.dumps({"error": {"message": f"injected error {status}", "type": "fake_error"}}).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if status == 429:
+            self.send_header("Retry-After", "0")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_json(self, payload: dict):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream(self, model: str, messages, content: str):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        n = max(1, self.chunks)
+        step = max(1, len(content) // n + 1)
+        pieces = [content[i:i + step] for i in range(0, len(content), step)]
+        delay = self.chunk_delay
+        if self.token_rate > 0:
+            delay = len(content) // 4 / self.token_rate / len(pieces)
+        base = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()), "model": model}
+        try:
+            for i, piece in enumerate(pieces):
+                if i:
+                    time.sleep(delay)
+                chunk = dict(base, choices=[{"index": 0, "delta": {"content": piece}, "finish_reason": None}])
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+            final = dict(base, choices=[], usage=usage_for(messages, content))
+            self.wfile.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+            self.wfile.flush()
+        except ConnectionError:
+            # The client stopped reading (e.g. a discarded speculative call)
+            pass
+        self.close_connection = True
+
+
+def start_server(port: int = 9100, latency: float = 2.0, chunks: int = 20, chunk_delay: float = 0.05,
+                 host: str = "127.0.0.1", token_rate: float = 0.0, words: int = 120, error_rate: float = 0.0,
+                 error_statuses: Sequence[int] = (500,), seed: int = 0) -> ThreadingHTTPServer:
+    """
+    Start the fake server on a daemon thread and return it (call .shutdown() to stop);
+    server.stats is its FakeStats. port 0 picks a free port (server.server_address[1]).
+    """
+    stats = FakeStats()
+    handler = type("ConfiguredFakeLLMHandler", (FakeLLMHandler,), {
+        "latency": latency, "chunks": chunks, "chunk_delay": chunk_delay, "token_rate": token_rate,
+        "words": words, "error_rate": error_rate, "error_statuses": tuple(error_statuses), "seed": seed,
+        "stats": stats,
+    })
+    server_class = type("FakeLLMServer", (ThreadingHTTPServer,), {
+        # The default listen backlog (5) drops connections when hundreds arrive at once
+        "request_queue_size": 1024,
+        "daemon_threads": True,
+    })
+    server = server_class((host, port), handler)
+    server.stats = stats
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", type=float, default=2.0, help="seconds before the first byte of each answer")
+    parser.add_argument("--chunks", type=int, default=20, help="SSE chunks per streamed answer")
+    parser.add_argument("--chunk-delay", type=float, default=0.05, help="seconds between streamed chunks")
+    parser.add_argument("--token-rate", type=float, default=0.0,
+                        help="completion tokens per second (default 0: --chunk-delay pacing, no generation time)")
+    parser.add_argument("--words", type=int, default=120, help="words per answer")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests that fail")
+    parser.add_argument("--error-status", default="500",
+                        help="comma-separated statuses of injected failures (0: drop the connection)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the error injection")
+    args = parser.parse_args()
+
+    server = start_server(args.port, args.latency, args.chunks, args.chunk_delay, args.host,
+                          token_rate=args.token_rate, words=args.words, error_rate=args.error_rate,
+                          error_statuses=[int(s) for s in args.error_status.split(",") if s.strip()],
+                          seed=args.seed)
+    print(f"Fake LLM server on http://{args.host}:{args.port} (latency {args.latency}s), Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Concurrent-conversation load test for the web app (app.py or asgi_app.py).
+
+    # 1. fake LLM (every call takes --latency seconds)
+    python benchmarks/fake_llm_server.py --port 9100 --latency 2.0
+    # 2. the app under test, pointed at the fake LLM, e.g. the async serving mode:
+    DEEPSEEK_BASE_URL=http://127.0.0.1:9100 uvicorn asgi_app:app --port 5000
+    #    or the threaded Flask server:  DEEPSEEK_BASE_URL=http://127.0.0.1:9100 python app.py
+    # 3. drive it
+    python benchmarks/load_test.py --url http://127.0.0.1:5000 --conversations 200 --messages 2
+
+Each simulated student (its own X-Client-Id) creates one conversation through
+POST /api/conversations and sends --messages questions one after another; all
+conversations run concurrently, each in its own TeachingAssistant session.
+Reports requests/s and latency percentiles (and time to first delta with --stream).
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+QUESTIONS = [
+    "What is the time complexity of heap sort?",
+    "Explain AVL tree rotations",
+    "My quicksort code has an error, the pivot loops forever",
+    "Give me practice problems on binary search trees",
+    "Please help me review chapters 1-3",
+    "解释一下快速排序的pivot",
+]
+
+
+async def create_conversation(client: httpx.AsyncClient, url: str, n: int) -> Tuple[Dict[str, str], str]:
+    """Create student n's conversation; returns (its request headers, the conversation id)"""
+    headers = {"X-Client-Id": f"loadtest-{n}"}
+    resp = await client.post(f"{url}/api/conversations", json={"title": f"Load test {n}"}, headers=headers)
+    resp.raise_for_status()
+    return headers, resp.json()["id"]
+
+
+async def send_message(client: httpx.AsyncClient, url: str, conv_id: str, content: str, stream: bool,
+                       headers: Dict[str, str]) -> Dict:
+    start = time.perf_counter()
+    if not stream:
+        resp = await client.post(f"{url}/api/conversations/{conv_id}/messages", json={"content": content},
+                                 headers=headers)
+        return {"ok": resp.status_code == 200, "latency": time.perf_counter() - start, "ttfd": None}
+
+    ttfd: Optional[float] = None
+    async with client.stream("POST", f"{url}/api/conversations/{conv_id}/messages/stream",
+                             json={"content": content}, headers=headers) as resp:
+        ok = resp.status_code == 200
+        async for line in resp.aiter_lines():
+            if ttfd is None and line.startswith("event: delta"):
+                ttfd = time.perf_counter() - start
+    return {"ok": ok, "latency": time.perf_counter() - start, "ttfd": ttfd}
+
+
+async def run_conversation(client, url, n, messages, stream, results: List[Dict]):
+    try:
+        headers, conv_id = await create_conversation(client, url, n)
+    except httpx.HTTPError as e:
+        results.extend({"ok": False, "latency": None, "ttfd": None, "error": str(e)} for _ in range(messages))
+        return
+    for i in range(messages):
+        question = QUESTIONS[(n + i) % len(QUESTIONS)]
+        try:
+            results.append(await send_message(client, url, conv_id, question, stream, headers))
+        except httpx.HTTPError as e:
+            results.append({"ok": False, "latency": None, "ttfd": None, "error": str(e)})
+
+
+def percentile(values: List[float], pct: float) -> float:
+    values = sorted(values)
+    if not values:
+        return 0.0
+    k = min(len(values) - 1, max(0, int(round(pct / 100 * len(values) + 0.5)) - 1))
+    return values[k]
+
+
+async def run(args) -> Dict:
+    limits = httpx.Limits(max_connections=args.conversations, max_keepalive_connections=args.conversations)
+    results: List[Dict] = []
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*[
+            run_conversation(client, args.url, n, args.messages, args.stream, results)
+            for n in range(args.conversations)
+        ])
+        elapsed = time.perf_counter() - start
+
+    latencies = [r["latency"] for r in results if r["ok"]]
+    ttfds = [r["ttfd"] for r in results if r["ok"] and r["ttfd"] is not None]
+    return {
+        "requests": len(results),
+        "errors": sum(1 for r in results if not r["ok"]),
+        "elapsed": elapsed,
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "max": max(latencies) if latencies else 0.0,
+        "mean": statistics.mean(latencies) if latencies else 0.0,
+        "ttfd_p50": percentile(ttfds, 50) if ttfds else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--conversations", type=int, default=100, help="concurrent conversations")
+    parser.add_argument("--messages", type=int, default=2, help="sequential messages per conversation")
+    parser.add_argument("--stream", action="store_true", help="use the SSE endpoint")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print(f"{report['requests']} requests over {args.conversations} conversations in {report['elapsed']:.1f}s "
+          f"({report['errors']} errors)")
+    print(f"throughput: {report['throughput']:.1f} req/s")
+    print(f"latency:    p50 {report['p50']:.2f}s  p95 {report['p95']:.2f}s  max {report['max']:.2f}s  "
+          f"mean {report['mean']:.2f}s")
+    if report["ttfd_p50"] is not None:
+        print(f"first delta p50: {report['ttfd_p50']:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
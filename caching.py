@@ -0,0 +1,475 @@
+"""
+Question-keyed caches with near-duplicate lookup.
+
+Students ask the same questions over and over, with small variations in case, spacing,
+punctuation or word order. QuestionCache maps a question to a stored value:
+- exact lookup on the normalized question (case folding, NFKC so full-width CJK
+  punctuation becomes ASCII, punctuation stripped, whitespace collapsed)
+- near-duplicate lookup with MinHash over CourseKnowledgeBase._tokenize tokens and
+  adjacent-token bigrams; candidates come from LSH buckets and are accepted when their
+  estimated Jaccard similarity reaches `similarity`
+- TTL expiry, LRU eviction beyond max_entries, hit/miss counters
+- persisted as JSONL (atomic rewrite) and reloaded on start; entries written under a
+  different `namespace` (e.g. after the router prompt changed) are discarded on load
+
+RouterCache stores RouterAgent decisions (see TeachingAssistant._route).
+AnswerCache stores agent answers to first-turn questions (no conversation history), scoped
+by (agent, materials version, prompt version) so new slides or prompt edits start fresh.
+A near-duplicate router decision is only reused when it sends the question to a human TA
+and the questions do not differ in a negation or answer-request word ("do not", "full
+answer", ...): a near hit must never let a question skip the human-TA gate.
+A near-duplicate answer is only reused when both questions have the same token set (word
+order, case and punctuation may differ): one swapped word ("insertion" / "deletion") keeps
+the estimated similarity of a long question above the threshold but needs another answer.
+
+Environment:
+    TA_ROUTER_CACHE             "off" disables the router cache
+    TA_ROUTER_CACHE_SIZE        max entries (default 5000)
+    TA_ROUTER_CACHE_TTL         seconds an entry stays valid (default 604800, one week)
+    TA_ROUTER_CACHE_SIMILARITY  min estimated Jaccard similarity for a near-duplicate hit (default 0.8)
+    TA_ROUTER_CACHE_FILE        persistence file (default <TA_KB_CACHE_DIR>/router_cache.jsonl)
+    TA_ANSWER_CACHE             "off" disables the answer cache
+    TA_ANSWER_CACHE_AGENTS      agents whose answers are reused (default ConceptAgent,ReviewAgent)
+    TA_ANSWER_CACHE_SIZE        max entries (default 2000)
+    TA_ANSWER_CACHE_TTL         freshness in seconds (default 86400, one day)
+    TA_ANSWER_CACHE_SIMILARITY  min estimated Jaccard similarity for a near-duplicate hit (default 0.85)
+    TA_ANSWER_CACHE_FILE        persistence file (default <TA_KB_CACHE_DIR>/answer_cache.jsonl)
+"""
+
+import atexit
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from kb_cache import DEFAULT_CACHE_DIR, _atomic_write
+
+PUNCT_RE = re.compile(r"[^\w\s]|_", re.UNICODE)
+SPACE_RE = re.compile(r"\s+")
+
+# Tokens (CourseKnowledgeBase._tokenize: English words, single CJK characters) that can flip
+# a routing decision; near-duplicate router questions must agree on all of them
+ROUTER_GUARD_TOKENS = frozenset({
+    "not", "no", "never", "don", "doesn", "didn", "isn", "aren", "can", "cannot", "won", "t", "without",
+    "just", "only", "full", "complete", "entire", "whole", "give", "show", "tell", "write",
+    "answer", "answers", "solution", "solutions", "solve", "code",
+    "不", "别", "没", "勿", "要", "给", "答", "案", "解", "完", "整", "直", "接",
+})
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+
+def normalize_question(text: str) -> str:
+    """Canonical form used as the exact-match key."""
+    text = unicodedata.normalize("NFKC", text or "").casefold()
+    text = PUNCT_RE.sub(" ", text)
+    return SPACE_RE.sub(" ", text).strip()
+
+
+def _stable_hash(token: str) -> int:
+    # Python's hash() is salted per process; signatures must survive restarts
+    return int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=4).digest(), "little")
+
+
+class MinHasher:
+    """MinHash signatures with num_perm = bands * rows, plus the LSH band keys of a signature."""
+
+    def __init__(self, bands: int = 16, rows: int = 4, seed: int = 1):
+        self.bands = bands
+        self.rows = rows
+        self.num_perm = bands * rows
+        rng = random.Random(seed)
+        self.perms = [
+            (rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME))
+            for _ in range(self.num_perm)
+        ]
+
+    def signature(self, shingles) -> Tuple[int, ...]:
+        hashes = [_stable_hash(s) for s in set(shingles)]
+        if not hashes:
+            return tuple([_MAX_HASH] * self.num_perm)
+        return tuple(
+            min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes)
+            for a, b in self.perms
+        )
+
+    def band_keys(self, signature: Tuple[int, ...]) -> List[Tuple[int, Tuple[int, ...]]]:
+        return [(i, signature[i * self.rows:(i + 1) * self.rows]) for i in range(self.bands)]
+
+    @staticmethod
+    def similarity(sig_a: Tuple[int, ...], sig_b: Tuple[int, ...]) -> float:
+        """Estimated Jaccard similarity of the two shingle sets."""
+        if not sig_a:
+            return 0.0
+        return sum(1 for a, b in zip(sig_a, sig_b) if a == b) / len(sig_a)
+
+
+class _Entry:
+    __slots__ = ("key", "question", "value", "signature", "created", "hits")
+
+    def __init__(self, key: str, question: str, value, signature: Tuple[int, ...], created: float, hits: int = 0):
+        self.key = key
+        self.question = question
+        self.value = value
+        self.signature = signature
+        self.created = created
+        self.hits = hits
+
+
+class QuestionCache:
+    """
+    get(question) -> value or None; put(question, value).
+    Keys can be scoped with a `scope` string (e.g. the agent name) so that the same
+    question is cached separately per scope; near-duplicates only match within a scope.
+    """
+
+    def __init__(
+        self,
+        tokenize: Callable[[str], List[str]],
+        max_entries: int = 5000,
+        ttl: float = 7 * 24 * 3600,
+        similarity: float = 0.8,
+        path: Optional[str] = None,
+        namespace: str = "",
+        flush_every: int = 20,
+        name: str = "Cache",
+    ):
+        self.tokenize = tokenize
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = float(ttl)
+        self.similarity = float(similarity)
+        self.path = path
+        self.namespace = namespace
+        self.flush_every = max(1, int(flush_every))
+        self.name = name
+        self.hasher = MinHasher()
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._buckets: Dict[Tuple, set] = {}
+        self._lock = threading.Lock()
+        self._dirty = 0
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        if path:
+            self.load()
+            atexit.register(self.save)
+
+    # ---- Keys ----
+
+    def shingles(self, question: str) -> List[str]:
+        tokens = self.tokenize(question)
+        return tokens + [f"{a}_{b}" for a, b in zip(tokens, tokens[1:])]
+
+    @staticmethod
+    def make_key(scope: str, normalized: str) -> str:
+        return f"{scope}\x1f{normalized}" if scope else normalized
+
+    # ---- Index maintenance (callers hold self._lock) ----
+
+    def _index(self, entry: _Entry):
+        scope = entry.key.split("\x1f", 1)[0] if "\x1f" in entry.key else ""
+        for band in self.hasher.band_keys(entry.signature):
+            self._buckets.setdefault((scope,) + band, set()).add(entry.key)
+
+    def _unindex(self, entry: _Entry):
+        scope = entry.key.split("\x1f", 1)[0] if "\x1f" in entry.key else ""
+        for band in self.hasher.band_keys(entry.signature):
+            bucket = self._buckets.get((scope,) + band)
+            if bucket is not None:
+                bucket.discard(entry.key)
+                if not bucket:
+                    del self._buckets[(scope,) + band]
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._unindex(entry)
+
+    def _expired(self, entry: _Entry, now: float) -> bool:
+        return self.ttl > 0 and now - entry.created > self.ttl
+
+    def _near_ok(self, tokens: set, entry: _Entry) -> bool:
+        """Whether a near-duplicate entry may answer a question with these tokens (subclass hook)."""
+        return True
+
+    # ---- Public API ----
+
+    def lookup(self, question: str, scope: str = "") -> Tuple[Optional[object], str]:
+        """(value, "exact" | "near" | "miss")."""
+        normalized = normalize_question(question)
+        key = self.make_key(scope, normalized)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry, now):
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                entry.hits += 1
+                self.exact_hits += 1
+                return entry.value, "exact"
+
+        signature = self.hasher.signature(self.shingles(normalized))
+        tokens = set(self.tokenize(normalized))
+        with self._lock:
+            candidates = set()
+            for band in self.hasher.band_keys(signature):
+                candidates |= self._buckets.get((scope,) + band, set())
+            best, best_sim = None, self.similarity
+            for cand_key in candidates:
+                cand = self._entries.get(cand_key)
+                if cand is None or self._expired(cand, now):
+                    continue
+                sim = MinHasher.similarity(signature, cand.signature)
+                if sim >= best_sim and self._near_ok(tokens, cand):
+                    best, best_sim = cand, sim
+            if best is not None:
+                self._entries.move_to_end(best.key)
+                best.hits += 1
+                self.near_hits += 1
+                return best.value, "near"
+            self.misses += 1
+            return None, "miss"
+
+    def get(self, question: str, scope: str = ""):
+        return self.lookup(question, scope)[0]
+
+    def put(self, question: str, value, scope: str = ""):
+        normalized = normalize_question(question)
+        if not normalized:
+            return
+        key = self.make_key(scope, normalized)
+        entry = _Entry(key, question, value, self.hasher.signature(self.shingles(normalized)), time.time())
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = entry
+            self._index(entry)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+            self._dirty += 1
+            flush = self._dirty >= self.flush_every
+        if flush:
+            self.save()
+
+    def invalidate(self, question: str, scope: str = "") -> bool:
+        key = self.make_key(scope, normalize_question(question))
+        with self._lock:
+            present = key in self._entries
+            self._remove(key)
+            self._dirty += present
+            return present
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+            self._dirty += 1
+        self.save()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    # ---- Persistence ----
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        now = time.time()
+        loaded = 0
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                header = json.loads(f.readline() or "{}")
+                if header.get("namespace") != self.namespace:
+                    print(f"[{self.name}] {self.path} was written for another version, starting empty")
+                    return
+                with self._lock:
+                    for line in f:
+                        try:
+                            rec = json.loads(line)
+                        except json.JSONDecodeError:
+                            continue
+                        entry = _Entry(rec["key"], rec["question"], rec["value"],
+                                       tuple(rec["signature"]), rec["created"], rec.get("hits", 0))
+                        if self._expired(entry, now):
+                            continue
+                        self._entries[entry.key] = entry
+                        self._index(entry)
+                        loaded += 1
+                    while len(self._entries) > self.max_entries:
+                        self._remove(next(iter(self._entries)))
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[{self.name}] Failed to load {self.path}: {e}")
+            return
+        print(f"[{self.name}] Loaded {loaded} entries from {self.path}")
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            records = [
+                json.dumps({
+                    "key": e.key, "question": e.question, "value": e.value,
+                    "signature": list(e.signature), "created": e.created, "hits": e.hits,
+                }, ensure_ascii=False) + "\n"
+                for e in self._entries.values()
+            ]
+            self._dirty = 0
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            _atomic_write(self.path, [json.dumps({"namespace": self.namespace}) + "\n"] + records)
+        except OSError as e:
+            print(f"[{self.name}] Failed to save {self.path}: {e}")
+
+    # ---- Metrics ----
+
+    def stats(self) -> Dict:
+        with self._lock:
+            hits = self.exact_hits + self.near_hits
+            lookups = hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "exact_hits": self.exact_hits,
+                "near_hits": self.near_hits,
+                "misses": self.misses,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+def prompt_version(*prompts: str) -> str:
+    """Short digest of prompt texts, used as a cache namespace so prompt edits invalidate entries."""
+    h = hashlib.sha256()
+    for p in prompts:
+        h.update(p.encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()[:12]
+
+
+class RouterCache(QuestionCache):
+    """Caches RouterAgent decisions (RouterDecision.__dict__) by question."""
+
+    @classmethod
+    def from_env(cls, tokenize: Callable[[str], List[str]], namespace: str) -> Optional["RouterCache"]:
+        """namespace: RouterAgent.prompt_version() (router prompt, model, max_tokens, temperature)."""
+        if os.getenv("TA_ROUTER_CACHE", "on").lower() in ("off", "0", "false"):
+            return None
+        return cls(
+            tokenize,
+            max_entries=int(os.getenv("TA_ROUTER_CACHE_SIZE", "5000")),
+            ttl=float(os.getenv("TA_ROUTER_CACHE_TTL", str(7 * 24 * 3600))),
+            similarity=float(os.getenv("TA_ROUTER_CACHE_SIMILARITY", "0.8")),
+            path=os.getenv("TA_ROUTER_CACHE_FILE") or os.path.join(DEFAULT_CACHE_DIR, "router_cache.jsonl"),
+            namespace=namespace,
+            name="Router Cache",
+        )
+
+    def _near_ok(self, tokens: set, entry: _Entry) -> bool:
+        if not entry.value.get("need_human_TA"):
+            return False
+        return not (tokens ^ set(self.tokenize(normalize_question(entry.question)))) & ROUTER_GUARD_TOKENS
+
+
+class AnswerCache(QuestionCache):
+    """
+    Caches answers as {"answer", "tokens", "seconds"} under scope(agent, materials, prompt).
+    tokens / seconds are what generating the answer cost; each hit adds them to the saved totals.
+    """
+
+    def __init__(self, tokenize: Callable[[str], List[str]], agents=("ConceptAgent", "ReviewAgent"), **kwargs):
+        kwargs.setdefault("name", "Answer Cache")
+        super().__init__(tokenize, **kwargs)
+        self.agents = set(agents)
+        self.saved_tokens = 0
+        self.saved_seconds = 0.0
+
+    @classmethod
+    def from_env(cls, tokenize: Callable[[str], List[str]]) -> Optional["AnswerCache"]:
+        if os.getenv("TA_ANSWER_CACHE", "on").lower() in ("off", "0", "false"):
+            return None
+        agents = [a.strip() for a in os.getenv("TA_ANSWER_CACHE_AGENTS", "ConceptAgent,ReviewAgent").split(",") if a.strip()]
+        return cls(
+            tokenize,
+            agents=agents,
+            max_entries=int(os.getenv("TA_ANSWER_CACHE_SIZE", "2000")),
+            ttl=float(os.getenv("TA_ANSWER_CACHE_TTL", "86400")),
+            similarity=float(os.getenv("TA_ANSWER_CACHE_SIMILARITY", "0.85")),
+            path=os.getenv("TA_ANSWER_CACHE_FILE") or os.path.join(DEFAULT_CACHE_DIR, "answer_cache.jsonl"),
+            namespace="answers-v1",
+        )
+
+    def caches(self, agent_name: str) -> bool:
+        return agent_name in self.agents
+
+    def _near_ok(self, tokens: set, entry: _Entry) -> bool:
+        # A wrong answer costs far more than a miss: only reordered / re-punctuated questions
+        return tokens == set(self.tokenize(normalize_question(entry.question)))
+
+    @staticmethod
+    def scope(agent_name: str, materials_version: str, prompt_version: str) -> str:
+        return f"{agent_name}|{materials_version}|{prompt_version}"
+
+    def lookup(self, question: str, scope: str = "") -> Tuple[Optional[object], str]:
+        value, kind = super().lookup(question, scope)
+        if value is not None:
+            with self._lock:
+                self.saved_tokens += int(value.get("tokens", 0))
+                self.saved_seconds += float(value.get("seconds", 0.0))
+        return value, kind
+
+    def stats(self) -> Dict:
+        stats = super().stats()
+        with self._lock:
+            stats["agents"] = sorted(self.agents)
+            stats["saved_tokens"] = self.saved_tokens
+            stats["saved_seconds"] = round(self.saved_seconds, 2)
+        return stats
+
+
+_default_router_cache: Optional[RouterCache] = None
+_default_router_cache_built = False
+_default_lock = threading.Lock()
+
+
+def default_router_cache(tokenize: Callable[[str], List[str]], namespace: str) -> Optional[RouterCache]:
+    """Process-wide RouterCache built from the environment (None when disabled)."""
+    global _default_router_cache, _default_router_cache_built
+    if not _default_router_cache_built:
+        with _default_lock:
+            if not _default_router_cache_built:
+                _default_router_cache = RouterCache.from_env(tokenize, namespace)
+                _default_router_cache_built = True
+    return _default_router_cache
+
+
+_default_answer_cache: Optional[AnswerCache] = None
+_default_answer_cache_built = False
+
+
+def default_answer_cache(tokenize: Callable[[str], List[str]]) -> Optional[AnswerCache]:
+    """Process-wide AnswerCache built from the environment (None when disabled)."""
+    global _default_answer_cache, _default_answer_cache_built
+    if not _default_answer_cache_built:
+        with _default_lock:
+            if not _default_answer_cache_built:
+                _default_answer_cache = AnswerCache.from_env(tokenize)
+                _default_answer_cache_built = True
+    return _default_answer_cache
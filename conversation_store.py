@@ -0,0 +1,465 @@
+"""
+SQLite-backed conversation store for the web app (app.py / asgi_app.py).
+
+Replaces reading and rewriting the whole conversations.json on every message: each request
+only touches the rows of its own conversation, an exchange (user message + AI response) is
+appended in one transaction, and concurrent writers (threads, processes, uvicorn workers)
+are serialized by SQLite instead of overwriting each other's whole-file rewrites.
+
+- WAL journal: readers never block the writer and vice versa; synchronous=NORMAL
+- one connection per thread (sqlite3 connections are not shared across threads)
+- tables: conversations (id, title, created, updated), messages (conversation_id, sender,
+  content, created), meta (key, value)
+- on first start an existing conversations.json is imported once (the file is left in place)
+- `updated` is assigned inside the write transaction and always increases, so MAX(updated)
+  works as a sync token: a later summaries(since=token) returns every conversation changed
+  after it was read, even if that write had started earlier
+- summaries() and messages_page() return keyset-paginated (cursor) pages
+- conversations created through the API get a random id (new_conversation_id) and the
+  client id of their creator as owner; summaries(owner=...) lists one client's conversations,
+  and exists() / version() with an owner treat other clients' conversations as missing
+
+Environment:
+    TA_CONVERSATION_DB    database file (default conversations.db)
+
+CLI:
+    python conversation_store.py migrate [--json conversations.json] [--db conversations.db]
+    python conversation_store.py info    [--db conversations.db]
+    python conversation_store.py export  [--db conversations.db] [--out conversations.json]
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from tracing import annotate, traced
+
+DEFAULT_DB_FILE = os.getenv("TA_CONVERSATION_DB", "conversations.db")
+LEGACY_JSON_FILE = "conversations.json"
+
+# Titles replaced by the first user message
+PLACEHOLDER_TITLES = ("New Conversation", "Current Conversation")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    id      TEXT PRIMARY KEY,
+    title   TEXT NOT NULL,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    owner   TEXT
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id              INTEGER PRIMARY KEY AUTOINCREMENT,
+    conversation_id TEXT NOT NULL REFERENCES conversations(id) ON DELETE CASCADE,
+    sender          TEXT NOT NULL,
+    content         TEXT NOT NULL,
+    created         REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_by_conversation ON messages (conversation_id, id);
+CREATE INDEX IF NOT EXISTS conversations_by_updated ON conversations (updated, id);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def title_after(title: str, content: str) -> str:
+    """Conversation title once `content` has been asked (placeholder titles become the question)."""
+    if title in PLACEHOLDER_TITLES and content:
+        return content[:20] + '...' if len(content) > 20 else content
+    return title
+
+
+def new_conversation_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def _write_clock(conn: sqlite3.Connection) -> float:
+    """
+    Timestamp for a write, taken inside its transaction (writers are serialized by BEGIN
+    IMMEDIATE): never below an existing `updated`, so it also orders writes by commit.
+    """
+    latest = conn.execute("SELECT MAX(updated) FROM conversations").fetchone()[0]
+    now = time.time()
+    return now if latest is None or now > latest else latest + 1e-6
+
+
+def _summary(row: tuple) -> Dict:
+    return {"id": row[0], "title": row[1], "created": row[2], "updated": row[3], "message_count": row[4]}
+
+
+def _list_cursor(updated: float, conv_id: str) -> str:
+    return f"{updated!r}:{conv_id}"
+
+
+def _parse_list_cursor(cursor: str) -> Tuple[float, str]:
+    updated, _, conv_id = cursor.partition(":")
+    return float(updated), conv_id
+
+
+class ConversationStore:
+    """
+    Usage (see app.py):
+        store = ConversationStore("conversations.db")
+        store.init()                                         # schema + one-time JSON import
+        store.get("current")                                 # {"title", "messages"} or None
+        store.append_exchange("current", question, answer)   # (user_message, ai_response)
+        store.summaries(limit=50)                            # ([{"id", "title", ...}], next_cursor)
+        store.messages_page("current", limit=100)            # latest messages, older via before=
+    """
+
+    def __init__(self, path: str = DEFAULT_DB_FILE, legacy_json: Optional[str] = LEGACY_JSON_FILE):
+        self.path = path
+        self.legacy_json = legacy_json
+        self._local = threading.local()
+        self._init_lock = threading.RLock()
+        self._initialized = False
+
+    # ---------- connections ----------
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    def _db(self) -> sqlite3.Connection:
+        """This thread's connection, initializing the database on first use."""
+        if not self._initialized and not getattr(self._local, "initializing", False):
+            self.init()
+        return self._conn()
+
+    def _transaction(self):
+        return _Transaction(self._db())
+
+    def _snapshot(self):
+        """Read transaction: the statements inside see one consistent state."""
+        return _Transaction(self._db(), "BEGIN")
+
+    def close(self):
+        """Close this thread's connection."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    # ---------- setup ----------
+
+    def init(self, default_conversation: bool = True):
+        """Create the schema, import the legacy JSON file once, and make sure 'current' exists."""
+        with self._init_lock:
+            if self._initialized:
+                return
+            # Other threads wait on the lock; this thread's own calls below skip the init check
+            self._local.initializing = True
+            try:
+                with _Transaction(self._conn()) as conn:
+                    # executescript() would COMMIT the open transaction, so run the statements one by one
+                    for statement in SCHEMA.split(";"):
+                        if statement.strip():
+                            conn.execute(statement)
+                    # Databases created before conversations had an owner
+                    columns = {row[1] for row in conn.execute("PRAGMA table_info(conversations)")}
+                    if "owner" not in columns:
+                        conn.execute("ALTER TABLE conversations ADD COLUMN owner TEXT")
+                    conn.execute(
+                        "CREATE INDEX IF NOT EXISTS conversations_by_owner ON conversations (owner, updated, id)"
+                    )
+                if self.legacy_json and os.path.exists(self.legacy_json):
+                    self.migrate_json(self.legacy_json)
+                if default_conversation:
+                    self.create("current", "Current Conversation", exist_ok=True)
+                self._initialized = True
+            finally:
+                self._local.initializing = False
+
+    def migrate_json(self, json_path: str, force: bool = False) -> Tuple[int, int]:
+        """
+        Import conversations.json ({conv_id: {"title", "messages": [{"sender", "content"}]}}).
+        Runs once per database (recorded in meta) unless force=True; conversations that already
+        exist are skipped. Returns (conversations, messages) imported.
+        """
+        key = f"migrated:{os.path.abspath(json_path)}"
+        with self._transaction() as conn:
+            if not force and conn.execute("SELECT 1 FROM meta WHERE key = ?", (key,)).fetchone():
+                return 0, 0
+            with open(json_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            now = _write_clock(conn)
+            n_conversations = n_messages = 0
+            for i, (conv_id, conv) in enumerate(data.items()):
+                created = now + i * 1e-6  # keep the file's order
+                cur = conn.execute(
+                    "INSERT OR IGNORE INTO conversations (id, title, created, updated) VALUES (?, ?, ?, ?)",
+                    (conv_id, conv.get("title", "New Conversation"), created, created),
+                )
+                if cur.rowcount == 0:
+                    continue
+                n_conversations += 1
+                messages = conv.get("messages", [])
+                conn.executemany(
+                    "INSERT INTO messages (conversation_id, sender, content, created) VALUES (?, ?, ?, ?)",
+                    [(conv_id, m.get("sender", "user"), m.get("content", ""), created) for m in messages],
+                )
+                n_messages += len(messages)
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(now)))
+        print(f"[Conversation Store] Imported {n_conversations} conversations "
+              f"({n_messages} messages) from {json_path}")
+        return n_conversations, n_messages
+
+    # ---------- reads ----------
+
+    def exists(self, conv_id: str, owner: Optional[str] = None) -> bool:
+        """Whether the conversation exists (and, with an owner, belongs to that client)."""
+        if owner is None:
+            row = self._db().execute("SELECT 1 FROM conversations WHERE id = ?", (conv_id,)).fetchone()
+        else:
+            row = self._db().execute(
+                "SELECT 1 FROM conversations WHERE id = ? AND owner = ?", (conv_id, owner)
+            ).fetchone()
+        return row is not None
+
+    def get(self, conv_id: str) -> Optional[Dict]:
+        """{"title", "messages"} of one conversation, or None."""
+        with self._snapshot() as conn:
+            row = conn.execute("SELECT title FROM conversations WHERE id = ?", (conv_id,)).fetchone()
+            if row is None:
+                return None
+            messages = conn.execute(
+                "SELECT sender, content FROM messages WHERE conversation_id = ? ORDER BY id", (conv_id,)
+            ).fetchall()
+        return {"title": row[0], "messages": [{"sender": s, "content": c} for s, c in messages]}
+
+    def all(self) -> Dict[str, Dict]:
+        """Every conversation, in creation order (the shape conversations.json had)."""
+        with self._snapshot() as conn:
+            conversations = {
+                conv_id: {"title": title, "messages": []}
+                for conv_id, title in conn.execute("SELECT id, title FROM conversations ORDER BY created, rowid")
+            }
+            for conv_id, sender, content in conn.execute(
+                "SELECT conversation_id, sender, content FROM messages ORDER BY id"
+            ):
+                if conv_id in conversations:
+                    conversations[conv_id]["messages"].append({"sender": sender, "content": content})
+        return conversations
+
+    def version(self, conv_id: Optional[str] = None, owner: Optional[str] = None) -> Optional[Tuple[float, int]]:
+        """
+        Cheap change marker for ETags: (latest updated, number of conversations) of the store,
+        or (updated, message count) of one conversation (None if it does not exist).
+        With an owner only that client's conversations count.
+        """
+        conn = self._db()
+        owned, params = (" AND owner = ?", (owner,)) if owner is not None else ("", ())
+        if conv_id is None:
+            row = conn.execute(
+                "SELECT COALESCE(MAX(updated), 0), COUNT(*) FROM conversations WHERE 1 = 1" + owned, params
+            ).fetchone()
+            return row[0], row[1]
+        row = conn.execute(
+            "SELECT updated, (SELECT COUNT(*) FROM messages WHERE conversation_id = ?) "
+            "FROM conversations WHERE id = ?" + owned, (conv_id, conv_id) + params
+        ).fetchone()
+        return (row[0], row[1]) if row is not None else None
+
+    def summaries(self, limit: int = 50, cursor: Optional[str] = None, since: Optional[float] = None,
+                  owner: Optional[str] = None) -> Tuple[List[Dict], Optional[str], float]:
+        """
+        One page of conversation summaries ({"id", "title", "created", "updated",
+        "message_count"}), most recently updated first.
+        cursor: next_cursor of the previous page; since: only conversations updated after this
+        sync token; owner: only that client's conversations.
+        Returns (summaries, next_cursor or None, sync token for the next since=).
+        """
+        where, params = [], []
+        if owner is not None:
+            where.append("c.owner = ?")
+            params.append(owner)
+        if since is not None:
+            where.append("c.updated > ?")
+            params.append(since)
+        if cursor:
+            updated, conv_id = _parse_list_cursor(cursor)
+            where.append("(c.updated < ? OR (c.updated = ? AND c.id < ?))")
+            params += [updated, updated, conv_id]
+        sql = (
+            "SELECT c.id, c.title, c.created, c.updated, "
+            "(SELECT COUNT(*) FROM messages m WHERE m.conversation_id = c.id) "
+            "FROM conversations c"
+            + (" WHERE " + " AND ".join(where) if where else "")
+            + " ORDER BY c.updated DESC, c.id DESC LIMIT ?"
+        )
+        with self._snapshot() as conn:
+            sync = conn.execute("SELECT COALESCE(MAX(updated), 0) FROM conversations").fetchone()[0]
+            rows = conn.execute(sql, params + [limit + 1]).fetchall()
+        page = [_summary(row) for row in rows[:limit]]
+        next_cursor = _list_cursor(page[-1]["updated"], page[-1]["id"]) if len(rows) > limit else None
+        return page, next_cursor, sync
+
+    def messages_page(self, conv_id: str, limit: int = 100, after: Optional[int] = None,
+                      before: Optional[int] = None) -> Optional[Dict]:
+        """
+        One page of a conversation's messages ({"id", "sender", "content", "created"}), oldest
+        first; None if the conversation does not exist.
+        - after=<message id>: the messages following it (incremental fetch); next_cursor is the
+          after= of the next page while more remain
+        - otherwise the latest messages (before=<message id>: the ones preceding it);
+          next_cursor is the before= of the previous, older page
+        """
+        with self._snapshot() as conn:
+            row = conn.execute("SELECT title, updated FROM conversations WHERE id = ?", (conv_id,)).fetchone()
+            if row is None:
+                return None
+            if after is not None:
+                rows = conn.execute(
+                    "SELECT id, sender, content, created FROM messages "
+                    "WHERE conversation_id = ? AND id > ? ORDER BY id LIMIT ?",
+                    (conv_id, after, limit + 1),
+                ).fetchall()
+                more = len(rows) > limit
+                rows = rows[:limit]
+            else:
+                rows = conn.execute(
+                    "SELECT id, sender, content, created FROM messages "
+                    "WHERE conversation_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                    (conv_id, before if before is not None else 2 ** 63 - 1, limit + 1),
+                ).fetchall()
+                more = len(rows) > limit
+                rows = rows[:limit][::-1]
+        messages = [{"id": i, "sender": s, "content": c, "created": t} for i, s, c, t in rows]
+        if more and messages:
+            next_cursor = messages[-1]["id"] if after is not None else messages[0]["id"]
+        else:
+            next_cursor = None
+        return {"id": conv_id, "title": row[0], "updated": row[1], "messages": messages, "next_cursor": next_cursor}
+
+    # ---------- writes ----------
+
+    def create(self, conv_id: str, title: str = "New Conversation", exist_ok: bool = False,
+               owner: Optional[str] = None) -> bool:
+        """Create an empty conversation; False if it already existed (error unless exist_ok)."""
+        with self._transaction() as conn:
+            now = _write_clock(conn)
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO conversations (id, title, created, updated, owner) VALUES (?, ?, ?, ?, ?)",
+                (conv_id, title, now, now, owner),
+            )
+        if cur.rowcount == 0 and not exist_ok:
+            raise KeyError(f"Conversation {conv_id!r} already exists")
+        return cur.rowcount == 1
+
+    def summary(self, conv_id: str) -> Optional[Dict]:
+        """{"id", "title", "created", "updated", "message_count"} of one conversation, or None."""
+        row = self._db().execute(
+            "SELECT id, title, created, updated, (SELECT COUNT(*) FROM messages WHERE conversation_id = ?) "
+            "FROM conversations WHERE id = ?", (conv_id, conv_id)
+        ).fetchone()
+        return _summary(row) if row is not None else None
+
+    @traced("save_conversation")
+    def append_messages(self, conv_id: str, messages: List[Dict]) -> bool:
+        """
+        Append messages ({"sender", "content"}) to a conversation in one transaction; the first
+        user message replaces a placeholder title. False if the conversation does not exist.
+        """
+        annotate(conversation_id=conv_id, messages=len(messages))
+        with self._transaction() as conn:
+            row = conn.execute("SELECT title FROM conversations WHERE id = ?", (conv_id,)).fetchone()
+            if row is None:
+                return False
+            now = _write_clock(conn)
+            title = row[0]
+            for m in messages:
+                if m["sender"] == "user":
+                    title = title_after(title, m["content"])
+            conn.executemany(
+                "INSERT INTO messages (conversation_id, sender, content, created) VALUES (?, ?, ?, ?)",
+                [(conv_id, m["sender"], m["content"], now) for m in messages],
+            )
+            conn.execute("UPDATE conversations SET title = ?, updated = ? WHERE id = ?", (title, now, conv_id))
+        return True
+
+    def append_exchange(self, conv_id: str, user_content: str, ai_content: str) -> Tuple[Optional[Dict], Optional[Dict]]:
+        """Append a user message + AI response; (None, None) if the conversation does not exist."""
+        user_message = {'sender': 'user', 'content': user_content}
+        ai_response = {'sender': 'ai', 'content': ai_content}
+        if not self.append_messages(conv_id, [user_message, ai_response]):
+            return None, None
+        return user_message, ai_response
+
+    def delete(self, conv_id: str) -> bool:
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM messages WHERE conversation_id = ?", (conv_id,))
+            cur = conn.execute("DELETE FROM conversations WHERE id = ?", (conv_id,))
+        return cur.rowcount == 1
+
+    def stats(self) -> Dict:
+        conn = self._db()
+        return {
+            "path": self.path,
+            "conversations": conn.execute("SELECT COUNT(*) FROM conversations").fetchone()[0],
+            "messages": conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0],
+        }
+
+
+class _Transaction:
+    """
+    BEGIN ... COMMIT / ROLLBACK. Writes use BEGIN IMMEDIATE, which takes the write lock up front
+    so two writers never deadlock upgrading from a read lock.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, begin: str = "BEGIN IMMEDIATE"):
+        self.conn = conn
+        self.begin = begin
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.conn.execute(self.begin)
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Conversation store maintenance")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_migrate = sub.add_parser("migrate", help="import a conversations.json file")
+    p_migrate.add_argument("--json", default=LEGACY_JSON_FILE)
+    p_migrate.add_argument("--db", default=DEFAULT_DB_FILE)
+    p_migrate.add_argument("--force", action="store_true", help="import again even if already imported")
+
+    p_info = sub.add_parser("info", help="show conversation / message counts")
+    p_info.add_argument("--db", default=DEFAULT_DB_FILE)
+
+    p_export = sub.add_parser("export", help="write all conversations as conversations.json-style JSON")
+    p_export.add_argument("--db", default=DEFAULT_DB_FILE)
+    p_export.add_argument("--out", default="conversations.export.json")
+
+    args = parser.parse_args()
+    store = ConversationStore(args.db, legacy_json=None)
+    store.init(default_conversation=False)
+    if args.command == "migrate":
+        store.migrate_json(args.json, force=args.force)
+    elif args.command == "info":
+        print(json.dumps(store.stats(), indent=2))
+    elif args.command == "export":
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(store.all(), f, ensure_ascii=False, indent=2)
+        print(f"Wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
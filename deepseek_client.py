@@ -3,38 +3,244 @@ DeepSeek API 客户端封装
 使用 OpenAI SDK 与 DeepSeek API 交互（DeepSeek API 兼容 OpenAI 格式）
 """
 
-from openai import OpenAI
+import asyncio
+import contextvars
+import httpx
+from openai import AsyncOpenAI, OpenAI
+import threading
 import time
-import os
-from typing import List, Dict  # 添加这行导入
+from typing import AsyncIterator, List, Dict, Iterator, Optional  # 添加这行导入
 
-class DeepSeekClient:
-    """DeepSeek API 客户端类"""
+from llm_config import LLMConfig, default_llm_config
+from resilience import CallGuard, default_call_guard
+from tracing import annotate, traced
+from usage_ledger import UsageLedger, default_usage_ledger
 
-    def __init__(self):
-        """初始化 DeepSeek 客户端"""
-        # 验证配置
+
+class DeepSeekAPIError(Exception):
+    """
+    DeepSeek API 调用失败（重试用尽、不可重试的错误，或熔断器打开时的快速失败）
+    cause 为原始异常（openai / httpx 异常或 resilience.CircuitOpenError）
+    """
+
+    def __init__(self, message: str, cause: Optional[BaseException] = None):
+        super().__init__(message)
+        self.cause = cause
+
+
+def _field(obj, name: str):
+    """对象属性或字典键（旧版 SDK 把流式分片里的 usage 保留为普通 dict）"""
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+def extract_usage(response) -> Dict[str, int]:
+    """
+    从 API 响应中提取 token 用量（兼容 DeepSeek 与 OpenAI 字段）:
+    - prompt_tokens / completion_tokens
+    - cache_hit_tokens: DeepSeek 的 prompt_cache_hit_tokens，或 OpenAI 的 prompt_tokens_details.cached_tokens
+    - cache_miss_tokens: DeepSeek 的 prompt_cache_miss_tokens（缺省时为 prompt_tokens - cache_hit_tokens）
+    """
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return {}
+    prompt_tokens = _field(usage, "prompt_tokens") or 0
+    hit = _field(usage, "prompt_cache_hit_tokens")
+    if hit is None:
+        details = _field(usage, "prompt_tokens_details")
+        hit = _field(details, "cached_tokens") if details is not None else None
+    hit = hit or 0
+    miss = _field(usage, "prompt_cache_miss_tokens")
+    if miss is None:
+        miss = max(0, prompt_tokens - hit)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": _field(usage, "completion_tokens") or 0,
+        "cache_hit_tokens": hit,
+        "cache_miss_tokens": miss,
+    }
+
+
+# ==================== Connection Pool Configuration ====================
+# 每个进程共享一个 HTTP 连接池（同步、异步各一个），所有客户端实例复用 keep-alive 连接。
+# 连接数、超时等取自进程级配置 llm_config.default_llm_config()（配置文件 + 环境变量
+# DEEPSEEK_MAX_CONNECTIONS / DEEPSEEK_MAX_KEEPALIVE_CONNECTIONS / DEEPSEEK_TIMEOUT / DEEPSEEK_CONNECT_TIMEOUT）。
+# AsyncDeepSeekClient 同时在途的最大请求数默认与连接数上限相同（DEEPSEEK_MAX_CONCURRENCY）：
+# 超出的请求在信号量上排队，而不是在 httpx 连接池里排队，后者在排队请求很多时开销明显
+
+_pool_lock = threading.Lock()
+_sync_http_client: Optional[httpx.Client] = None
+_async_http_client: Optional[httpx.AsyncClient] = None
+
+
+def _pool_limits() -> httpx.Limits:
+    config = default_llm_config()
+    return httpx.Limits(
+        max_connections=config.max_connections,
+        max_keepalive_connections=config.max_keepalive_connections,
+    )
+
+
+def _pool_timeout() -> httpx.Timeout:
+    config = default_llm_config()
+    return httpx.Timeout(config.timeout, connect=config.connect_timeout)
+
+
+def shared_http_client() -> httpx.Client:
+    """进程内共享的同步 HTTP 连接池（首次调用时创建）"""
+    global _sync_http_client
+    if _sync_http_client is None:
+        with _pool_lock:
+            if _sync_http_client is None:
+                _sync_http_client = httpx.Client(limits=_pool_limits(), timeout=_pool_timeout())
+    return _sync_http_client
+
+
+def shared_async_http_client() -> httpx.AsyncClient:
+    """
+    进程内共享的异步 HTTP 连接池（首次调用时创建）
+    注意：连接绑定在首次使用它的事件循环上，一个进程应只在一个事件循环中使用它
+    """
+    global _async_http_client
+    if _async_http_client is None or _async_http_client.is_closed:
+        with _pool_lock:
+            if _async_http_client is None or _async_http_client.is_closed:
+                _async_http_client = httpx.AsyncClient(limits=_pool_limits(), timeout=_pool_timeout())
+    return _async_http_client
+
+
+async def close_async_http_client():
+    """关闭共享的异步连接池（在 ASGI 应用 shutdown 时调用）"""
+    global _async_http_client
+    with _pool_lock:
+        client, _async_http_client = _async_http_client, None
+    if client is not None and not client.is_closed:
+        await client.aclose()
+
+
+class _DeepSeekBase:
+    """同步 / 异步客户端共用的配置、token 用量统计与重试 / 熔断（resilience.CallGuard）"""
+
+    def __init__(self, timeout: Optional[float] = None, guard: Optional[CallGuard] = None,
+                 ledger: Optional[UsageLedger] = None, base_url: Optional[str] = None,
+                 config: Optional[LLMConfig] = None):
         # ==================== API Configuration ====================
-        DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY", "your_api_key")
-        DEEPSEEK_BASE_URL = "https://api.deepseek.com"
-        MODEL_NAME = "deepseek-chat"
+        # 默认取进程级配置（llm_config.json / TA_LLM_CONFIG 配置文件 + DEEPSEEK_* 环境变量），
+        # 可指向任意 OpenAI 兼容服务（本地推理服务、区域端点、benchmarks/fake_llm_server.py 等）
+        self.config = config if config is not None else default_llm_config()
+        self.api_key = self.config.api_key
+        # base_url 参数优先于配置
+        self.base_url = base_url or self.config.base_url
 
-        # 创建 OpenAI 客户端，指向 DeepSeek API
+        # ==================== AI Behavior Parameters ====================
+        # 客户端默认值；各 agent 可在配置中单独指定 model / max_tokens / temperature，
+        # 并在每次调用时通过 model / max_tokens / temperature 参数传入
+        self.model = self.config.model
+        self.temperature = self.config.temperature
+        self.max_tokens = self.config.max_tokens
+
+        # 重试 / 退避 / 熔断：默认与进程内所有客户端共享一个 CallGuard（同一个上游），
+        # 因此 SDK 自带的重试关闭（max_retries=0），避免重复重试
+        self.timeout = timeout if timeout is not None else self.config.timeout
+        self.guard = guard if guard is not None else default_call_guard()
+        # 按会话 / agent / 路由记录每次调用的 token 用量（见 usage_ledger.py）
+        self.ledger = ledger if ledger is not None else default_usage_ledger()
+
+        # Token 用量统计（客户端在多线程 / 多个协程间共享，因此加锁；
+        # last_usage / last_ttft 用 contextvars 保存，每个线程和每个 asyncio 任务互不干扰）
+        self._usage_lock = threading.Lock()
+        self._last_usage_var = contextvars.ContextVar(f"deepseek_last_usage_{id(self)}", default={})
+        self._last_ttft_var = contextvars.ContextVar(f"deepseek_last_ttft_{id(self)}", default=None)
+        self.usage_totals = {
+            "calls": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "cache_hit_tokens": 0,
+            "cache_miss_tokens": 0,
+        }
+
+    @property
+    def last_usage(self) -> Dict[str, int]:
+        """当前线程 / 协程最近一次调用的 token 用量"""
+        return self._last_usage_var.get()
+
+    @property
+    def last_ttft(self) -> Optional[float]:
+        """当前线程 / 协程最近一次流式调用的首个 token 时间（秒）"""
+        return self._last_ttft_var.get()
+
+    def _record_usage(self, response) -> Dict[str, int]:
+        usage = extract_usage(response)
+        self._last_usage_var.set(usage)
+        annotate(**usage)
+        self.ledger.record(usage)
+        with self._usage_lock:
+            self.usage_totals["calls"] += 1
+            for key, value in usage.items():
+                self.usage_totals[key] = self.usage_totals.get(key, 0) + value
+        return usage
+
+    def usage_stats(self) -> Dict:
+        """累计 token 用量与前缀缓存命中率"""
+        with self._usage_lock:
+            stats = dict(self.usage_totals)
+        prompt = stats["cache_hit_tokens"] + stats["cache_miss_tokens"]
+        stats["cache_hit_ratio"] = round(stats["cache_hit_tokens"] / prompt, 4) if prompt else 0.0
+        return stats
+
+    def resilience_stats(self) -> Dict:
+        """重试次数、退避时间、熔断器状态等统计"""
+        return self.guard.stats()
+
+    def _request_kwargs(self, system_prompt: str, messages: list, temperature: Optional[float],
+                        timeout: Optional[float] = None, model: Optional[str] = None,
+                        max_tokens: Optional[int] = None) -> Dict:
+        model = model or self.model
+        annotate(model=model, messages=len(messages) + 1)
+        return {
+            "model": model,
+            "messages": [{"role": "system", "content": system_prompt}] + messages,
+            "temperature": temperature if temperature is not None else self.temperature,
+            "max_tokens": max_tokens or self.max_tokens,
+            "timeout": timeout if timeout is not None else self.timeout,
+        }
+
+    @staticmethod
+    def _error(e: Exception) -> DeepSeekAPIError:
+        error_msg = f"❌ DeepSeek API 调用失败: {str(e)}"
+        print(error_msg)
+        return DeepSeekAPIError(error_msg, e)
+
+
+class DeepSeekClient(_DeepSeekBase):
+    """
+    DeepSeek API 客户端类
+    - timeout: 单次调用超时（秒，默认 DEEPSEEK_TIMEOUT），各方法也可用 timeout 参数按调用覆盖
+    - 可重试的失败（连接错误、超时、429、5xx）按 resilience.RetryPolicy 带抖动指数退避重试，
+      遵守 Retry-After；上游连续失败时熔断器打开，调用直接以 DeepSeekAPIError 快速失败
+    - base_url: OpenAI 兼容服务地址（默认取配置，离线基准测试指向 benchmarks/fake_llm_server.py）
+    - config: llm_config.LLMConfig（默认进程级配置）：模型、max_tokens、超时及各 agent 的单独设置
+    """
+
+    def __init__(self, timeout: Optional[float] = None, guard: Optional[CallGuard] = None,
+                 ledger: Optional[UsageLedger] = None, base_url: Optional[str] = None,
+                 config: Optional[LLMConfig] = None):
+        """初始化 DeepSeek 客户端"""
+        super().__init__(timeout, guard, ledger, base_url, config)
+
+        # 创建 OpenAI 客户端，指向 DeepSeek API（复用进程共享的连接池）
         self.client = OpenAI(
-            api_key=DEEPSEEK_API_KEY,
-            base_url=DEEPSEEK_BASE_URL
+            api_key=self.api_key,
+            base_url=self.base_url,
+            http_client=shared_http_client(),
+            max_retries=0,
         )
 
-        
-    # ==================== AI Behavior Parameters ====================
-        TEMPERATURE = 0.9
-        MAX_TOKENS = 1500
-    
-        self.model = MODEL_NAME
-        self.temperature = TEMPERATURE
-        self.max_tokens = MAX_TOKENS
-
-    def chat(self, system_prompt: str, user_message: str, temperature: float = None) -> str:
+    @traced("llm.chat")
+    def chat(self, system_prompt: str, user_message: str, temperature: float = None,
+             timeout: Optional[float] = None, model: Optional[str] = None,
+             max_tokens: Optional[int] = None) -> str:
         """
         发送聊天请求到 DeepSeek API
 
@@ -42,6 +248,8 @@ class DeepSeekClient:
             system_prompt: 系统提示词（定义 AI 角色）
             user_message: 用户消息内容
             temperature: 温度参数（可选，默认使用配置值）
+            timeout: 本次调用的超时（秒，可选）
+            model / max_tokens: 本次调用使用的模型 / 最大输出 token 数（可选，默认使用配置值）
 
         返回:
             AI 生成的回复内容
@@ -50,38 +258,38 @@ class DeepSeekClient:
             # 记录开始时间
             start_time = time.time()
 
-            # 调用 DeepSeek API
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ],
-                temperature=temperature if temperature is not None else self.temperature,
-                max_tokens=self.max_tokens
+            # 调用 DeepSeek API（失败时按重试策略重试）
+            kwargs = self._request_kwargs(
+                system_prompt, [{"role": "user", "content": user_message}], temperature, timeout, model, max_tokens
             )
+            response = self.guard.call(lambda: self.client.chat.completions.create(**kwargs))
 
             # 记录结束时间
             elapsed_time = time.time() - start_time
 
             # 提取回复内容
             reply = response.choices[0].message.content
+            usage = self._record_usage(response)
 
             # 打印调试信息（可选）
             print(f"⏱️  API 响应时间: {elapsed_time:.2f}秒")
+            if usage:
+                print(f"🧮 Prompt tokens: {usage['prompt_tokens']} (缓存命中 {usage['cache_hit_tokens']})")
 
             return reply
 
         except Exception as e:
-            error_msg = f"❌ DeepSeek API 调用失败: {str(e)}"
-            print(error_msg)
-            raise Exception(error_msg)
+            raise self._error(e) from e
 
+    @traced("llm.chat")
     def chat_with_context(
         self,
         system_prompt: str,
         messages: list,
-        temperature: float = None
+        temperature: float = None,
+        timeout: Optional[float] = None,
+        model: Optional[str] = None,
+        max_tokens: Optional[int] = None,
     ) -> str:
         """
         带上下文的聊天请求（支持多轮对话）
@@ -90,32 +298,103 @@ class DeepSeekClient:
             system_prompt: 系统提示词
             messages: 消息历史列表 [{"role": "user/assistant", "content": "..."}]
             temperature: 温度参数（可选）
+            timeout: 本次调用的超时（秒，可选）
+            model / max_tokens: 本次调用使用的模型 / 最大输出 token 数（可选）
 
         返回:
             AI 生成的回复内容
         """
         try:
-            # 构建完整的消息列表
-            full_messages = [{"role": "system", "content": system_prompt}] + messages
-
-            # 调用 API
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=full_messages,
-                temperature=temperature if temperature is not None else self.temperature,
-                max_tokens=self.max_tokens
-            )
+            # 构建完整的消息列表并调用 API（失败时按重试策略重试）
+            kwargs = self._request_kwargs(system_prompt, messages, temperature, timeout, model, max_tokens)
+            response = self.guard.call(lambda: self.client.chat.completions.create(**kwargs))
 
             # 提取回复
             reply = response.choices[0].message.content
+            usage = self._record_usage(response)
+            if usage:
+                print(f"🧮 Prompt tokens: {usage['prompt_tokens']} (缓存命中 {usage['cache_hit_tokens']})")
             return reply
 
         except Exception as e:
-            error_msg = f"❌ DeepSeek API 调用失败: {str(e)}"
-            print(error_msg)
-            raise Exception(error_msg)
+            raise self._error(e) from e
     
-    def chat_with_history(self, system_prompt: str, messages: List[Dict], temperature: float = 0.0) -> str:
+    def chat_stream(self, system_prompt: str, user_message: str, temperature: float = None,
+                    timeout: Optional[float] = None, model: Optional[str] = None,
+                    max_tokens: Optional[int] = None) -> Iterator[str]:
+        """
+        流式版本的 chat：逐段产出（yield）AI 回复的增量文本
+
+        参数与 chat 相同；首个 token 到达时间记录在 last_ttft（秒）
+        """
+        return self.chat_with_context_stream(
+            system_prompt, [{"role": "user", "content": user_message}], temperature, timeout, model, max_tokens
+        )
+
+    @traced("llm.chat", stream=True)
+    def chat_with_context_stream(
+        self,
+        system_prompt: str,
+        messages: list,
+        temperature: float = None,
+        timeout: Optional[float] = None,
+        model: Optional[str] = None,
+        max_tokens: Optional[int] = None,
+    ) -> Iterator[str]:
+        """
+        流式版本的 chat_with_context（支持多轮对话）
+
+        返回:
+            增量文本的生成器；流结束时记录 token 用量（若 API 在最后一个分片中返回 usage）
+            只有在还没有产出任何文本时失败才会重试（已产出的文本无法撤回）
+        """
+        kwargs = self._request_kwargs(system_prompt, messages, temperature, timeout, model, max_tokens)
+        start_time = time.time()
+        self._last_ttft_var.set(None)
+        attempt = 0
+        while True:
+            streamed = False
+            try:
+                self.guard.before_call(attempt)
+                stream = self.client.chat.completions.create(
+                    **kwargs,
+                    stream=True,
+                    # 让兼容 OpenAI 的服务在最后一个分片中返回 usage
+                    extra_body={"stream_options": {"include_usage": True}},
+                )
+                self.guard.record_success()
+                for chunk in stream:
+                    if getattr(chunk, "usage", None):
+                        self._record_usage(chunk)
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        if self._last_ttft_var.get() is None:
+                            self._last_ttft_var.set(time.time() - start_time)
+                            annotate(ttft_ms=round(self._last_ttft_var.get() * 1000, 1))
+                            print(f"⏱️  首个 token 时间: {self._last_ttft_var.get():.2f}秒")
+                        streamed = True
+                        yield delta
+                break
+            except Exception as e:
+                delay = None if streamed else self.guard.retry_delay(e, attempt)
+                if delay is None:
+                    raise self._error(e) from e
+            time.sleep(delay)
+            attempt += 1
+
+        print(f"⏱️  API 响应时间（流式）: {time.time() - start_time:.2f}秒")
+
+    def chat_with_history_stream(self, system_prompt: str, messages: List[Dict], temperature: float = 0.0,
+                                 timeout: Optional[float] = None, model: Optional[str] = None,
+                                 max_tokens: Optional[int] = None) -> Iterator[str]:
+        """流式版本的 chat_with_history"""
+        return self.chat_with_context_stream(system_prompt, messages, temperature, timeout, model, max_tokens)
+
+    def chat_with_history(self, system_prompt: str, messages: List[Dict], temperature: float = 0.0,
+                          timeout: Optional[float] = None, model: Optional[str] = None,
+                          max_tokens: Optional[int] = None) -> str:
         """
         支持历史记录的聊天方法（兼容之前的 chat_with_context）
         
@@ -123,11 +402,159 @@ class DeepSeekClient:
             system_prompt: 系统提示词
             messages: 消息历史列表 [{"role": "user/assistant", "content": "..."}]
             temperature: 温度参数
+            timeout: 本次调用的超时（秒，可选）
+            model / max_tokens: 本次调用使用的模型 / 最大输出 token 数（可选）
             
         返回:
             AI 生成的回复内容
         """
-        return self.chat_with_context(system_prompt, messages, temperature)
+        return self.chat_with_context(system_prompt, messages, temperature, timeout, model, max_tokens)
+
+
+class AsyncDeepSeekClient(_DeepSeekBase):
+    """
+    DeepSeek API 异步客户端（基于 AsyncOpenAI），接口与 DeepSeekClient 相同，但方法都是协程：
+        await client.chat(...) / chat_with_context(...) / chat_with_history(...)
+        async for delta in client.chat_with_context_stream(...)
+    - 所有实例共享进程内一个异步 HTTP 连接池（DEEPSEEK_MAX_CONNECTIONS / DEEPSEEK_MAX_KEEPALIVE_CONNECTIONS）
+    - 每个实例最多 max_concurrency 个请求同时在途（默认 DEEPSEEK_MAX_CONCURRENCY），超出的请求排队等待
+    - 超时、重试与熔断同 DeepSeekClient；重试前的退避等待不占用并发名额
+    """
+
+    def __init__(self, max_concurrency: Optional[int] = None, timeout: Optional[float] = None,
+                 guard: Optional[CallGuard] = None, ledger: Optional[UsageLedger] = None,
+                 base_url: Optional[str] = None, config: Optional[LLMConfig] = None):
+        """初始化异步 DeepSeek 客户端"""
+        super().__init__(timeout, guard, ledger, base_url, config)
+
+        self.client = AsyncOpenAI(
+            api_key=self.api_key,
+            base_url=self.base_url,
+            http_client=shared_async_http_client(),
+            max_retries=0,
+        )
+        self.max_concurrency = max(1, int(max_concurrency or self.config.concurrency))
+        # Semaphore 在首次请求时于运行中的事件循环里创建
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def _limiter(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def _create(self, kwargs: Dict):
+        async with self._limiter():
+            return await self.client.chat.completions.create(**kwargs)
+
+    async def chat(self, system_prompt: str, user_message: str, temperature: float = None,
+                   timeout: Optional[float] = None, model: Optional[str] = None,
+                   max_tokens: Optional[int] = None) -> str:
+        """异步版本的 DeepSeekClient.chat"""
+        return await self.chat_with_context(
+            system_prompt, [{"role": "user", "content": user_message}], temperature, timeout, model, max_tokens
+        )
+
+    @traced("llm.chat")
+    async def chat_with_context(
+        self,
+        system_prompt: str,
+        messages: list,
+        temperature: float = None,
+        timeout: Optional[float] = None,
+        model: Optional[str] = None,
+        max_tokens: Optional[int] = None,
+    ) -> str:
+        """异步版本的 DeepSeekClient.chat_with_context（支持多轮对话）"""
+        try:
+            kwargs = self._request_kwargs(system_prompt, messages, temperature, timeout, model, max_tokens)
+            start_time = time.time()
+            response = await self.guard.acall(lambda: self._create(kwargs))
+            elapsed_time = time.time() - start_time
+
+            reply = response.choices[0].message.content
+            usage = self._record_usage(response)
+            print(f"⏱️  API 响应时间（异步）: {elapsed_time:.2f}秒")
+            if usage:
+                print(f"🧮 Prompt tokens: {usage['prompt_tokens']} (缓存命中 {usage['cache_hit_tokens']})")
+            return reply
+
+        except Exception as e:
+            raise self._error(e) from e
+
+    def chat_stream(self, system_prompt: str, user_message: str, temperature: float = None,
+                    timeout: Optional[float] = None, model: Optional[str] = None,
+                    max_tokens: Optional[int] = None) -> AsyncIterator[str]:
+        """异步流式版本的 chat"""
+        return self.chat_with_context_stream(
+            system_prompt, [{"role": "user", "content": user_message}], temperature, timeout, model, max_tokens
+        )
+
+    @traced("llm.chat", stream=True)
+    async def chat_with_context_stream(
+        self,
+        system_prompt: str,
+        messages: list,
+        temperature: float = None,
+        timeout: Optional[float] = None,
+        model: Optional[str] = None,
+        max_tokens: Optional[int] = None,
+    ) -> AsyncIterator[str]:
+        """
+        异步流式版本的 chat_with_context
+
+        返回:
+            增量文本的异步生成器；整个流占用一个并发名额，直到流结束
+            只有在还没有产出任何文本时失败才会重试
+        """
+        kwargs = self._request_kwargs(system_prompt, messages, temperature, timeout, model, max_tokens)
+        start_time = time.time()
+        self._last_ttft_var.set(None)
+        attempt = 0
+        while True:
+            streamed = False
+            try:
+                async with self._limiter():
+                    self.guard.before_call(attempt)
+                    stream = await self.client.chat.completions.create(
+                        **kwargs,
+                        stream=True,
+                        extra_body={"stream_options": {"include_usage": True}},
+                    )
+                    self.guard.record_success()
+                    async for chunk in stream:
+                        if getattr(chunk, "usage", None):
+                            self._record_usage(chunk)
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta.content
+                        if delta:
+                            if self._last_ttft_var.get() is None:
+                                self._last_ttft_var.set(time.time() - start_time)
+                                annotate(ttft_ms=round(self._last_ttft_var.get() * 1000, 1))
+                                print(f"⏱️  首个 token 时间: {self._last_ttft_var.get():.2f}秒")
+                            streamed = True
+                            yield delta
+                break
+            except Exception as e:
+                delay = None if streamed else self.guard.retry_delay(e, attempt)
+                if delay is None:
+                    raise self._error(e) from e
+            await asyncio.sleep(delay)
+            attempt += 1
+
+        print(f"⏱️  API 响应时间（流式）: {time.time() - start_time:.2f}秒")
+
+    def chat_with_history_stream(self, system_prompt: str, messages: List[Dict], temperature: float = 0.0,
+                                 timeout: Optional[float] = None, model: Optional[str] = None,
+                                 max_tokens: Optional[int] = None) -> AsyncIterator[str]:
+        """异步流式版本的 chat_with_history"""
+        return self.chat_with_context_stream(system_prompt, messages, temperature, timeout, model, max_tokens)
+
+    async def chat_with_history(self, system_prompt: str, messages: List[Dict], temperature: float = 0.0,
+                                timeout: Optional[float] = None, model: Optional[str] = None,
+                                max_tokens: Optional[int] = None) -> str:
+        """异步版本的 chat_with_history"""
+        return await self.chat_with_context(system_prompt, messages, temperature, timeout, model, max_tokens)
 
 
 # 测试代码
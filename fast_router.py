@@ -0,0 +1,327 @@
+"""
+Local fast-path router.
+
+Classifies obvious questions without the RouterAgent LLM call:
+1. keyword / regex rules (posted code, exam answers, practice and review requests, labs)
+   (logistics and bare code keywords like "IndexError" only pass the default threshold when
+   the model agrees)
+2. a multinomial naive Bayes model over CourseKnowledgeBase._tokenize tokens (plus adjacent
+   token bigrams), trained at startup on a small labeled file (router_labels.jsonl)
+
+FastRouter.route(question) returns a FastRoute with a confidence in [0, 1], or None when
+neither stage reaches the threshold, in which case the caller asks the LLM router.
+Decisions the LLM router makes can be appended to a JSONL log (TA_ROUTER_LOG) in the
+same format as the labeled file, to grow the training set.
+
+Environment:
+    TA_FAST_ROUTER            "off" disables the fast path (every question goes to the LLM)
+    TA_FAST_ROUTER_THRESHOLD  minimum confidence to skip the LLM (default 0.9)
+    TA_ROUTER_LABELS          labeled training file (default router_labels.jsonl)
+    TA_ROUTER_LOG             optional JSONL file to record LLM router decisions
+
+Evaluate against the LLM router with benchmarks/eval_router.py.
+"""
+
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_LABELS_FILE = os.getenv(
+    "TA_ROUTER_LABELS", os.path.join(os.path.dirname(os.path.abspath(__file__)), "router_labels.jsonl")
+)
+DEFAULT_THRESHOLD = float(os.getenv("TA_FAST_ROUTER_THRESHOLD", "0.9"))
+
+# Keyword lists shared with TeachingAssistant's assignment fallback
+LAB_KEYWORDS = ["lab", "exercise", "experiment", "homework", "assignment", "作业", "练习", "实验"]
+EXAM_KEYWORDS = ["exam", "midterm", "final", "quiz", "test", "考试", "期中", "期末", "小测", "考卷", "试卷"]
+CODE_KEYWORDS = ["code", "c++", "java", "python", "implementation", "compile", "error", "代码", "实现", "报错"]
+
+# Where each question type goes when the type alone decides it
+TYPE_ROUTES = {
+    "concept": "ConceptAgent",
+    "code": "CodeAgent",
+    "assignment": "ConceptAgent",
+    "practice": "PracticeAgent",
+    "review": "ReviewAgent",
+    "logistics": "None",
+    "out_of_scope": "None",
+}
+
+CODE_RE = re.compile(
+    r"```|#include\s*<|\bint\s+main\s*\(|\bdef\s+\w+\s*\(|\bpublic\s+(static\s+)?\w+|\bTraceback \(most recent call last\)"
+    r"|segmentation fault|\bsegfault\b|[;{}]\s*$"
+    r"|\bfor\s+\w+\s+in\s+\w+|\bmy (code|implementation|program)\b|我的代码|这段.{0,4}代码",
+    re.IGNORECASE | re.MULTILINE,
+)
+# Also found in concept questions ("what causes a StackOverflowError", "what does a for (...) loop
+# cost"), so on their own these only route to CodeAgent when the model agrees
+WEAK_CODE_RE = re.compile(r"\b\w+(Error|Exception)\b|\b(for|while|if)\s*\(.*\)")
+FULL_ANSWER_RE = re.compile(
+    r"\b(full|complete|whole)\s+(answer|solution|code)\b|\banswer (to|for)\b|\bsolve (this|it) for me\b"
+    r"|\bdo my (homework|assignment|lab)\b|\bwrite .{0,30}\bfor my (homework|assignment|lab)\b"
+    r"|答案|完整代码|帮我写作业|直接交",
+    re.IGNORECASE,
+)
+# "give me hints, not the answer" must not count as asking for the answer
+NO_ANSWER_RE = re.compile(
+    r"\b(don'?t|do not|without)\b.{0,20}\b(answer|solution|full code)|(不要|别|不用|无需).{0,6}(答案|代码)",
+    re.IGNORECASE,
+)
+LOGISTICS_RE = re.compile(
+    r"\bdeadline\b|\bdue (date|on|when)\b|\bextension\b|\boffice hours?\b|\bgrad(e|es|ing)\b.{0,20}\b(count|weight|policy)"
+    r"|\bcount(s)? towards\b|\bwhen is the (midterm|final|exam|quiz)\b|\bwhere is the (exam|midterm|final)\b"
+    r"|截止|成绩怎么算|什么时候考(试|$|[?？])|什么时候交(作业|实验|报告|项目|$|[?？])|考试时间|答疑时间|延期",
+    re.IGNORECASE,
+)
+PRACTICE_RE = re.compile(
+    r"\b(give|generate|make|create)\b.{0,20}\b(problems?|questions?|exercises?|quiz)\b|\bpractice problems?\b"
+    r"|\bquiz me\b|\bmock (exam|quiz|test)\b|出.{0,6}题|练习题|选择题|模拟题",
+    re.IGNORECASE,
+)
+REVIEW_RE = re.compile(
+    r"\bhelp me review\b|\breview (guide|outline|plan|sheet)\b|\bsummari[sz]e\b|\bkey points\b|\bstudy plan\b"
+    r"|复习|总结|重点|知识点",
+    re.IGNORECASE,
+)
+
+
+@dataclass
+class FastRoute:
+    type: str
+    route_to: str
+    need_human_TA: bool
+    confidence: float
+    reason: str
+    difficulty: str = "medium"
+
+
+def _contains_any(text: str, keywords: Iterable[str]) -> bool:
+    return any(k in text for k in keywords)
+
+
+def rule_route(question: str) -> Optional[FastRoute]:
+    """Keyword / regex rules; None when no rule applies."""
+    lower_q = question.lower()
+    is_exam = _contains_any(lower_q, EXAM_KEYWORDS)
+    is_lab = _contains_any(lower_q, LAB_KEYWORDS)
+    wants_answer = bool(FULL_ANSWER_RE.search(question)) and not NO_ANSWER_RE.search(question)
+
+    if wants_answer and (is_exam or is_lab):
+        return FastRoute("assignment", "None", True, 0.95, "rule:full-answer request")
+    if LOGISTICS_RE.search(question):
+        # A logistics decision sends the question to a human without an answer, so the rule
+        # alone stays below the default threshold: the model has to agree (or the LLM decides)
+        return FastRoute("logistics", "None", True, 0.85, "rule:course logistics")
+    if CODE_RE.search(question):
+        if is_lab:
+            return FastRoute("assignment", "CodeAgent", False, 0.9, "rule:lab code")
+        return FastRoute("code", "CodeAgent", False, 0.95, "rule:code")
+    if PRACTICE_RE.search(question):
+        return FastRoute("practice", "PracticeAgent", False, 0.9, "rule:practice request")
+    if REVIEW_RE.search(question):
+        return FastRoute("review", "ReviewAgent", False, 0.9, "rule:review request")
+    if WEAK_CODE_RE.search(question):
+        return FastRoute("code", "CodeAgent", False, 0.8, "rule:code keyword")
+    if is_lab and not is_exam:
+        route_to = "CodeAgent" if _contains_any(lower_q, CODE_KEYWORDS) else "ConceptAgent"
+        return FastRoute("assignment", route_to, False, 0.85, "rule:lab/homework guidance")
+    return None
+
+
+class NaiveBayesRouter:
+    """
+    Multinomial naive Bayes over (type, route_to, need_human_TA) labels with Laplace smoothing.
+    Features are unigram tokens plus adjacent-token bigrams, so single CJK characters
+    ("复", "习") also contribute as words ("复习").
+
+    Plain naive Bayes posteriors are close to 0/1 on a training set this small, so they are
+    tempered: the log-likelihood is divided by sqrt(number of features), and the posterior is
+    scaled by the share of the question's features seen in training (an off-topic question
+    made of unknown words gets a low confidence instead of a confident guess).
+    """
+
+    def __init__(self, tokenize: Callable[[str], List[str]], alpha: float = 1.0):
+        self.tokenize = tokenize
+        self.alpha = alpha
+        self.class_counts: Counter = Counter()
+        self.feature_counts: Dict[Tuple, Counter] = {}
+        self.feature_totals: Counter = Counter()
+        self.vocab: set = set()
+
+    def features(self, text: str) -> List[str]:
+        tokens = self.tokenize(text)
+        return tokens + [f"{a}_{b}" for a, b in zip(tokens, tokens[1:])]
+
+    def fit(self, examples: Iterable[Dict]) -> "NaiveBayesRouter":
+        for ex in examples:
+            label = (ex["type"], ex["route_to"], bool(ex["need_human_TA"]))
+            feats = self.features(ex["question"])
+            self.class_counts[label] += 1
+            counts = self.feature_counts.setdefault(label, Counter())
+            counts.update(feats)
+            self.feature_totals[label] += len(feats)
+            self.vocab.update(feats)
+        return self
+
+    def __len__(self) -> int:
+        return sum(self.class_counts.values())
+
+    def predict_proba(self, text: str) -> List[Tuple[float, Tuple]]:
+        """[(posterior, label), ...] best first."""
+        if not self.class_counts:
+            return []
+        all_feats = self.features(text)
+        feats = [f for f in all_feats if f in self.vocab]
+        if not feats:
+            return []
+        known = len(feats) / len(all_feats)
+        n = len(self)
+        v = len(self.vocab)
+        log_scores = {}
+        for label, count in self.class_counts.items():
+            counts = self.feature_counts[label]
+            denom = math.log(self.feature_totals[label] + self.alpha * v)
+            likelihood = sum(math.log(counts.get(f, 0) + self.alpha) - denom for f in feats)
+            log_scores[label] = math.log(count / n) + likelihood / math.sqrt(len(feats))
+        top = max(log_scores.values())
+        exp = {label: math.exp(s - top) for label, s in log_scores.items()}
+        total = sum(exp.values())
+        return sorted(((known * p / total, label) for label, p in exp.items()), reverse=True)
+
+    def predict(self, text: str) -> Optional[FastRoute]:
+        ranked = self.predict_proba(text)
+        if not ranked:
+            return None
+        prob, (qtype, route_to, need_human) = ranked[0]
+        return FastRoute(qtype, route_to, need_human, prob, "model:naive_bayes")
+
+
+def load_labeled(path: str) -> List[Dict]:
+    examples = []
+    if not path or not os.path.exists(path):
+        return examples
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                ex = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if ex.get("question") and ex.get("type"):
+                ex.setdefault("route_to", TYPE_ROUTES.get(ex["type"], "None"))
+                ex.setdefault("need_human_TA", False)
+                examples.append(ex)
+    return examples
+
+
+class FastRouter:
+    """
+    Rules first, then the naive Bayes model; when both fire and agree their confidence is
+    combined (1 - (1-a)(1-b)), when they disagree the rule wins, at a lower confidence if the
+    model is more than 50% sure of its own answer.
+    route() returns None below threshold (or when disabled) so the caller uses the LLM.
+    """
+
+    def __init__(
+        self,
+        tokenize: Callable[[str], List[str]],
+        examples: Optional[Iterable[Dict]] = None,
+        threshold: float = DEFAULT_THRESHOLD,
+        enabled: bool = True,
+        log_path: Optional[str] = None,
+    ):
+        self.threshold = threshold
+        self.enabled = enabled
+        self.log_path = log_path
+        self.model = NaiveBayesRouter(tokenize).fit(examples or [])
+        self._lock = threading.Lock()
+        self.stats_counts = Counter()
+
+    @classmethod
+    def from_env(cls, tokenize: Callable[[str], List[str]]) -> "FastRouter":
+        examples = load_labeled(DEFAULT_LABELS_FILE)
+        router = cls(
+            tokenize,
+            examples,
+            threshold=DEFAULT_THRESHOLD,
+            enabled=os.getenv("TA_FAST_ROUTER", "on").lower() not in ("off", "0", "false"),
+            log_path=os.getenv("TA_ROUTER_LOG") or None,
+        )
+        print(f"[Fast Router] trained on {len(examples)} labeled questions, threshold {router.threshold}"
+              + ("" if router.enabled else " (disabled)"))
+        return router
+
+    def classify(self, question: str) -> Optional[FastRoute]:
+        """Best local guess regardless of threshold (None if nothing applies)."""
+        rule = rule_route(question)
+        model = self.model.predict(question)
+        if rule is None:
+            return model
+        if model is None:
+            return rule
+        if (rule.type, rule.route_to, rule.need_human_TA) == (model.type, model.route_to, model.need_human_TA):
+            rule.confidence = 1.0 - (1.0 - rule.confidence) * (1.0 - model.confidence)
+            rule.reason += "+" + model.reason
+        else:
+            # Only a model that is fairly sure of something else lowers the rule's confidence
+            rule.confidence -= max(0.0, model.confidence - 0.5)
+        return rule
+
+    def route(self, question: str) -> Optional[FastRoute]:
+        """Confident local decision, or None to fall back to the LLM router."""
+        if not self.enabled:
+            return None
+        guess = self.classify(question)
+        hit = guess is not None and guess.confidence >= self.threshold
+        with self._lock:
+            self.stats_counts["fast" if hit else "fallback"] += 1
+        return guess if hit else None
+
+    def record(self, question: str, decision: Dict):
+        """Append an LLM router decision to the log (same format as the labeled file)."""
+        if not self.log_path:
+            return
+        record = {
+            "question": question,
+            "type": decision.get("type"),
+            "route_to": decision.get("route_to"),
+            "need_human_TA": bool(decision.get("need_human_TA")),
+        }
+        with self._lock:
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            fast = self.stats_counts["fast"]
+            fallback = self.stats_counts["fallback"]
+        total = fast + fallback
+        return {
+            "enabled": self.enabled,
+            "threshold": self.threshold,
+            "training_examples": len(self.model),
+            "fast_path": fast,
+            "llm_fallback": fallback,
+            "fast_path_ratio": round(fast / total, 4) if total else 0.0,
+        }
+
+
+_default_router: Optional[FastRouter] = None
+_default_lock = threading.Lock()
+
+
+def default_fast_router(tokenize: Callable[[str], List[str]]) -> FastRouter:
+    """Process-wide FastRouter built from the environment (trained once)."""
+    global _default_router
+    if _default_router is None:
+        with _default_lock:
+            if _default_router is None:
+                _default_router = FastRouter.from_env(tokenize)
+    return _default_router
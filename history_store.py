@@ -0,0 +1,240 @@
+"""
+Write-behind persistence of TeachingAssistant session histories (history_<session>.*).
+
+Saving used to rewrite the whole history_<session>.json twice per question (user message,
+then answer). HistoryPersister instead buffers writes in memory and a background thread
+flushes them every TA_HISTORY_FLUSH_SECONDS (and on shutdown, via atexit):
+
+- "jsonl" format (default): history_<session>.jsonl, one message per line; a flush appends
+  the buffered messages in one write. Once the file holds more than
+  HISTORY_WINDOW * COMPACT_FACTOR lines it is truncated to the last HISTORY_WINDOW messages.
+  A torn last line (crash mid-append) is skipped on load.
+- "json" format: history_<session>.json as before (one JSON list), but written at most once
+  per flush however many messages arrived in between.
+Every rewrite (clear, compaction, json snapshot) goes to a temp file that is renamed over the
+old one, so a reader never sees a half-written file. An old history_<session>.json is read
+when no .jsonl exists yet, so switching to jsonl keeps existing histories.
+
+Environment:
+    TA_HISTORY_FORMAT           "jsonl" (default) or "json"
+    TA_HISTORY_FLUSH_SECONDS    flush interval (default 1.0; 0 writes through synchronously)
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+from kb_cache import _atomic_write
+from tracing import default_tracer
+
+# Messages kept per session (10 turns)
+HISTORY_WINDOW = 20
+# A jsonl file is truncated back to HISTORY_WINDOW lines once it has this many windows
+COMPACT_FACTOR = 2
+HISTORY_FORMATS = ("jsonl", "json")
+
+
+class _Pending:
+    __slots__ = ("snapshot", "appends")
+
+    def __init__(self):
+        # Rewrite the file with these messages first (None: keep what is on disk)
+        self.snapshot: Optional[List[Dict]] = None
+        self.appends: List[Dict] = []
+
+
+class HistoryPersister:
+    """
+    Usage (see TeachingAssistant):
+        persister = HistoryPersister()
+        path = persister.path_for(session_id)
+        history = persister.load(path)
+        persister.append(path, message, history)   # buffered
+        persister.replace(path, [])                # e.g. clear_history
+        persister.flush()                          # also runs periodically and at exit
+    """
+
+    def __init__(self, fmt: str = "jsonl", flush_interval: float = 1.0, window: int = HISTORY_WINDOW):
+        if fmt not in HISTORY_FORMATS:
+            raise ValueError(f"Unknown history format {fmt!r}, expected one of {HISTORY_FORMATS}")
+        self.fmt = fmt
+        self.flush_interval = flush_interval
+        self.window = window
+        self._pending: Dict[str, _Pending] = {}
+        self._lines: Dict[str, int] = {}  # jsonl lines on disk, per path
+        self._lock = threading.Lock()      # guards _pending
+        self._io_lock = threading.RLock()  # serializes file I/O (timer thread, atexit, load)
+        self._thread: Optional[threading.Thread] = None
+        self.stats_counts = {"messages": 0, "flushes": 0, "file_writes": 0, "compactions": 0}
+        atexit.register(self.flush)
+
+    @classmethod
+    def from_env(cls) -> "HistoryPersister":
+        return cls(
+            fmt=os.getenv("TA_HISTORY_FORMAT", "jsonl").lower(),
+            flush_interval=float(os.getenv("TA_HISTORY_FLUSH_SECONDS", "1.0")),
+        )
+
+    def path_for(self, session_id: str) -> str:
+        return f"history_{session_id}.{self.fmt}"
+
+    # ---------- reads ----------
+
+    def load(self, path: str) -> List[Dict]:
+        """The last `window` messages of a history file (buffered writes are flushed first)."""
+        self.flush(path)
+        try:
+            if os.path.exists(path):
+                if self.fmt == "json":
+                    with open(path, "r", encoding="utf-8") as f:
+                        return json.load(f)[-self.window:]
+                return self._open_jsonl(path)[-self.window:]
+            legacy = path[:-len(".jsonl")] + ".json" if path.endswith(".jsonl") else None
+            if legacy and os.path.exists(legacy):
+                with open(legacy, "r", encoding="utf-8") as f:
+                    messages = json.load(f)[-self.window:]
+                # Written in the new format on the next flush
+                self.replace(path, messages)
+                return messages
+        except Exception as e:
+            print(f"[History] Failed to load history: {e}")
+        return []
+
+    def _open_jsonl(self, path: str) -> List[Dict]:
+        """Read a jsonl file before appending to it; a torn last line is cut off first."""
+        with self._io_lock:
+            messages = self._read_jsonl(path)
+            with open(path, "rb") as f:
+                f.seek(0, os.SEEK_END)
+                torn = False
+                if f.tell() > 0:
+                    f.seek(-1, os.SEEK_END)
+                    torn = f.read(1) != b"\n"
+            if torn:
+                # The next append would otherwise continue the torn line
+                self._rewrite(path, messages)
+            self._lines[path] = len(messages)
+            return messages
+
+    @staticmethod
+    def _read_jsonl(path: str) -> List[Dict]:
+        messages = []
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    messages.append(json.loads(line))
+                except ValueError:
+                    # Torn line from an interrupted append
+                    continue
+        return messages
+
+    # ---------- writes (buffered) ----------
+
+    def append(self, path: str, message: Dict, history: List[Dict]):
+        """Record `message`, just added to the in-memory `history` (already cut to the window)."""
+        with self._lock:
+            pending = self._pending.setdefault(path, _Pending())
+            if self.fmt == "json":
+                pending.snapshot = list(history)
+            else:
+                pending.appends.append(message)
+            self.stats_counts["messages"] += 1
+        self._schedule()
+
+    def replace(self, path: str, messages: List[Dict]):
+        """Replace the whole history (drops buffered appends)."""
+        with self._lock:
+            pending = self._pending.setdefault(path, _Pending())
+            pending.snapshot = list(messages)
+            pending.appends = []
+        self._schedule()
+
+    def _schedule(self):
+        if self.flush_interval <= 0:
+            self.flush()
+            return
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="history-flusher", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    # ---------- flushing ----------
+
+    def flush(self, path: Optional[str] = None):
+        """Write buffered changes of one path (or all of them) to disk."""
+        with self._io_lock:
+            with self._lock:
+                if path is None:
+                    batch, self._pending = self._pending, {}
+                else:
+                    batch = {path: self._pending.pop(path)} if path in self._pending else {}
+            if not batch:
+                return
+            with default_tracer().span("history.flush", files=len(batch)):
+                for p, pending in batch.items():
+                    try:
+                        self._write(p, pending)
+                    except Exception as e:
+                        print(f"[History] Failed to save history {p}: {e}")
+            self.stats_counts["flushes"] += 1
+
+    def _write(self, path: str, pending: _Pending):
+        if self.fmt == "json":
+            _atomic_write(path, [json.dumps(pending.snapshot or [], ensure_ascii=False, indent=2)])
+            self.stats_counts["file_writes"] += 1
+            return
+
+        if pending.snapshot is not None:
+            messages = (pending.snapshot + pending.appends)[-self.window:]
+            self._rewrite(path, messages)
+            return
+        if not pending.appends:
+            return
+        if path not in self._lines:
+            if os.path.exists(path):
+                self._open_jsonl(path)
+            else:
+                self._lines[path] = 0
+        with open(path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(m, ensure_ascii=False) + "\n" for m in pending.appends))
+        self._lines[path] += len(pending.appends)
+        self.stats_counts["file_writes"] += 1
+        if self._lines[path] > self.window * COMPACT_FACTOR:
+            self._rewrite(path, self._read_jsonl(path)[-self.window:])
+            self.stats_counts["compactions"] += 1
+
+    def _rewrite(self, path: str, messages: List[Dict]):
+        _atomic_write(path, (json.dumps(m, ensure_ascii=False) + "\n" for m in messages))
+        self._lines[path] = len(messages)
+        self.stats_counts["file_writes"] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            pending = sum(len(p.appends) + (p.snapshot is not None) for p in self._pending.values())
+            return dict(self.stats_counts, format=self.fmt, pending=pending)
+
+
+_default_persister: Optional[HistoryPersister] = None
+_default_lock = threading.Lock()
+
+
+def default_history_persister() -> HistoryPersister:
+    """Process-wide HistoryPersister built from the environment, shared by all sessions."""
+    global _default_persister
+    if _default_persister is None:
+        with _default_lock:
+            if _default_persister is None:
+                _default_persister = HistoryPersister.from_env()
+    return _default_persister
@@ -0,0 +1,97 @@
+"""
+HTTP helpers shared by app.py (Flask) and asgi_app.py (Starlette): ETags / If-None-Match,
+response compression and pagination parameters.
+
+- etag_for(...) hashes a change marker (ConversationStore.version) plus the query string
+  into a weak ETag; a request whose If-None-Match matches gets 304 without a body
+- compress_body() gzips (or, when the optional `brotli` package is installed and the client
+  accepts it, brotli-compresses) JSON / HTML bodies of at least TA_COMPRESS_MIN_BYTES.
+  Event streams are never compressed: a compressor buffers, which would hold back SSE deltas.
+
+Environment:
+    TA_COMPRESS_MIN_BYTES    smallest body worth compressing (default 1024; 0 disables)
+"""
+
+import gzip
+import hashlib
+import os
+from typing import Optional, Tuple
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.getenv("TA_COMPRESS_MIN_BYTES", "1024"))
+COMPRESSIBLE_TYPES = ("application/json", "text/html", "text/plain", "text/css", "application/javascript")
+
+
+def etag_for(*parts) -> str:
+    digest = hashlib.sha1("|".join(repr(p) for p in parts).encode("utf-8")).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header names `etag` (weak comparison)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    bare = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == bare:
+            return True
+    return False
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """'br', 'gzip' or None for an Accept-Encoding header (q=0 entries are refused)."""
+    accepted = {}
+    for item in (accept_encoding or "").split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            accepted[name.strip().lower()] = q
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+def compress_body(body: bytes, content_type: str, accept_encoding: Optional[str]) -> Tuple[bytes, Optional[str]]:
+    """(body, Content-Encoding or None): the body compressed if it is worth it."""
+    if COMPRESS_MIN_BYTES <= 0 or len(body) < COMPRESS_MIN_BYTES:
+        return body, None
+    if (content_type or "").split(";")[0].strip().lower() not in COMPRESSIBLE_TYPES:
+        return body, None
+    encoding = choose_encoding(accept_encoding)
+    if encoding == "br":
+        return brotli.compress(body, quality=5), encoding
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=6), encoding
+    return body, None
+
+
+def page_limit(value: Optional[str], default: int, maximum: int) -> int:
+    """The ?limit= of a paginated request, clamped to [1, maximum]; raises ValueError if not a number."""
+    if value in (None, ""):
+        return default
+    return max(1, min(maximum, int(value)))
+
+
+def optional_int(value: Optional[str]) -> Optional[int]:
+    return int(value) if value not in (None, "") else None
+
+
+def optional_float(value: Optional[str]) -> Optional[float]:
+    return float(value) if value not in (None, "") else None
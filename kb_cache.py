@@ -0,0 +1,237 @@
+"""
+Persistent parse cache for course materials.
+
+Extracting text from PPTX/PDF with python-pptx / PyPDF2 dominates knowledge base load time,
+so the result of every parsed file is stored on disk and reused on the next start:
+
+- <cache_dir>/materials.jsonl : one JSON line per material file
+  {"path", "size", "mtime", "sha256", "version", "text", "chunks"}
+- <cache_dir>/global_context.json : the rendered global_context plus a digest of the
+  (path, sha256) list it was built from
+
+A file is reused when its size + mtime match the stored entry (no hashing needed), or,
+if the stat changed (e.g. after a fresh git checkout), when its sha256 still matches.
+Anything else is treated as a changed deck and re-parsed.
+
+CLI (prebuild the cache at deploy time):
+    python kb_cache.py build [--folder course_materials] [--cache-dir .kb_cache] [--workers N]
+    python kb_cache.py info  [--cache-dir .kb_cache]
+    python kb_cache.py clear [--cache-dir .kb_cache]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Bump when extraction or chunking changes so old entries are ignored
+CACHE_VERSION = 1
+
+DEFAULT_CACHE_DIR = os.getenv("TA_KB_CACHE_DIR", ".kb_cache")
+
+MATERIALS_FILE = "materials.jsonl"
+GLOBAL_CONTEXT_FILE = "global_context.json"
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _atomic_write(path: str, lines: Iterable[str]):
+    tmp = f"{path}.tmp.{os.getpid()}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        for line in lines:
+            f.write(line)
+    os.replace(tmp, path)
+
+
+class MaterialCache:
+    """
+    On-disk cache of extracted material text and chunks, keyed by file fingerprint.
+    Usage (see CourseKnowledgeBase._load_folder):
+        cache = MaterialCache(".kb_cache")
+        entry = cache.lookup(path)          # None on miss / stale entry
+        cache.store(path, text, chunks)     # after parsing a missed file
+        cache.save()                        # persist only if something changed
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.entries: Dict[str, Dict] = {}
+        self.hits = 0
+        self.misses = 0
+        self._dirty = False
+        self._load()
+
+    @property
+    def materials_path(self) -> str:
+        return os.path.join(self.cache_dir, MATERIALS_FILE)
+
+    @property
+    def global_context_path(self) -> str:
+        return os.path.join(self.cache_dir, GLOBAL_CONTEXT_FILE)
+
+    def _load(self):
+        if not os.path.exists(self.materials_path):
+            return
+        try:
+            with open(self.materials_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    rec = json.loads(line)
+                    if rec.get("version") != CACHE_VERSION:
+                        self._dirty = True
+                        continue
+                    self.entries[rec["path"]] = rec
+        except Exception as e:
+            print(f"[KB Cache] Ignoring unreadable cache {self.materials_path}: {e}")
+            self.entries = {}
+            self._dirty = True
+
+    @staticmethod
+    def _key(path: str) -> str:
+        return os.path.normpath(path)
+
+    def lookup(self, path: str) -> Optional[Dict]:
+        """Return the cached entry for path if it still matches the file on disk."""
+        key = self._key(path)
+        rec = self.entries.get(key)
+        if rec is None:
+            self.misses += 1
+            return None
+        st = os.stat(path)
+        if rec["size"] == st.st_size and rec["mtime"] == st.st_mtime_ns:
+            self.hits += 1
+            return rec
+        # Stat changed: fall back to comparing content
+        if rec["size"] == st.st_size and rec["sha256"] == file_sha256(path):
+            rec["mtime"] = st.st_mtime_ns
+            self._dirty = True
+            self.hits += 1
+            return rec
+        self.misses += 1
+        return None
+
+    def store(self, path: str, text: str, chunks: List[str]) -> Dict:
+        st = os.stat(path)
+        rec = {
+            "path": self._key(path),
+            "size": st.st_size,
+            "mtime": st.st_mtime_ns,
+            "sha256": file_sha256(path),
+            "version": CACHE_VERSION,
+            "text": text,
+            "chunks": chunks,
+        }
+        self.entries[rec["path"]] = rec
+        self._dirty = True
+        return rec
+
+    def prune(self, keep_paths: Iterable[str], folder: str):
+        """Drop entries for files under folder that no longer exist."""
+        keep = {self._key(p) for p in keep_paths}
+        prefix = self._key(folder) + os.sep
+        for key in list(self.entries):
+            if key.startswith(prefix) and key not in keep:
+                del self.entries[key]
+                self._dirty = True
+
+    def save(self):
+        if not self._dirty:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        _atomic_write(
+            self.materials_path,
+            (json.dumps(rec, ensure_ascii=False) + "\n" for rec in self.entries.values()),
+        )
+        self._dirty = False
+
+    # ---- Rendered global_context ----
+
+    def fingerprint(self, paths: List[str]) -> str:
+        """Digest of the ordered (path, sha256) list a global_context is built from."""
+        h = hashlib.sha256(f"v{CACHE_VERSION}".encode())
+        for p in paths:
+            rec = self.entries.get(self._key(p))
+            h.update(self._key(p).encode("utf-8"))
+            h.update((rec["sha256"] if rec else "").encode())
+        return h.hexdigest()
+
+    def load_global_context(self, digest: str) -> Optional[str]:
+        try:
+            with open(self.global_context_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("digest") != digest:
+            return None
+        return data.get("text")
+
+    def save_global_context(self, digest: str, text: str):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        _atomic_write(
+            self.global_context_path,
+            [json.dumps({"digest": digest, "text": text}, ensure_ascii=False)],
+        )
+
+    def clear(self):
+        self.entries = {}
+        self._dirty = False
+        if os.path.isdir(self.cache_dir):
+            shutil.rmtree(self.cache_dir)
+
+    def stats(self) -> Dict:
+        return {
+            "cache_dir": self.cache_dir,
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+def cache_info(cache_dir: str) -> Tuple[int, int]:
+    """(number of cached files, total bytes on disk)"""
+    cache = MaterialCache(cache_dir)
+    size = 0
+    for name in (MATERIALS_FILE, GLOBAL_CONTEXT_FILE):
+        p = os.path.join(cache_dir, name)
+        if os.path.exists(p):
+            size += os.path.getsize(p)
+    return len(cache.entries), size
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Course material parse cache")
+    parser.add_argument("command", choices=["build", "info", "clear"])
+    parser.add_argument("--folder", default="course_materials")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--workers", type=int, default=None, help="parser processes (default: CPU count)")
+    args = parser.parse_args(argv)
+
+    if args.command == "clear":
+        MaterialCache(args.cache_dir).clear()
+        print(f"[KB Cache] Cleared {args.cache_dir}")
+    elif args.command == "info":
+        n, size = cache_info(args.cache_dir)
+        print(f"[KB Cache] {args.cache_dir}: {n} files, {size / 1024:.1f} KiB")
+    else:
+        from ta_agents_history import CourseKnowledgeBase
+
+        kb = CourseKnowledgeBase(args.folder, cache_dir=args.cache_dir, workers=args.workers)
+        n, size = cache_info(args.cache_dir)
+        print(
+            f"[KB Cache] Built {args.cache_dir}: {n} files, {len(kb.chunks)} chunks, "
+            f"{size / 1024:.1f} KiB"
+        )
+
+
+if __name__ == "__main__":
+    main()
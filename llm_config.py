@@ -0,0 +1,245 @@
+"""
+LLM client configuration: endpoint, default model / sampling, connection pool and timeouts,
+plus per-agent model / max_tokens / temperature / context window, so each route can be tuned
+for latency and cost (e.g. a small fast model for RouterAgent, a larger one for ReviewAgent).
+
+Sources, later ones winning:
+    1. built-in defaults (deepseek-chat on https://api.deepseek.com)
+    2. the config file TA_LLM_CONFIG (default llm_config.json, skipped when it does not exist);
+       JSON, or TOML for a .toml file
+    3. environment variables
+    4. DeepSeekClient / AsyncDeepSeekClient arguments (base_url, timeout, max_concurrency)
+
+Config file:
+    {
+      "base_url": "http://127.0.0.1:8000/v1",
+      "model": "deepseek-chat",
+      "temperature": 0.9,
+      "max_tokens": 1500,
+      "timeout": 120,
+      "connect_timeout": 10,
+      "pool": {"max_connections": 100, "max_keepalive_connections": 20, "max_concurrency": 100},
+      "agents": {
+        "RouterAgent": {"model": "small-fast-model", "max_tokens": 200},
+        "ReviewAgent": {"model": "large-model", "max_tokens": 3000, "context_window": 128000}
+      }
+    }
+
+Environment:
+    DEEPSEEK_API_KEY, DEEPSEEK_BASE_URL, DEEPSEEK_MODEL, DEEPSEEK_TEMPERATURE, DEEPSEEK_MAX_TOKENS
+    DEEPSEEK_TIMEOUT, DEEPSEEK_CONNECT_TIMEOUT
+    DEEPSEEK_MAX_CONNECTIONS, DEEPSEEK_MAX_KEEPALIVE_CONNECTIONS, DEEPSEEK_MAX_CONCURRENCY
+    TA_MODEL_<AGENT>, TA_MAX_TOKENS_<AGENT>, TA_TEMPERATURE_<AGENT>, TA_CONTEXT_WINDOW_<AGENT>
+        per agent, <AGENT> as in TA_CONTEXT_MODE_<AGENT>: ROUTER, CONCEPT, CODE, PRACTICE,
+        REVIEW, COMBINED (e.g. TA_MODEL_ROUTER=small-fast-model)
+
+An agent without its own model / max_tokens uses the client-wide ones; without its own
+temperature it keeps the agent's built-in one (RouterAgent 0.0, ConceptAgent 0.5, ...), and
+without its own context window it uses TA_CONTEXT_WINDOW.
+The connection pool is shared by the whole process, so its settings come from the process-wide
+config (default_llm_config).
+"""
+
+import json
+import os
+import threading
+from dataclasses import asdict, dataclass, field, fields
+from typing import Dict, Optional
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    tomllib = None
+
+DEFAULT_CONFIG_FILE = "llm_config.json"
+POOL_KEYS = ("max_connections", "max_keepalive_connections", "max_concurrency")
+
+
+@dataclass
+class AgentLLMSettings:
+    """One agent's overrides (None: not overridden)."""
+    model: Optional[str] = None
+    max_tokens: Optional[int] = None
+    temperature: Optional[float] = None
+    context_window: Optional[int] = None
+
+
+@dataclass
+class LLMConfig:
+    api_key: str = "your_api_key"
+    base_url: str = "https://api.deepseek.com"
+    model: str = "deepseek-chat"
+    temperature: float = 0.9
+    max_tokens: int = 1500
+    # Per-call timeout and connect timeout (seconds)
+    timeout: float = 120.0
+    connect_timeout: float = 10.0
+    # Process-wide HTTP connection pool; AsyncDeepSeekClient requests in flight per client
+    # (default: max_connections)
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    max_concurrency: Optional[int] = None
+    agents: Dict[str, AgentLLMSettings] = field(default_factory=dict)
+    # Config file that was read, if any
+    source: Optional[str] = None
+
+    @classmethod
+    def load(cls, path: Optional[str] = None) -> "LLMConfig":
+        """Defaults, then the config file (path, else TA_LLM_CONFIG), then the environment."""
+        config = cls()
+        explicit = path or os.getenv("TA_LLM_CONFIG")
+        path = explicit or DEFAULT_CONFIG_FILE
+        if os.path.exists(path):
+            config.update(read_config_file(path))
+            config.source = path
+            print(f"[Config] Loaded LLM config from {path}")
+        elif explicit:
+            raise ValueError(f"LLM config file {path} does not exist")
+        config.update_from_env()
+        return config
+
+    def update(self, data: Dict):
+        """Apply a config file's settings (see the module docstring for the format)."""
+        data = dict(data)
+        pool = data.pop("pool", {}) or {}
+        agents = data.pop("agents", {}) or {}
+        settable = {f.name for f in fields(self)} - {"agents", "source", *POOL_KEYS}
+        unknown = set(data) - settable
+        unknown |= {f"pool.{k}" for k in set(pool) - set(POOL_KEYS)}
+        if unknown:
+            raise ValueError(f"Unknown LLM config keys: {', '.join(sorted(unknown))}")
+        for key, value in list(data.items()) + list(pool.items()):
+            setattr(self, key, value)
+        agent_keys = {f.name for f in fields(AgentLLMSettings)}
+        for name, overrides in agents.items():
+            unknown = set(overrides) - agent_keys
+            if unknown:
+                raise ValueError(f"Unknown LLM config keys for {name}: {', '.join(sorted(unknown))}")
+            settings = self.agents.setdefault(name, AgentLLMSettings())
+            for key, value in overrides.items():
+                setattr(settings, key, value)
+        self._coerce()
+
+    def update_from_env(self):
+        env = {
+            "api_key": "DEEPSEEK_API_KEY",
+            "base_url": "DEEPSEEK_BASE_URL",
+            "model": "DEEPSEEK_MODEL",
+            "temperature": "DEEPSEEK_TEMPERATURE",
+            "max_tokens": "DEEPSEEK_MAX_TOKENS",
+            "timeout": "DEEPSEEK_TIMEOUT",
+            "connect_timeout": "DEEPSEEK_CONNECT_TIMEOUT",
+            "max_connections": "DEEPSEEK_MAX_CONNECTIONS",
+            "max_keepalive_connections": "DEEPSEEK_MAX_KEEPALIVE_CONNECTIONS",
+            "max_concurrency": "DEEPSEEK_MAX_CONCURRENCY",
+        }
+        for key, name in env.items():
+            value = os.getenv(name)
+            if value:
+                setattr(self, key, value)
+        prefixes = {
+            "model": "TA_MODEL_",
+            "max_tokens": "TA_MAX_TOKENS_",
+            "temperature": "TA_TEMPERATURE_",
+            "context_window": "TA_CONTEXT_WINDOW_",
+        }
+        for name, value in os.environ.items():
+            for key, prefix in prefixes.items():
+                if name.startswith(prefix) and value:
+                    agent = agent_name_for(name[len(prefix):])
+                    setattr(self.agents.setdefault(agent, AgentLLMSettings()), key, value)
+        self._coerce()
+
+    def _coerce(self):
+        """Environment values are strings; config files may hold ints for floats and so on."""
+        for f in fields(self):
+            value = getattr(self, f.name)
+            if value is None or f.name in ("agents", "source"):
+                continue
+            kind = {"temperature": float, "timeout": float, "connect_timeout": float}.get(f.name)
+            if kind is None:
+                kind = int if f.name in ("max_tokens", *POOL_KEYS) else str
+            try:
+                setattr(self, f.name, kind(value))
+            except (TypeError, ValueError):
+                raise ValueError(f"Invalid LLM config value for {f.name}: {value!r}") from None
+        for name, settings in self.agents.items():
+            for key, kind in (("model", str), ("max_tokens", int), ("temperature", float), ("context_window", int)):
+                value = getattr(settings, key)
+                if value is None:
+                    continue
+                try:
+                    setattr(settings, key, kind(value))
+                except (TypeError, ValueError):
+                    raise ValueError(f"Invalid LLM config value for {name}.{key}: {value!r}") from None
+
+    @property
+    def concurrency(self) -> int:
+        return max(1, self.max_concurrency or self.max_connections)
+
+    def agent(self, agent_name: str) -> AgentLLMSettings:
+        """The agent's settings with the client-wide model / max_tokens filled in."""
+        overrides = self.agents.get(agent_name) or AgentLLMSettings()
+        return AgentLLMSettings(
+            model=overrides.model or self.model,
+            max_tokens=overrides.max_tokens or self.max_tokens,
+            temperature=overrides.temperature,
+            context_window=overrides.context_window,
+        )
+
+    def to_dict(self) -> Dict:
+        """The settings without the API key (for /api/health)."""
+        data = asdict(self)
+        data.pop("api_key")
+        data["max_concurrency"] = self.concurrency
+        data["agents"] = {
+            name: {k: v for k, v in asdict(settings).items() if v is not None}
+            for name, settings in sorted(self.agents.items())
+        }
+        return data
+
+
+def agent_name_for(key: str) -> str:
+    """ROUTER -> RouterAgent (the <AGENT> part of TA_MODEL_<AGENT> and friends)."""
+    key = key.strip().lower()
+    return key[:1].upper() + key[1:] + "Agent"
+
+
+def read_config_file(path: str) -> Dict:
+    if path.endswith(".toml") and tomllib is None:
+        raise ValueError(f"Reading {path} needs Python 3.11+ (tomllib); use a JSON config file")
+    try:
+        if path.endswith(".toml"):
+            with open(path, "rb") as f:
+                data = tomllib.load(f)
+        else:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+    except (OSError, ValueError) as e:
+        # JSONDecodeError and TOMLDecodeError are ValueErrors
+        raise ValueError(f"Cannot read LLM config file {path}: {e}") from e
+    if not isinstance(data, dict):
+        raise ValueError(f"LLM config file {path} must hold an object")
+    return data
+
+
+def settings_for(client, agent_name: str) -> AgentLLMSettings:
+    """The agent's settings from the client's config (the process-wide one for clients without)."""
+    config = getattr(client, "config", None)
+    if not isinstance(config, LLMConfig):
+        config = default_llm_config()
+    return config.agent(agent_name)
+
+
+_default_config: Optional[LLMConfig] = None
+_default_lock = threading.Lock()
+
+
+def default_llm_config() -> LLMConfig:
+    """Process-wide LLMConfig (config file + environment), read once."""
+    global _default_config
+    if _default_config is None:
+        with _default_lock:
+            if _default_config is None:
+                _default_config = LLMConfig.load()
+    return _default_config
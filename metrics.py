@@ -0,0 +1,454 @@
+"""
+Prometheus metrics for the tutor service, served as text (exposition format 0.0.4) on GET /metrics
+by app.py and asgi_app.py. Written against the format directly, so prometheus_client is not needed.
+
+Recorded as requests happen (see track_request / note_route / record_fallback in app.py):
+    ta_requests_total{endpoint, route_to, outcome}        questions handled; outcome is
+                                                          answered | human | fallback | error
+    ta_request_duration_seconds{endpoint, route_to}       histogram, whole request (whole stream)
+    ta_time_to_first_token_seconds{route_to}              histogram, streamed answers
+    ta_requests_in_flight{endpoint}                       gauge
+    ta_fallback_responses_total                           get_ai_response_fallback answers
+
+Read from the running components on every scrape (attach(registry)):
+    LLM calls and tokens in / out / prompt-cache hits per client (DeepSeekClient.usage_totals),
+    router / answer cache lookups and hit ratios, fast-path routing, speculation, retries and
+    circuit breaker, sessions, buffered history writes, knowledge base load time and size
+    (files, chunks, global_context characters) and the pending-for-human queue depth
+    (lines in pending_for_human.jsonl).
+
+Environment:
+    TA_METRICS_BUCKETS    comma-separated latency buckets in seconds
+                          (default 0.05,0.1,0.25,0.5,1,2.5,5,10,20,30,60)
+"""
+
+import contextvars
+import functools
+import inspect
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+MEDIA_TYPE = "text/plain; version=0.0.4"
+CONTENT_TYPE = MEDIA_TYPE + "; charset=utf-8"
+
+# (name, type, help, [(labels, value), ...]) produced by a collector at scrape time
+Family = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+def _sample(name: str, labels: Dict[str, str], value: float) -> str:
+    if labels:
+        body = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+        return f"{name}{{{body}}} {_format_value(value)}"
+    return f"{name} {_format_value(value)}"
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def _key(self, labels: Dict) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def value(self, **labels) -> float:
+        key = self._key(labels)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [_sample(self.name, dict(zip(self.labelnames, key)), value) for key, value in items]
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # labels -> [per-bucket counts..., sum, count]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        lines = []
+        for key, series in items:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(_sample(f"{self.name}_bucket", dict(labels, le=_format_value(float(bound))), cumulative))
+            lines.append(_sample(f"{self.name}_sum", labels, series[-2]))
+            lines.append(_sample(f"{self.name}_count", labels, series[-1]))
+        return lines
+
+
+class MetricsRegistry:
+    """Metrics updated in place plus collectors called at scrape time; render() is the /metrics body."""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], Iterable[Family]]] = []
+
+    def counter(self, name: str, help: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._add(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Tuple[str, ...] = ()) -> Gauge:
+        return self._add(Gauge(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], Iterable[Family]]):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            try:
+                families = list(collector())
+            except Exception as e:
+                print(f"[Metrics] Collector failed: {e}")
+                continue
+            for name, kind, help, samples in families:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                lines.extend(_sample(name, labels, value) for labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+_pending_depths: Dict[str, Tuple[Tuple[int, int], int]] = {}
+
+
+def pending_queue_depth(path: str) -> int:
+    """Questions waiting in a pending_for_human.jsonl file (recounted only when the file changed)."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return 0
+    stamp = (st.st_mtime_ns, st.st_size)
+    cached = _pending_depths.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    with open(path, "rb") as f:
+        depth = sum(1 for line in f if line.strip())
+    _pending_depths[path] = (stamp, depth)
+    return depth
+
+
+class _Tracked:
+    __slots__ = ("route_to", "outcome", "ttft")
+
+    def __init__(self):
+        self.route_to = "unknown"
+        self.outcome = "answered"
+        self.ttft: Optional[float] = None
+
+
+class ServiceMetrics:
+    """
+    Usage (see app.py / asgi_app.py):
+        metrics = default_service_metrics()
+        metrics.attach(ta_registry)                  # scrape-time gauges of the TA components
+        with metrics.track("message") as tracked:    # in-flight gauge, rate, latency
+            ...
+            tracked.route_to = "ConceptAgent"
+        body = metrics.render()                      # GET /metrics
+    """
+
+    def __init__(self, buckets: Iterable[float] = DEFAULT_BUCKETS, pending_file: Optional[str] = None):
+        self.registry = MetricsRegistry()
+        self.pending_file = pending_file
+        self.ta_registry = None
+        self.requests = self.registry.counter(
+            "ta_requests_total", "Questions handled, by endpoint, routed agent and outcome",
+            ("endpoint", "route_to", "outcome"),
+        )
+        self.latency = self.registry.histogram(
+            "ta_request_duration_seconds", "Time to answer a question (the whole stream for streamed answers)",
+            ("endpoint", "route_to"), buckets,
+        )
+        self.ttft = self.registry.histogram(
+            "ta_time_to_first_token_seconds", "Time to the first answer text of streamed answers",
+            ("route_to",), buckets,
+        )
+        self.in_flight = self.registry.gauge(
+            "ta_requests_in_flight", "Questions being answered right now", ("endpoint",)
+        )
+        self.fallbacks = self.registry.counter(
+            "ta_fallback_responses_total", "Answers from get_ai_response_fallback (TA agent unavailable or failed)"
+        )
+        self.registry.add_collector(self._collect)
+
+    @classmethod
+    def from_env(cls) -> "ServiceMetrics":
+        from ta_agents_history import PENDING_FILE
+
+        buckets = os.getenv("TA_METRICS_BUCKETS")
+        return cls(
+            buckets=[float(b) for b in buckets.split(",")] if buckets else DEFAULT_BUCKETS,
+            pending_file=PENDING_FILE,
+        )
+
+    def attach(self, ta_registry):
+        """Report the components of a SessionRegistry (the last one attached wins)."""
+        self.ta_registry = ta_registry
+
+    # ---------- request tracking ----------
+
+    @contextmanager
+    def track(self, endpoint: str):
+        tracked = _Tracked()
+        self.in_flight.inc(endpoint=endpoint)
+        started = time.perf_counter()
+        try:
+            yield tracked
+        except BaseException:
+            tracked.outcome = "error"
+            raise
+        finally:
+            self.in_flight.dec(endpoint=endpoint)
+            self.requests.inc(endpoint=endpoint, route_to=tracked.route_to, outcome=tracked.outcome)
+            self.latency.observe(time.perf_counter() - started, endpoint=endpoint, route_to=tracked.route_to)
+            if tracked.ttft is not None:
+                self.ttft.observe(tracked.ttft, route_to=tracked.route_to)
+
+    def render(self) -> str:
+        return self.registry.render()
+
+    # ---------- scrape-time collection ----------
+
+    def _collect(self) -> Iterable[Family]:
+        if self.pending_file:
+            yield ("ta_pending_for_human", "gauge", "Questions queued for a human TA (pending_for_human.jsonl)",
+                   [({}, pending_queue_depth(self.pending_file))])
+        registry = self.ta_registry
+        if registry is None:
+            return
+
+        clients = [("sync", registry.client)]
+        if registry.use_async and registry.async_client is not None:
+            clients.append(("async", registry.async_client))
+        usage = [(name, client.usage_stats()) for name, client in clients]
+        yield ("ta_llm_calls_total", "counter", "LLM API calls that returned usage",
+               [({"client": name}, u["calls"]) for name, u in usage])
+        yield ("ta_llm_tokens_total", "counter", "LLM tokens from response.usage; direction in = prompt, out = completion",
+               [({"client": name, "direction": d}, u[key]) for name, u in usage
+                for d, key in (("in", "prompt_tokens"), ("out", "completion_tokens"))])
+        yield ("ta_llm_prompt_cache_hit_tokens_total", "counter", "Prompt tokens served from the provider's prefix cache",
+               [({"client": name}, u["cache_hit_tokens"]) for name, u in usage])
+        yield ("ta_llm_prompt_cache_hit_ratio", "gauge", "Share of prompt tokens served from the prefix cache",
+               [({"client": name}, u["cache_hit_ratio"]) for name, u in usage])
+
+        resilience = registry.client.resilience_stats()
+        yield ("ta_llm_retries_total", "counter", "LLM calls retried after a transient failure",
+               [({}, resilience["retries"])])
+        yield ("ta_llm_failures_total", "counter", "LLM calls that failed for good", [({}, resilience["failures"])])
+        yield ("ta_llm_short_circuited_total", "counter", "LLM calls refused by the open circuit breaker",
+               [({}, resilience["short_circuited"])])
+        yield ("ta_llm_circuit_open", "gauge", "1 while the circuit breaker is open or half-open",
+               [({}, 0 if resilience["breaker_state"] == "closed" else 1)])
+
+        for cache_name, cache in (("router", registry.router_cache), ("answer", registry.answer_cache)):
+            if cache is None:
+                continue
+            stats = cache.stats()
+            yield (f"ta_{cache_name}_cache_lookups_total", "counter", f"{cache_name.capitalize()} cache lookups by result",
+                   [({"result": r}, stats[key]) for r, key in (("exact_hit", "exact_hits"), ("near_hit", "near_hits"),
+                                                               ("miss", "misses"))])
+            yield (f"ta_{cache_name}_cache_hit_ratio", "gauge", f"{cache_name.capitalize()} cache hit ratio",
+                   [({}, stats["hit_rate"])])
+            yield (f"ta_{cache_name}_cache_entries", "gauge", f"{cache_name.capitalize()} cache entries",
+                   [({}, stats["entries"])])
+
+        router = registry.fast_router.stats()
+        yield ("ta_router_decisions_total", "counter", "Routing decisions by path (local fast path or LLM router)",
+               [({"path": "fast"}, router["fast_path"]), ({"path": "llm"}, router["llm_fallback"])])
+        speculation = registry.speculation_stats.stats()
+        yield ("ta_speculation_total", "counter", "Speculative agent calls by result",
+               [({"result": r}, speculation[r]) for r in ("hits", "misses", "discarded_human")])
+        yield ("ta_speculation_wasted_tokens_total", "counter", "Tokens spent on discarded speculative calls",
+               [({}, speculation["wasted_tokens"])])
+
+        sessions = registry.stats()
+        yield ("ta_sessions_active", "gauge", "Conversation sessions held in memory", [({}, sessions["active_sessions"])])
+        yield ("ta_sessions_evicted_total", "counter", "Sessions evicted (LRU or idle)", [({}, sessions["evictions"])])
+        yield ("ta_history_pending_writes", "gauge", "History changes buffered for the next flush",
+               [({}, registry.history_persister.stats()["pending"])])
+
+        if sessions["kb_loaded"]:
+            kb = registry.kb
+            yield ("ta_kb_load_seconds", "gauge", "Time the course knowledge base took to load", [({}, kb.load_seconds)])
+            yield ("ta_kb_files", "gauge", "Course material files loaded", [({}, len(kb.load_timings))])
+            yield ("ta_kb_chunks", "gauge", "Knowledge base chunks (len(kb.chunks))", [({}, len(kb.chunks))])
+            yield ("ta_kb_global_context_chars", "gauge", "Characters in the global course context",
+                   [({}, len(kb.global_context))])
+
+
+_default_metrics: Optional[ServiceMetrics] = None
+_default_lock = threading.Lock()
+
+
+def default_service_metrics() -> ServiceMetrics:
+    """Process-wide ServiceMetrics built from the environment."""
+    global _default_metrics
+    if _default_metrics is None:
+        with _default_lock:
+            if _default_metrics is None:
+                _default_metrics = ServiceMetrics.from_env()
+    return _default_metrics
+
+
+def track_request(endpoint: str):
+    """
+    Decorator for the app's answer functions (function, coroutine, generator or async generator):
+    counts the call as an in-flight request of `endpoint`; inside it, note_route() and
+    record_fallback() fill in the routed agent and the outcome.
+    """
+
+    def decorate(fn):
+        if inspect.isasyncgenfunction(fn):
+            @functools.wraps(fn)
+            async def agen_wrapper(*args, **kwargs):
+                with _tracking(endpoint):
+                    async for item in fn(*args, **kwargs):
+                        yield item
+            return agen_wrapper
+
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def gen_wrapper(*args, **kwargs):
+                with _tracking(endpoint):
+                    return (yield from fn(*args, **kwargs))
+            return gen_wrapper
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def coro_wrapper(*args, **kwargs):
+                with _tracking(endpoint):
+                    return await fn(*args, **kwargs)
+            return coro_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _tracking(endpoint):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    return decorate
+
+
+# The request tracked in this thread / asyncio task
+_current: contextvars.ContextVar = contextvars.ContextVar("ta_tracked_request", default=None)
+
+
+@contextmanager
+def _tracking(endpoint: str):
+    with default_service_metrics().track(endpoint) as tracked:
+        previous = _current.get()
+        _current.set(tracked)
+        try:
+            yield tracked
+        finally:
+            _current.set(previous)
+
+
+def note_route(router: Dict, ttft: Optional[float] = None):
+    """Record the router decision (and time to first token) of the request being tracked."""
+    tracked = _current.get()
+    if tracked is None:
+        return
+    tracked.route_to = router.get("route_to") or "None"
+    if router.get("need_human_TA"):
+        tracked.outcome = "human"
+    if ttft is not None:
+        tracked.ttft = ttft
+
+
+def note_error():
+    """The tracked request failed after part of its answer was sent (an interrupted stream)."""
+    tracked = _current.get()
+    if tracked is not None:
+        tracked.outcome = "error"
+
+
+def record_fallback():
+    """Count a get_ai_response_fallback answer (also the outcome of the request being tracked)."""
+    default_service_metrics().fallbacks.inc()
+    tracked = _current.get()
+    if tracked is not None:
+        tracked.outcome = "fallback"
@@ -0,0 +1,299 @@
+"""
+Retries, backoff and a circuit breaker for the LLM API calls of deepseek_client.
+
+- retryable failures: connection errors and timeouts, HTTP 408 / 409 / 429 and 5xx (or whatever
+  an `x-should-retry` response header says); other 4xx errors are raised at once
+- RetryPolicy: exponential backoff with full jitter (a random delay in
+  [0, min(max_delay, base_delay * 2**attempt)]); a Retry-After / retry-after-ms header on the
+  error response is honored instead, up to max_retry_after seconds
+- CircuitBreaker: after `threshold` consecutive upstream failures the circuit opens and calls
+  fail fast with CircuitOpenError for `reset_timeout` seconds; then a single probe call is let
+  through (half-open) and its outcome closes or re-opens the circuit
+- CallGuard ties both together for one upstream and counts calls, retries, backoff time and
+  short-circuited calls (stats(), reported by /api/health)
+
+A streamed call is only retried while none of its text has been handed to the caller.
+
+Environment:
+    DEEPSEEK_MAX_RETRIES          retries after the first attempt (default 3; 0 disables)
+    DEEPSEEK_RETRY_BASE_DELAY     first backoff ceiling in seconds (default 0.5)
+    DEEPSEEK_RETRY_MAX_DELAY      largest backoff ceiling in seconds (default 8)
+    DEEPSEEK_RETRY_AFTER_MAX      longest Retry-After that is waited for (default 30)
+    DEEPSEEK_BREAKER_THRESHOLD    consecutive failures that open the circuit (default 5; 0 disables)
+    DEEPSEEK_BREAKER_RESET        seconds the circuit stays open (default 30)
+"""
+
+import asyncio
+import email.utils
+import os
+import random
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+import httpx
+
+from tracing import annotate
+
+T = TypeVar("T")
+
+RETRYABLE_STATUS = {408, 409, 429}
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit is open."""
+
+    def __init__(self, retry_in: float):
+        super().__init__(f"circuit open after repeated upstream failures, retry in {retry_in:.0f}s")
+        self.retry_in = retry_in
+
+
+def status_code(exc: BaseException) -> Optional[int]:
+    response = getattr(exc, "response", None)
+    return getattr(response, "status_code", None) if isinstance(response, httpx.Response) else None
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Whether a failed call may succeed when repeated (openai / httpx exceptions)."""
+    response = getattr(exc, "response", None)
+    if isinstance(response, httpx.Response):
+        hint = response.headers.get("x-should-retry")
+        if hint in ("true", "false"):
+            return hint == "true"
+        code = response.status_code
+        return code in RETRYABLE_STATUS or code >= 500
+    # openai.APIConnectionError / APITimeoutError, or raw httpx transport errors
+    name = type(exc).__name__
+    return isinstance(exc, (httpx.TransportError, TimeoutError, ConnectionError)) or name in (
+        "APIConnectionError", "APITimeoutError"
+    )
+
+
+def retry_after(exc: BaseException) -> Optional[float]:
+    """Seconds a Retry-After / retry-after-ms header of the error response asks to wait."""
+    response = getattr(exc, "response", None)
+    if not isinstance(response, httpx.Response):
+        return None
+    value = response.headers.get("retry-after-ms")
+    if value:
+        try:
+            return max(0.0, float(value) / 1000)
+        except ValueError:
+            pass
+    value = response.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        parsed = email.utils.parsedate_tz(value)
+        if parsed is None:
+            return None
+        return max(0.0, email.utils.mktime_tz(parsed) - time.time())
+
+
+class RetryPolicy:
+    def __init__(self, max_retries: int = 3, base_delay: float = 0.5, max_delay: float = 8.0,
+                 max_retry_after: float = 30.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+
+    @classmethod
+    def from_env(cls) -> "RetryPolicy":
+        return cls(
+            max_retries=int(os.getenv("DEEPSEEK_MAX_RETRIES", "3")),
+            base_delay=float(os.getenv("DEEPSEEK_RETRY_BASE_DELAY", "0.5")),
+            max_delay=float(os.getenv("DEEPSEEK_RETRY_MAX_DELAY", "8")),
+            max_retry_after=float(os.getenv("DEEPSEEK_RETRY_AFTER_MAX", "30")),
+        )
+
+    def delay(self, attempt: int, exc: Optional[BaseException] = None) -> Optional[float]:
+        """Seconds to wait before retry number attempt + 1; None if the server asks for too long."""
+        if exc is not None:
+            wait = retry_after(exc)
+            if wait is not None:
+                return wait if wait <= self.max_retry_after else None
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """Thread-safe consecutive-failure circuit breaker (threshold <= 0 never opens)."""
+
+    def __init__(self, threshold: int = 5, reset_timeout: float = 30.0):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.opens = 0
+        self._probe_started: Optional[float] = None
+
+    @classmethod
+    def from_env(cls) -> "CircuitBreaker":
+        return cls(
+            threshold=int(os.getenv("DEEPSEEK_BREAKER_THRESHOLD", "5")),
+            reset_timeout=float(os.getenv("DEEPSEEK_BREAKER_RESET", "30")),
+        )
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go upstream now."""
+        if self.threshold <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if self.state == OPEN:
+                if now - self.opened_at < self.reset_timeout:
+                    raise CircuitOpenError(self.reset_timeout - (now - self.opened_at))
+                self.state = HALF_OPEN
+                self._probe_started = None
+            if self.state == HALF_OPEN:
+                # One probe at a time; a probe that never reported back (cancelled) expires
+                if self._probe_started is not None and now - self._probe_started < self.reset_timeout:
+                    raise CircuitOpenError(self.reset_timeout - (now - self._probe_started))
+                self._probe_started = now
+
+    def record_success(self):
+        with self._lock:
+            self.consecutive_failures = 0
+            self.state = CLOSED
+            self._probe_started = None
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.threshold > 0 and (self.state == HALF_OPEN or self.consecutive_failures >= self.threshold):
+                if self.state != OPEN:
+                    self.opens += 1
+                    print(f"[Circuit Breaker] Open after {self.consecutive_failures} consecutive failures, "
+                          f"failing fast for {self.reset_timeout:.0f}s")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self._probe_started = None
+
+
+class CallGuard:
+    """
+    Retry policy + circuit breaker + counters for one upstream.
+    Usage (see deepseek_client):
+        reply = guard.call(lambda: client.chat.completions.create(...))
+        reply = await guard.acall(lambda: async_client.chat.completions.create(...))
+    Streaming callers drive the steps themselves: before_call(), then on an error
+    retry_delay(exc, attempt) (None: give up), and record_success() once the stream answered.
+    """
+
+    def __init__(self, policy: Optional[RetryPolicy] = None, breaker: Optional[CircuitBreaker] = None):
+        self.policy = policy if policy is not None else RetryPolicy.from_env()
+        self.breaker = breaker if breaker is not None else CircuitBreaker.from_env()
+        self._lock = threading.Lock()
+        self.counts = {
+            "calls": 0,
+            "failures": 0,
+            "retries": 0,
+            "retry_after_honored": 0,
+            "backoff_seconds": 0.0,
+            "short_circuited": 0,
+        }
+
+    def _count(self, key: str, value=1):
+        with self._lock:
+            self.counts[key] += value
+
+    def before_call(self, attempt: int = 0):
+        if attempt == 0:
+            self._count("calls")
+        try:
+            self.breaker.before_call()
+        except CircuitOpenError:
+            self._count("short_circuited")
+            raise
+
+    def record_success(self):
+        self.breaker.record_success()
+
+    def retry_delay(self, exc: BaseException, attempt: int) -> Optional[float]:
+        """
+        Account for a failed attempt; returns the backoff before the next one, or None if the
+        error is final (not retryable, retries used up, circuit now open, Retry-After too long).
+        """
+        if isinstance(exc, CircuitOpenError):
+            return None
+        if not is_retryable(exc):
+            # The upstream answered, so it is up; the request itself was bad
+            self.breaker.record_success()
+            self._count("failures")
+            return None
+        self.breaker.record_failure()
+        delay = self.policy.delay(attempt, exc) if attempt < self.policy.max_retries else None
+        if delay is None or self.breaker.state == OPEN:
+            self._count("failures")
+            return None
+        with self._lock:
+            self.counts["retries"] += 1
+            self.counts["backoff_seconds"] += delay
+            if retry_after(exc) is not None:
+                self.counts["retry_after_honored"] += 1
+        code = status_code(exc)
+        annotate(retries=attempt + 1)
+        print(f"[Retry] {type(exc).__name__}{f' ({code})' if code else ''}, "
+              f"retry {attempt + 1}/{self.policy.max_retries} in {delay:.2f}s")
+        return delay
+
+    def call(self, fn: Callable[[], T]) -> T:
+        attempt = 0
+        while True:
+            self.before_call(attempt)
+            try:
+                result = fn()
+            except Exception as e:
+                delay = self.retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self.record_success()
+            return result
+
+    async def acall(self, fn: Callable[[], Awaitable[T]]) -> T:
+        attempt = 0
+        while True:
+            self.before_call(attempt)
+            try:
+                result = await fn()
+            except Exception as e:
+                delay = self.retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            self.record_success()
+            return result
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self.counts)
+        stats["backoff_seconds"] = round(stats["backoff_seconds"], 2)
+        stats["breaker_state"] = self.breaker.state
+        stats["breaker_opens"] = self.breaker.opens
+        stats["consecutive_failures"] = self.breaker.consecutive_failures
+        return stats
+
+
+_default_guard: Optional[CallGuard] = None
+_default_lock = threading.Lock()
+
+
+def default_call_guard() -> CallGuard:
+    """Process-wide CallGuard shared by the sync and async DeepSeek clients (one upstream)."""
+    global _default_guard
+    if _default_guard is None:
+        with _default_lock:
+            if _default_guard is None:
+                _default_guard = CallGuard()
+    return _default_guard
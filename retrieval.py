@@ -0,0 +1,123 @@
+"""
+Inverted index over knowledge base chunks.
+
+Documents are token lists produced by CourseKnowledgeBase._tokenize (English/number words
+plus one token per CJK character), so Chinese questions retrieve Chinese slides too.
+The index is built once when the knowledge base is loaded; a query only touches the
+posting lists of its own tokens. Two scorers share the same postings:
+- BM25 (scores / top_k), used by build_context(mode="retrieval")
+- the legacy token-overlap score with filename boost (overlap_top_k), used by search()
+"""
+
+import heapq
+import math
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+
+class BM25Index:
+    """
+    postings:        token -> [(doc_id, term_frequency), ...] over document text
+    name_postings:   token -> {doc_id, ...} for tokens of the document's file name
+    doc_lens:        number of text tokens in each document
+    distinct_counts: number of distinct text + name tokens in each document
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        self.name_postings: Dict[str, Set[int]] = {}
+        self.doc_lens: List[int] = []
+        self.distinct_counts: List[int] = []
+        self.avgdl = 0.0
+        self.idf: Dict[str, float] = {}
+
+    @classmethod
+    def build(
+        cls,
+        docs: Iterable[List[str]],
+        names: Optional[Iterable[List[str]]] = None,
+        k1: float = 1.5,
+        b: float = 0.75,
+    ) -> "BM25Index":
+        """
+        docs:  text tokens of each document
+        names: file name tokens of each document (optional, same order as docs)
+        """
+        index = cls(k1=k1, b=b)
+        name_iter = iter(names) if names is not None else None
+        for doc_id, tokens in enumerate(docs):
+            index.doc_lens.append(len(tokens))
+            counts = Counter(tokens)
+            for token, tf in counts.items():
+                index.postings.setdefault(token, []).append((doc_id, tf))
+            name_tokens = set(next(name_iter)) if name_iter is not None else set()
+            for token in name_tokens:
+                index.name_postings.setdefault(token, set()).add(doc_id)
+            index.distinct_counts.append(len(counts.keys() | name_tokens))
+        n = len(index.doc_lens)
+        index.avgdl = (sum(index.doc_lens) / n) if n else 0.0
+        for token, plist in index.postings.items():
+            df = len(plist)
+            # BM25+ style idf that never goes negative for very common tokens
+            index.idf[token] = math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+        return index
+
+    def __len__(self) -> int:
+        return len(self.doc_lens)
+
+    def scores(self, query_tokens: Iterable[str]) -> Dict[int, float]:
+        """BM25 score for every document containing at least one query token."""
+        scores: Dict[int, float] = {}
+        if not self.doc_lens:
+            return scores
+        k1, b, avgdl = self.k1, self.b, self.avgdl or 1.0
+        for token in set(query_tokens):
+            plist = self.postings.get(token)
+            if not plist:
+                continue
+            idf = self.idf[token]
+            for doc_id, tf in plist:
+                norm = k1 * (1.0 - b + b * self.doc_lens[doc_id] / avgdl)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (k1 + 1.0) / (tf + norm)
+        return scores
+
+    def top_k(self, query_tokens: Iterable[str], k: int) -> List[Tuple[float, int]]:
+        """[(score, doc_id), ...] best first; ties broken by document order."""
+        return _rank(self.scores(query_tokens), k)
+
+    def overlap_scores(self, query_tokens: Iterable[str], name_boost: float = 0.5) -> Dict[int, float]:
+        """
+        Legacy CourseKnowledgeBase.search score, computed from postings instead of re-tokenizing chunks:
+            |query ∩ (text ∪ name)| / sqrt(|text ∪ name|) + name_boost * |query ∩ name|
+        (all token sets are distinct tokens).
+        """
+        overlap: Dict[int, int] = {}
+        name_hits: Dict[int, int] = {}
+        for token in set(query_tokens):
+            in_text = [doc_id for doc_id, _ in self.postings.get(token, ())]
+            for doc_id in in_text:
+                overlap[doc_id] = overlap.get(doc_id, 0) + 1
+            in_name = self.name_postings.get(token)
+            if in_name:
+                text_docs = set(in_text)
+                for doc_id in in_name:
+                    name_hits[doc_id] = name_hits.get(doc_id, 0) + 1
+                    if doc_id not in text_docs:
+                        overlap[doc_id] = overlap.get(doc_id, 0) + 1
+        return {
+            doc_id: n / (self.distinct_counts[doc_id] ** 0.5 + 1e-6) + name_boost * name_hits.get(doc_id, 0)
+            for doc_id, n in overlap.items()
+        }
+
+    def overlap_top_k(self, query_tokens: Iterable[str], k: int, name_boost: float = 0.5) -> List[Tuple[float, int]]:
+        """[(score, doc_id), ...] by the legacy overlap score, best first; ties broken by document order."""
+        return _rank(self.overlap_scores(query_tokens, name_boost), k)
+
+
+def _rank(scores: Dict[int, float], k: int) -> List[Tuple[float, int]]:
+    if k <= 0 or not scores:
+        return []
+    ranked = heapq.nsmallest(k, scores.items(), key=lambda x: (-x[1], x[0]))
+    return [(score, doc_id) for doc_id, score in ranked]
@@ -0,0 +1,268 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Dict, Iterator, Optional
+
+from caching import AnswerCache, RouterCache, default_answer_cache, default_router_cache
+from deepseek_client import AsyncDeepSeekClient, DeepSeekClient
+from fast_router import FastRouter, default_fast_router
+from history_store import HistoryPersister, default_history_persister
+from speculation import SpeculationStats, default_speculation_stats
+from ta_agents_history import CourseKnowledgeBase, RouterAgent, TeachingAssistant
+
+
+class _SessionEntry:
+    __slots__ = ("ta", "lock", "async_lock", "last_used", "in_use")
+
+    def __init__(self, ta: TeachingAssistant):
+        self.ta = ta
+        # Serializes questions within one conversation so history stays in order
+        self.lock = threading.Lock()
+        # Same for the asyncio serving path (asgi_app), where a thread lock would block the event loop
+        self.async_lock = asyncio.Lock()
+        self.last_used = time.monotonic()
+        # session() / session_async() callers holding or waiting for the locks; such an entry is
+        # never evicted, or a second TeachingAssistant (with its own locks) could be created for
+        # the same conversation and interleave its history
+        self.in_use = 0
+
+    def evictable(self) -> bool:
+        return not self.in_use and not self.lock.locked() and not self.async_lock.locked()
+
+
+class SessionRegistry:
+    """
+    Process-wide registry of Teaching Assistant sessions:
+    - Holds ONE CourseKnowledgeBase and ONE DeepSeekClient (plus ONE AsyncDeepSeekClient
+      when use_async is set) for the whole process. They are built lazily on first use (or eagerly via warm_up) and are treated as
+      read-only afterwards, so they can be shared by all sessions and threads.
+    - Hands out lightweight per-conversation TeachingAssistant objects that only own
+      their conversation history; course materials are never re-parsed per request.
+    - Keeps at most max_sessions sessions (LRU) and drops sessions idle for longer
+      than idle_timeout seconds. An evicted session simply reloads its history file
+      the next time it is requested. Sessions with a question in progress (or waiting for
+      one) are never evicted; the registry may briefly hold more than max_sessions then.
+    """
+
+    def __init__(
+        self,
+        materials_folder: str = "course_materials",
+        max_sessions: int = 256,
+        idle_timeout: float = 1800.0,
+        client: Optional[DeepSeekClient] = None,
+        kb: Optional[CourseKnowledgeBase] = None,
+        context_modes: Optional[Dict[str, str]] = None,
+        prompt_layout: Optional[str] = None,
+        use_async: bool = False,
+        async_client: Optional[AsyncDeepSeekClient] = None,
+    ):
+        self.materials_folder = materials_folder
+        self.context_modes = context_modes
+        self.prompt_layout = prompt_layout
+        self.max_sessions = max(1, int(max_sessions))
+        self.idle_timeout = float(idle_timeout)
+        self._client = client
+        self.use_async = use_async or async_client is not None
+        self._async_client = async_client
+        self._kb = kb
+        self._sessions: "OrderedDict[str, _SessionEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._init_lock = threading.Lock()
+        self.evictions = 0
+
+    # ---- Shared resources ----
+
+    @property
+    def client(self) -> DeepSeekClient:
+        if self._client is None:
+            with self._init_lock:
+                if self._client is None:
+                    self._client = DeepSeekClient()
+        return self._client
+
+    @property
+    def async_client(self) -> Optional[AsyncDeepSeekClient]:
+        if not self.use_async:
+            return None
+        if self._async_client is None:
+            with self._init_lock:
+                if self._async_client is None:
+                    self._async_client = AsyncDeepSeekClient()
+        return self._async_client
+
+    @property
+    def fast_router(self) -> FastRouter:
+        """The process-wide local router shared by all sessions."""
+        return default_fast_router(CourseKnowledgeBase._tokenize)
+
+    @property
+    def router_cache(self) -> Optional[RouterCache]:
+        """The process-wide router decision cache (None when disabled)."""
+        return default_router_cache(CourseKnowledgeBase._tokenize, RouterAgent(self.client).prompt_version())
+
+    @property
+    def answer_cache(self) -> Optional[AnswerCache]:
+        """The process-wide first-turn answer cache (None when disabled)."""
+        return default_answer_cache(CourseKnowledgeBase._tokenize)
+
+    @property
+    def speculation_stats(self) -> SpeculationStats:
+        """Process-wide speculative routing counters (see speculation.py)."""
+        return default_speculation_stats()
+
+    @property
+    def history_persister(self) -> HistoryPersister:
+        """Process-wide write-behind writer of the session history files (see history_store.py)."""
+        return default_history_persister()
+
+    @property
+    def kb(self) -> CourseKnowledgeBase:
+        if self._kb is None:
+            with self._init_lock:
+                if self._kb is None:
+                    self._kb = CourseKnowledgeBase(self.materials_folder)
+        return self._kb
+
+    def warm_up(self):
+        """Build the shared client and knowledge base now instead of on the first question."""
+        _ = self.client
+        _ = self.async_client
+        _ = self.kb
+        _ = self.fast_router
+        _ = self.router_cache
+        _ = self.answer_cache
+
+    # ---- Sessions ----
+
+    def _get_entry(self, session_id: str, hold: bool = False) -> _SessionEntry:
+        """The session's entry; hold=True marks it in use until _release(entry)."""
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle_locked(now)
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                self._sessions.move_to_end(session_id)
+                entry.last_used = now
+                entry.in_use += hold
+                return entry
+
+        # Built outside the registry lock: loading history does file I/O
+        ta = TeachingAssistant(
+            materials_folder=self.materials_folder,
+            session_id=session_id,
+            client=self.client,
+            kb=self.kb,
+            context_modes=self.context_modes,
+            prompt_layout=self.prompt_layout,
+            async_client=self.async_client,
+            fast_router=self.fast_router,
+            router_cache=self.router_cache,
+            answer_cache=self.answer_cache,
+            speculation_stats=self.speculation_stats,
+            history_persister=self.history_persister,
+        )
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                entry = _SessionEntry(ta)
+                self._sessions[session_id] = entry
+            self._sessions.move_to_end(session_id)
+            entry.last_used = time.monotonic()
+            entry.in_use += hold
+            self._trim_locked()
+            return entry
+
+    def _release(self, entry: _SessionEntry):
+        with self._lock:
+            entry.in_use -= 1
+
+    def _trim_locked(self):
+        """
+        Drop least recently used sessions down to max_sessions, skipping sessions in use;
+        when all of them are busy the registry stays over the limit until some are released.
+        """
+        excess = len(self._sessions) - self.max_sessions
+        if excess <= 0:
+            return
+        victims = [sid for sid, entry in self._sessions.items() if entry.evictable()][:excess]
+        for sid in victims:
+            del self._sessions[sid]
+        self.evictions += len(victims)
+
+    def get(self, session_id: str) -> TeachingAssistant:
+        """Return the (possibly cached) TeachingAssistant for session_id."""
+        return self._get_entry(session_id).ta
+
+    @contextmanager
+    def session(self, session_id: str) -> Iterator[TeachingAssistant]:
+        """
+        Context manager yielding the session's TeachingAssistant while holding its lock,
+        so two concurrent messages in the same conversation cannot interleave history.
+        """
+        entry = self._get_entry(session_id, hold=True)
+        try:
+            with entry.lock:
+                entry.last_used = time.monotonic()
+                yield entry.ta
+                entry.last_used = time.monotonic()
+        finally:
+            self._release(entry)
+
+    @asynccontextmanager
+    async def session_async(self, session_id: str) -> AsyncIterator[TeachingAssistant]:
+        """Async counterpart of session(): waits on the session's asyncio lock instead of blocking."""
+        # In a worker thread: a new session loads its history file. If the caller is cancelled
+        # meanwhile, the hold taken by that thread is released once it finishes.
+        pending = asyncio.ensure_future(asyncio.to_thread(self._get_entry, session_id, True))
+        try:
+            entry = await asyncio.shield(pending)
+        except asyncio.CancelledError:
+            pending.add_done_callback(
+                lambda f: None if f.cancelled() or f.exception() else self._release(f.result())
+            )
+            raise
+        try:
+            async with entry.async_lock:
+                entry.last_used = time.monotonic()
+                yield entry.ta
+                entry.last_used = time.monotonic()
+        finally:
+            self._release(entry)
+
+    def drop(self, session_id: str) -> bool:
+        """Forget a session (its history file is left untouched)."""
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def _evict_idle_locked(self, now: float) -> int:
+        if self.idle_timeout <= 0:
+            return 0
+        expired = [
+            sid for sid, entry in self._sessions.items()
+            if now - entry.last_used > self.idle_timeout and entry.evictable()
+        ]
+        for sid in expired:
+            del self._sessions[sid]
+        self.evictions += len(expired)
+        return len(expired)
+
+    def evict_idle(self) -> int:
+        """Drop sessions that have been idle longer than idle_timeout; returns the number dropped."""
+        with self._lock:
+            return self._evict_idle_locked(time.monotonic())
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._sessions)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "active_sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "idle_timeout": self.idle_timeout,
+                "evictions": self.evictions,
+                "kb_loaded": self._kb is not None,
+            }
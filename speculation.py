@@ -0,0 +1,207 @@
+"""
+Speculative agent calls: start the most likely answering agent while the LLM router is still
+deciding, keep the answer when the router agrees and throw it away when it does not.
+
+TeachingAssistant only speculates when a question actually goes to the LLM router (no fast-path
+or cached decision) and the local classifier's best guess (FastRouter.classify) names an agent
+with confidence >= TA_SPECULATIVE_MIN_CONFIDENCE. The speculative call streams into a buffer:
+- hit : the router picked the same agent; the buffered text is replayed and the rest streamed
+        through, so the answer is already router-latency seconds ahead
+- miss: the router picked another agent or flagged need_human_TA; the call is cancelled and
+        the prompt plus the completion text received so far are counted as wasted tokens
+
+SpeculativeCall runs the sync client's stream on a daemon thread; AsyncSpeculativeCall runs
+the async client's stream as an asyncio task. SpeculationStats collects the counters that tell
+whether speculation pays off (hit rate vs wasted tokens).
+
+Environment:
+    TA_SPECULATIVE                 "on" enables speculative routing (default off)
+    TA_SPECULATIVE_MIN_CONFIDENCE  min local classifier confidence to speculate (default 0.5)
+"""
+
+import asyncio
+import contextvars
+import os
+import queue
+import threading
+import time
+from typing import AsyncIterator, Callable, Dict, Iterator, Optional
+
+from token_budget import count_tokens
+
+_DONE = object()
+
+
+def speculative_enabled() -> bool:
+    return os.getenv("TA_SPECULATIVE", "off").lower() in ("on", "1", "true")
+
+
+def speculative_min_confidence() -> float:
+    return float(os.getenv("TA_SPECULATIVE_MIN_CONFIDENCE", "0.5"))
+
+
+class SpeculationStats:
+    """Thread-safe counters of speculative agent calls."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = 0
+        self.hits = 0
+        self.misses = 0
+        self.discarded_human = 0
+        self.wasted_tokens = 0
+        self.head_start_seconds = 0.0
+
+    def record_start(self):
+        with self._lock:
+            self.started += 1
+
+    def record_hit(self, head_start: float):
+        with self._lock:
+            self.hits += 1
+            self.head_start_seconds += head_start
+
+    def record_miss(self, wasted_tokens: int, human: bool = False):
+        with self._lock:
+            if human:
+                self.discarded_human += 1
+            else:
+                self.misses += 1
+            self.wasted_tokens += wasted_tokens
+
+    def stats(self) -> Dict:
+        with self._lock:
+            resolved = self.hits + self.misses + self.discarded_human
+            return {
+                "started": self.started,
+                "hits": self.hits,
+                "misses": self.misses,
+                "discarded_human": self.discarded_human,
+                "hit_rate": round(self.hits / resolved, 4) if resolved else 0.0,
+                "wasted_tokens": self.wasted_tokens,
+                "head_start_seconds": round(self.head_start_seconds, 2),
+            }
+
+
+class _SpeculativeBase:
+    # Produced by the routed agent itself, so it may go into the answer cache
+    cacheable = True
+
+    def __init__(self, agent, client):
+        self.agent = agent
+        self.route_to = agent.agent_name
+        self.client = client
+        self.started = time.perf_counter()
+        self.prompt_tokens = 0
+        self.parts = []
+        self.usage: Optional[Dict] = None
+        self.error: Optional[BaseException] = None
+        self.finished = False
+
+    def _built(self):
+        # _build runs eagerly when the stream is created, so the report is this call's
+        report = self.agent.last_token_report
+        self.prompt_tokens = report.total if report is not None else 0
+
+    def _finished(self):
+        self.usage = dict(getattr(self.client, "last_usage", {}) or {})
+        self.finished = True
+
+    def wasted_tokens(self) -> int:
+        """Tokens spent on the call: API usage when it completed, otherwise an estimate."""
+        if self.usage:
+            return int(self.usage.get("prompt_tokens", 0)) + int(self.usage.get("completion_tokens", 0))
+        return self.prompt_tokens + count_tokens("".join(self.parts))
+
+    def head_start(self) -> float:
+        return time.perf_counter() - self.started
+
+
+class SpeculativeCall(_SpeculativeBase):
+    """An agent stream consumed on a background thread; deltas() replays it, cancel() stops it."""
+
+    def __init__(self, agent, start_stream: Callable[[], Iterator[str]], client):
+        super().__init__(agent, client)
+        self._start_stream = start_stream
+        self._queue: "queue.Queue" = queue.Queue()
+        self._cancelled = threading.Event()
+        # Run in a copy of the caller's context so the call's trace spans nest under the request
+        self._thread = threading.Thread(
+            target=contextvars.copy_context().run, args=(self._run,), name=f"speculate-{self.route_to}", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self):
+        stream = None
+        try:
+            stream = self._start_stream()
+            self._built()
+            for delta in stream:
+                self.parts.append(delta)
+                self._queue.put(delta)
+                if self._cancelled.is_set():
+                    break
+            else:
+                self._finished()
+        except Exception as e:
+            self.error = e
+        finally:
+            if stream is not None and hasattr(stream, "close"):
+                stream.close()
+            self._queue.put(_DONE)
+
+    def deltas(self) -> Iterator[str]:
+        """Everything the agent produced, buffered text first; re-raises the agent's error."""
+        while True:
+            item = self._queue.get()
+            if item is _DONE:
+                break
+            yield item
+        if self.error is not None:
+            raise self.error
+
+    def cancel(self):
+        self._cancelled.set()
+
+
+class AsyncSpeculativeCall(_SpeculativeBase):
+    """Async counterpart of SpeculativeCall, consuming the async stream in an asyncio task."""
+
+    def __init__(self, agent, start_stream: Callable[[], AsyncIterator[str]], client):
+        super().__init__(agent, client)
+        self._start_stream = start_stream
+        self._queue: "asyncio.Queue" = asyncio.Queue()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        try:
+            stream = self._start_stream()
+            self._built()
+            async for delta in stream:
+                self.parts.append(delta)
+                self._queue.put_nowait(delta)
+            self._finished()
+        except Exception as e:
+            self.error = e
+        finally:
+            self._queue.put_nowait(_DONE)
+
+    async def deltas(self) -> AsyncIterator[str]:
+        while True:
+            item = await self._queue.get()
+            if item is _DONE:
+                break
+            yield item
+        if self.error is not None:
+            raise self.error
+
+    def cancel(self):
+        self._task.cancel()
+
+
+_default_stats = SpeculationStats()
+
+
+def default_speculation_stats() -> SpeculationStats:
+    """Process-wide speculation counters shared by all sessions."""
+    return _default_stats
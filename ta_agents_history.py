@@ -1,10 +1,29 @@
+import abc
 import os
 import json
 import re
+import time
 from dataclasses import dataclass
-from typing import List, Dict, Optional, Tuple
-
-from deepseek_client import DeepSeekClient  # Reuse your existing wrapper
+from typing import AsyncIterator, Iterator, List, Dict, Optional, Tuple
+
+from caching import AnswerCache, RouterCache, default_answer_cache, default_router_cache, prompt_version
+from deepseek_client import AsyncDeepSeekClient, DeepSeekClient  # Reuse your existing wrapper
+from fast_router import CODE_KEYWORDS, CODE_RE, EXAM_KEYWORDS, LAB_KEYWORDS, FastRouter, default_fast_router
+from history_store import HISTORY_WINDOW, HistoryPersister, default_history_persister
+from kb_cache import DEFAULT_CACHE_DIR, MaterialCache
+from llm_config import settings_for
+from retrieval import BM25Index
+from speculation import (
+    AsyncSpeculativeCall,
+    SpeculationStats,
+    SpeculativeCall,
+    default_speculation_stats,
+    speculative_enabled,
+    speculative_min_confidence,
+)
+from token_budget import ContextPacker, TokenBudget, TokenReport, count_tokens
+from tracing import annotate, traced
+from usage_ledger import UsageLedger, tag_usage, usage_tags
 
 
 # =======================
@@ -15,19 +34,97 @@ class CourseKnowledgeBase:
     """
     Lightweight Course Knowledge Base (Revised to "Global Knowledge Graph" mode):
     - Scans course materials (txt/md/pdf/pptx) in a specified directory
-    - Still splits into multiple "chunks", but no longer retrieves based on query
+    - Still splits into multiple "chunks", indexed with BM25 (self.index) for optional retrieval
     - Organizes all materials by "file dimension" into one large text self.global_context
-    - When answering questions, directly provides the entire global_context to the LLM,
-      allowing the LLM to decide which sections/materials to use (e.g., chapters 1-10 vs. all)
+    - When answering questions, by default ("full" mode) directly provides the entire global_context
+      to the LLM, allowing the LLM to decide which sections/materials to use (e.g., chapters 1-10 vs. all);
+      "retrieval" mode instead sends only the top-k relevant chunks (see build_context)
     """
 
-    def __init__(self, folder: str = "course_materials"):
+    SUPPORTED_EXTS = (".txt", ".md", ".pdf", ".pptx")
+
+    # build_context modes:
+    # - "full"      : the entire global_context (the original "global knowledge graph" behavior)
+    # - "retrieval" : BM25 top-k chunks for the query, packed within max_chars
+    CONTEXT_MODES = ("full", "retrieval")
+
+    def __init__(
+        self,
+        folder: str = "course_materials",
+        cache_dir: Optional[str] = DEFAULT_CACHE_DIR,
+        workers: Optional[int] = None,
+    ):
         self.folder = folder
+        # Parse cache directory (see kb_cache.py); None / "" disables the on-disk cache
+        self.cache = MaterialCache(cache_dir) if cache_dir else None
+        # Number of processes used to parse uncached files; None -> TA_KB_WORKERS or CPU count, 1 -> in-process
+        self.workers = workers if workers is not None else int(os.getenv("TA_KB_WORKERS", "0")) or None
         # Each chunk: {"path": str, "text": str}
         self.chunks: List[Dict] = []
+        # Per-file load timings in seconds: {"path": str, "seconds": float, "source": "cache" | "parsed"}
+        self.load_timings: List[Dict] = []
         # The entire course knowledge graph text
         self.global_context: str = ""
+        # BM25 inverted index over self.chunks (doc_id == index into self.chunks)
+        self.index = BM25Index()
+        self._prompt_prefix: Optional[str] = None
+        self._materials_version: Optional[str] = None
+        # (materials_version, count_tokens(global_context))
+        self._context_tokens: Optional[Tuple[str, int]] = None
+        started = time.perf_counter()
         self._load_folder()
+        self._build_index()
+        # Wall time of the whole load (cache lookups, parsing, global context, index)
+        self.load_seconds = time.perf_counter() - started
+
+    @classmethod
+    def _extract_text(cls, path: str) -> str:
+        """Extract raw text from one material file based on its extension ("" if unsupported)."""
+        ext = os.path.splitext(path)[1].lower()
+        if ext in [".txt", ".md"]:
+            return cls._load_text_file(path)
+        elif ext == ".pdf":
+            return cls._load_pdf_file(path)
+        elif ext == ".pptx":
+            return cls._load_pptx_file(path)
+        return ""
+
+    def _list_material_files(self) -> List[str]:
+        """All supported files under self.folder, in a stable (sorted) order."""
+        paths = []
+        for root, dirs, files in os.walk(self.folder):
+            dirs.sort()
+            for name in sorted(files):
+                if os.path.splitext(name)[1].lower() in self.SUPPORTED_EXTS:
+                    paths.append(os.path.join(root, name))
+        return paths
+
+    def _parse_files(self, paths: List[str]) -> Dict[str, Tuple[str, List[str], float, Optional[str]]]:
+        """
+        Parse uncached files, fanning out over a process pool when there is more than one.
+        Returns {path: (text, chunk_texts, seconds, error)}; results are keyed by path so the
+        completion order of the workers never affects chunk / global_context order.
+        """
+        if not paths:
+            return {}
+        workers = min(self.workers or os.cpu_count() or 1, len(paths))
+        if workers <= 1:
+            return {p: _parse_material_file(p) for p in paths}
+
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        # fork where available: under spawn (macOS / Windows default) each worker would re-import
+        # the caller's __main__, and app.py builds its registry (and this knowledge base) at import
+        mp_context = multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else None
+        print(f"[Knowledge Base] Parsing {len(paths)} files with {workers} worker processes...")
+        try:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context) as pool:
+                return dict(zip(paths, pool.map(_parse_material_file, paths)))
+        except Exception as e:
+            # e.g. process creation not permitted in a sandbox: fall back to sequential parsing
+            print(f"[Knowledge Base] Process pool unavailable ({e}), parsing sequentially.")
+            return {p: _parse_material_file(p) for p in paths}
 
     def _load_folder(self):
         if not os.path.isdir(self.folder):
@@ -36,40 +133,79 @@ class CourseKnowledgeBase:
             return
 
         print(f"[Knowledge Base] Loading materials from {self.folder}...")
-        for root, _, files in os.walk(self.folder):
-            for name in files:
-                path = os.path.join(root, name)
-                ext = os.path.splitext(name)[1].lower()
-                try:
-                    if ext in [".txt", ".md"]:
-                        text = self._load_text_file(path)
-                    elif ext == ".pdf":
-                        text = self._load_pdf_file(path)
-                    elif ext == ".pptx":
-                        text = self._load_pptx_file(path)
-                    else:
-                        continue
-
-                    text = text.strip()
-                    if not text:
-                        continue
-
-                    # Split the entire content into multiple chunks (mainly for readability and context continuity)
-                    for chunk_text in self._chunk_text(text, chunk_size=700, overlap=150):
-                        self.chunks.append(
-                            {"path": path, "text": chunk_text}
-                        )
-
-                    print(f"[Knowledge Base] Loaded and split: {path} (Current total: {len(self.chunks)} chunks)")
-                except Exception as e:
-                    print(f"[Knowledge Base] Failed to load {path}: {e}")
+        load_start = time.perf_counter()
+        paths = self._list_material_files()
+
+        # 1) Cache lookups (cheap, in-process)
+        cached: Dict[str, List[str]] = {}
+        for path in paths:
+            try:
+                entry = self.cache.lookup(path) if self.cache else None
+            except OSError as e:
+                print(f"[Knowledge Base] Failed to stat {path}: {e}")
+                entry = None
+            if entry is not None:
+                cached[path] = entry["chunks"]
+
+        # 2) Parse everything else (CPU bound: python-pptx / PyPDF2)
+        parsed = self._parse_files([p for p in paths if p not in cached])
+
+        # 3) Assemble chunks in file order
+        loaded_paths: List[str] = []
+        for path in paths:
+            if path in cached:
+                chunk_texts, seconds, source = cached[path], 0.0, "cache"
+            else:
+                text, chunk_texts, seconds, error = parsed[path]
+                source = "parsed"
+                if error:
+                    print(f"[Knowledge Base] Failed to load {path}: {error}")
+                    continue
+                if self.cache:
+                    self.cache.store(path, text, chunk_texts)
+
+            self.load_timings.append({"path": path, "seconds": seconds, "source": source})
+            if not chunk_texts:
+                continue
+            for chunk_text in chunk_texts:
+                self.chunks.append(
+                    {"path": path, "text": chunk_text}
+                )
+            loaded_paths.append(path)
+            print(f"[Knowledge Base] Loaded and split ({source}, {seconds:.3f}s): {path} (Current total: {len(self.chunks)} chunks)")
 
         print(f"[Knowledge Base] Generated a total of {len(self.chunks)} text fragments (chunks).")
+        print(
+            f"[Knowledge Base] {len(parsed)} files parsed, {len(cached)} from cache in "
+            f"{time.perf_counter() - load_start:.2f}s (sum of per-file parse time "
+            f"{sum(t['seconds'] for t in self.load_timings):.2f}s)."
+        )
 
         # Key: Build the "global course knowledge graph" text here in one go
-        self.global_context = self._build_global_context()
+        # (reused from the parse cache when the same set of files is loaded again)
+        digest = None
+        if self.cache:
+            self.cache.prune(loaded_paths, self.folder)
+            self.cache.save()
+            digest = self.cache.fingerprint(loaded_paths)
+            self.global_context = self.cache.load_global_context(digest) or ""
+        if not self.global_context:
+            self.global_context = self._build_global_context()
+            if self.cache:
+                self.cache.save_global_context(digest, self.global_context)
         print(f"[Knowledge Base] Global course knowledge graph built, total characters approximately {len(self.global_context)}.")
 
+    def _build_index(self):
+        """(Re)build the inverted index over self.chunks: text postings + file name postings."""
+        name_tokens: Dict[str, List[str]] = {}
+        for ch in self.chunks:
+            if ch["path"] not in name_tokens:
+                name_tokens[ch["path"]] = self._tokenize(os.path.basename(ch["path"]))
+        self.index = BM25Index.build(
+            (self._tokenize(ch["text"]) for ch in self.chunks),
+            names=(name_tokens[ch["path"]] for ch in self.chunks),
+        )
+
     def _build_global_context(self) -> str:
         """
         Groups all chunks by "file (lecture slides)" and organizes them into a large knowledge graph text.
@@ -170,7 +306,8 @@ class CourseKnowledgeBase:
     @staticmethod
     def _tokenize(s: str) -> List[str]:
         """
-        (No longer used for retrieval logic, but kept for potential future expansion)
+        Shared tokenizer of the BM25 retrieval index, the fast router and the router / answer
+        caches; changing it changes their scores and cache keys.
         Splits a string into:
         - English/Numbers: continuous segments like 'quick', 'sort', 'lab', 'cs202'
         - Chinese: character by character, e.g., '快','速','排','序'
@@ -185,50 +322,96 @@ class CourseKnowledgeBase:
 
     def search(self, query: str, top_k: int = 4) -> List[Dict]:
         """
-        Old "retrieve chunks by query" interface.
-        Not recommended for use now; kept for compatibility. Can be reused if retrieval is needed later.
+        Old "retrieve chunks by query" interface, kept for compatibility.
+        Score per chunk: distinct query tokens found in the chunk text or file name, normalized by
+        sqrt(number of distinct chunk tokens), plus 0.5 per query token in the file name.
+        Served from the precomputed posting lists in self.index, so the cost depends on the
+        query terms rather than on the corpus size. (build_context(mode="retrieval") uses BM25 instead.)
         """
         if not self.chunks:
             return []
+        return [self.chunks[i] for _, i in self.index.overlap_top_k(self._tokenize(query), top_k)]
 
-        q_tokens = set(self._tokenize(query))
-        scored: List[Tuple[float, Dict]] = []
+    def retrieve(self, query: str, top_k: int = 4) -> List[Tuple[float, Dict]]:
+        """BM25 top-k chunks for query: [(score, chunk), ...], best first."""
+        return [(score, self.chunks[i]) for score, i in self.index.top_k(self._tokenize(query), top_k)]
 
-        for chunk in self.chunks:
-            d_tokens = set(self._tokenize(chunk["text"]))
-            name_tokens = set(self._tokenize(os.path.basename(chunk["path"])))
-            all_tokens = d_tokens | name_tokens
+    def prompt_prefix(self) -> str:
+        """
+        The whole course knowledge graph as a system prompt prefix (prompt_layout="prefix").
+        Built once and byte-identical for every session and agent, so the provider's
+        prompt cache can serve it; agent-specific instructions are appended after it.
+        """
+        if self._prompt_prefix is None:
+            self._prompt_prefix = (
+                "Below is the [Complete Knowledge Graph/Course Materials] for this course "
+                "(grouped by lecture/chapter). It is shared by all teaching assistants; refer to it "
+                "when answering, following its terminology, symbols and pseudocode style.\n\n"
+                + self.global_context
+                + "\n\n===== End of Course Materials =====\n\n"
+            )
+        return self._prompt_prefix
 
-            overlap = len(q_tokens & all_tokens)
-            if overlap == 0:
-                continue
+    def materials_version(self) -> str:
+        """Short digest of the loaded course materials (changes whenever any slide text changes)."""
+        if self._materials_version is None:
+            self._materials_version = prompt_version(self.global_context)
+        return self._materials_version
 
-            base_score = overlap / (len(all_tokens) ** 0.5 + 1e-6)
-            filename_boost = len(q_tokens & name_tokens) * 0.5
-            score = base_score + filename_boost
-            scored.append((score, chunk))
+    def context_tokens(self) -> int:
+        """Tokens of the whole global_context, counted once per materials version (ContextPacker's full mode)."""
+        version = self.materials_version()
+        if self._context_tokens is None or self._context_tokens[0] != version:
+            self._context_tokens = (version, count_tokens(self.global_context))
+        return self._context_tokens[1]
 
-        scored.sort(key=lambda x: x[0], reverse=True)
-        return [c for _, c in scored[:top_k]]
+    @staticmethod
+    def format_chunk(chunk: Dict) -> str:
+        """A retrieved chunk as it appears in the prompt, labelled with its material name."""
+        return f"[Material: {os.path.basename(chunk['path'])}]\n{chunk['text']}"
 
-    def build_context(self, query: str, top_k: int = 4, max_chars: int = 2400) -> str:
+    def build_context(self, query: str, top_k: int = 4, max_chars: int = 2400, mode: str = "full") -> str:
         """
-        (Key Modification Point)
-        Before: Retrieved based on query, took several high-scoring chunks to form context.
-        Now: Directly returns the "entire course knowledge graph" self.global_context,
-        completely leaving it to the LLM to decide which parts are relevant to the question.
-
-        For backward compatibility, query/top_k/max_chars parameters are kept but not used here.
-        If context length becomes a concern in the future, you can truncate self.global_context here.
+        mode="full" (default, unchanged behavior):
+            Directly returns the "entire course knowledge graph" self.global_context,
+            completely leaving it to the LLM to decide which parts are relevant to the question.
+            query/top_k/max_chars are not used in this mode.
+        mode="retrieval":
+            Returns the top_k BM25 chunks for query, labelled with their material name and
+            packed best-first until max_chars is reached.
         """
-        if not self.global_context:
-            return ""
+        if mode not in self.CONTEXT_MODES:
+            raise ValueError(f"Unknown context mode {mode!r}, expected one of {self.CONTEXT_MODES}")
+        if mode == "full":
+            return self.global_context
 
-        # If you want hard truncation, you can change to:
-        # if len(self.global_context) > max_chars:
-        #     return self.global_context[:max_chars]
-        # As per your request: directly give the entire knowledge graph to the LLM.
-        return self.global_context
+        parts: List[str] = []
+        used = 0
+        for _, chunk in self.retrieve(query, top_k):
+            block = self.format_chunk(chunk)
+            if used + len(block) > max_chars:
+                if parts:
+                    # Skip, a later (shorter) chunk may still fit
+                    continue
+                block = block[:max_chars]
+            parts.append(block)
+            used += len(block) + 2
+        return "\n\n".join(parts)
+
+
+def _parse_material_file(path: str) -> Tuple[str, List[str], float, Optional[str]]:
+    """
+    Parse + chunk a single material file. Module-level so it can run in a ProcessPoolExecutor worker.
+    Returns (text, chunk_texts, seconds, error).
+    """
+    start = time.perf_counter()
+    try:
+        text = CourseKnowledgeBase._extract_text(path).strip()
+        # Split the entire content into multiple chunks (mainly for readability and context continuity)
+        chunk_texts = CourseKnowledgeBase._chunk_text(text, chunk_size=700, overlap=150) if text else []
+        return text, chunk_texts, time.perf_counter() - start, None
+    except Exception as e:
+        return "", [], time.perf_counter() - start, str(e)
 
 
 # =======================
@@ -415,6 +598,48 @@ Behavior Guidelines:
 4. Do not directly leak complete standard answers for exams or quizzes.
 """
 
+# Separates the routing header from the answer in combined route + answer replies
+ANSWER_MARKER = "===ANSWER==="
+
+COMBINED_SYSTEM_PROMPT = """
+You are the AI Teaching Assistant for the "Data Structures and Algorithms" course. For every
+student question you both classify the question and answer it, in ONE reply with two parts.
+
+Part 1 - routing header. Start the reply with one JSON object (no code fence, no other text):
+{
+  "type": "concept" | "code" | "assignment" | "practice" | "review" | "logistics" | "out_of_scope",
+  "difficulty": "easy" | "medium" | "hard",
+  "need_human_TA": true or false,
+  "route_to": "ConceptAgent" | "CodeAgent" | "PracticeAgent" | "ReviewAgent" | "None",
+  "notes_for_TA": "brief note for the human TA"
+}
+Classification rules:
+- need_human_TA = false when the student wants explanations, hints, ideas, review or practice,
+  including homework / lab questions asking "teach me / explain the idea / give hints";
+- need_human_TA = true when the question asks for complete answers to official exam (midterm,
+  final, quiz, test) questions, explicitly asks for "the full answer / full code / do my homework",
+  or is clearly beyond what you can answer reliably;
+- route_to: "ConceptAgent" for concepts and idea-level homework guidance, "CodeAgent" for code
+  debugging and implementation details, "PracticeAgent" for practice problems, "ReviewAgent" for
+  review summaries and study plans, "None" for logistics and out-of-scope questions.
+
+Part 2 - then output a line containing exactly """ + ANSWER_MARKER + """ followed by the answer.
+- If need_human_TA is true or route_to is "None", output nothing after the marker.
+- Otherwise answer as the assistant named in route_to would:
+  ConceptAgent : core idea in 2~3 sentences, step-by-step explanation, examples from the course
+                 materials, time / space complexity, common mistakes;
+  CodeAgent    : the code's intent and issues, suspicious snippets, cause of each error,
+                 modification suggestions (partial examples only), complexity;
+  PracticeAgent: practice problems matching the requested chapter / difficulty / number, with
+                 reference answers unless the student says not to give them yet;
+  ReviewAgent  : main line of the chapter, key knowledge points with complexity, common pitfalls,
+                 suggested review order.
+- Answer in the language the student mainly uses (English or Chinese, keeping English terms).
+- Follow the [Course Materials] you receive: their terminology, symbols and pseudocode style.
+- For homework / lab questions, give ideas and steps, never complete code or final answers that
+  can be copied directly; never leak complete answers for exams or quizzes.
+"""
+
 
 # =======================
 # Router Data Structure
@@ -427,31 +652,132 @@ class RouterDecision:
     need_human_TA: bool
     route_to: str
     notes_for_TA: str
+    # 1.0 for LLM decisions; the classifier's confidence for fast-path decisions
+    confidence: float = 1.0
+    # "llm", "fast_path" (fast_router.FastRouter), "cache" (caching.RouterCache) or
+    # "combined" (header of a combined route + answer reply, see CombinedAgent)
+    source: str = "llm"
 
 
 def extract_json_block(text: str) -> str:
-    """Extracts the first {...} JSON block from the model output."""
+    """
+    Extracts the first complete {...} JSON object from the model output.
+    Tolerates code fences or prose around it, braces inside JSON strings and braces in text
+    after the object (e.g. code in the answer part of a combined route + answer reply);
+    trailing commas are dropped as a last resort.
+    """
+    decoder = json.JSONDecoder()
+    start = text.find("{")
+    while start != -1:
+        try:
+            _, end = decoder.raw_decode(text, start)
+            return text[start:end]
+        except ValueError:
+            start = text.find("{", start + 1)
+
     start = text.find("{")
     end = text.rfind("}")
     if start == -1 or end == -1:
         raise ValueError(f"Router output is not valid JSON: {text!r}")
-    return text[start: end + 1]
+    return re.sub(r",\s*([}\]])", r"\1", text[start: end + 1])
+
+
+# Give up waiting for ANSWER_MARKER after this many characters (the header is ~200)
+COMBINED_HEADER_MAX_CHARS = 2000
+
+
+def split_combined_output(text: str, final: bool = False) -> Optional[Tuple[str, str]]:
+    """
+    (routing header, start of the answer) of a combined reply, or None while the header may
+    still be incomplete. final=True means the reply has ended, so a header must be found now.
+    Without ANSWER_MARKER the answer is whatever follows the first JSON object.
+    """
+    idx = text.find(ANSWER_MARKER)
+    if idx != -1:
+        return text[:idx], text[idx + len(ANSWER_MARKER):].lstrip("\r\n")
+    if not final and len(text) < COMBINED_HEADER_MAX_CHARS:
+        return None
+    header = extract_json_block(text)
+    end = text.find(header)
+    rest = text[end + len(header):] if end != -1 else ""
+    return header, rest.lstrip("\r\n")
 
 
 # =======================
 # 2. Agent Wrappers
 # =======================
 
+RETRIEVED_CONTEXT_HEADER = (
+    "Below are the [Course Material Fragments] most relevant to this question "
+    "(retrieved from the course slides, each labelled with its material), please refer to them:\n"
+)
+
+
+def default_context_mode(agent_name: str) -> str:
+    """
+    Context mode for an agent: TA_CONTEXT_MODE_<AGENT> (e.g. TA_CONTEXT_MODE_CONCEPT=retrieval),
+    falling back to TA_CONTEXT_MODE, falling back to "full".
+    """
+    key = agent_name.upper().replace("AGENT", "")
+    return os.getenv(f"TA_CONTEXT_MODE_{key}") or os.getenv("TA_CONTEXT_MODE") or "full"
+
+
+PROMPT_LAYOUTS = ("inline", "prefix")
+
+
+def default_prompt_layout() -> str:
+    """Prompt layout from TA_PROMPT_LAYOUT ("inline" or "prefix"), default "inline"."""
+    return os.getenv("TA_PROMPT_LAYOUT") or "inline"
+
+
+def context_header(mode: str, full_header: str) -> str:
+    """The agent's own header for the full knowledge graph, or the generic header for retrieved fragments."""
+    return full_header if mode == "full" else RETRIEVED_CONTEXT_HEADER
+
+
 class RouterAgent:
-    def __init__(self, client: DeepSeekClient):
-        self.client = client
+    agent_name = "RouterAgent"
 
+    def __init__(self, client: DeepSeekClient, async_client: Optional[AsyncDeepSeekClient] = None):
+        self.client = client
+        self.async_client = async_client
+        # model / max_tokens / temperature from the LLM config (see llm_config.py)
+        settings = settings_for(client, self.agent_name)
+        self.model = settings.model
+        self.max_tokens = settings.max_tokens
+        self.temperature = settings.temperature if settings.temperature is not None else 0.0
+
+    def prompt_version(self) -> str:
+        """Digest of the prompt and settings behind a routing decision (the RouterCache namespace)."""
+        return prompt_version(ROUTER_SYSTEM_PROMPT, self.model, str(self.max_tokens), str(self.temperature))
+
+    @traced("router")
     def route(self, question: str) -> RouterDecision:
-        resp = self.client.chat(
-            system_prompt=ROUTER_SYSTEM_PROMPT,
-            user_message=f"The student's question is as follows, please output the decision in the agreed format:\n\n{question}",
-            temperature=0.0,
-        )
+        with usage_tags(agent="RouterAgent", route="router"):
+            resp = self.client.chat(
+                system_prompt=ROUTER_SYSTEM_PROMPT,
+                user_message=f"The student's question is as follows, please output the decision in the agreed format:\n\n{question}",
+                temperature=self.temperature,
+                model=self.model,
+                max_tokens=self.max_tokens,
+            )
+        return self._parse(resp)
+
+    @traced("router")
+    async def route_async(self, question: str) -> RouterDecision:
+        """Same as route, awaiting the async client."""
+        with usage_tags(agent="RouterAgent", route="router"):
+            resp = await self.async_client.chat(
+                system_prompt=ROUTER_SYSTEM_PROMPT,
+                user_message=f"The student's question is as follows, please output the decision in the agreed format:\n\n{question}",
+                temperature=self.temperature,
+                model=self.model,
+                max_tokens=self.max_tokens,
+            )
+        return self._parse(resp)
+
+    @staticmethod
+    def _parse(resp: str) -> RouterDecision:
         data = json.loads(extract_json_block(resp))
         return RouterDecision(
             type=data.get("type", "out_of_scope"),
@@ -462,94 +788,308 @@ class RouterAgent:
         )
 
 
-class ConceptAgent:
-    def __init__(self, client: DeepSeekClient, kb: CourseKnowledgeBase):
+class _MaterialAgent(abc.ABC):
+    """
+    Shared plumbing of the four answering agents:
+    - token-budgeted course context + history (ContextPacker), report kept in last_token_report
+    - prompt layout:
+        "inline" : course context inside the user message, after the conversation history
+        "prefix" : system message = shared course context block + agent system prompt, so every
+                   session and agent sends a byte-identical prefix that the provider can cache;
+                   history and the question follow (only applies when the full context is used)
+    - sending the final prompt with or without conversation history, in one piece or streamed,
+      through the sync client or (the *_async methods) the optional AsyncDeepSeekClient
+
+    - the agent's model / max_tokens / temperature / context window from the LLM config
+      (see llm_config.py), temperature defaulting to the subclass's own
+
+    Subclasses implement _build(question, history) -> (system_prompt, user_message, history)
+    and set temperature.
+    """
+
+    agent_name = ""
+    system_prompt = ""
+    temperature = 0.5
+
+    def __init__(
+        self,
+        client: DeepSeekClient,
+        kb: CourseKnowledgeBase,
+        context_mode: Optional[str] = None,
+        prompt_layout: Optional[str] = None,
+        async_client: Optional[AsyncDeepSeekClient] = None,
+    ):
         self.client = client
+        self.async_client = async_client
         self.kb = kb
-
-    def answer(self, question: str, conversation_history: List[Dict] = None) -> str:
-        # Now build_context returns the entire course knowledge graph
-        context = self.kb.build_context(question, top_k=4, max_chars=2400)
-
-        # Simple check if it's lab / homework explanation
-        lower_q = question.lower()
-        lab_keywords = ["lab", "exercise", "experiment", "homework", "assignment", "作业", "练习", "实验"]
-        is_lab_like = any(k in lower_q for k in lab_keywords)
+        self.context_mode = context_mode or default_context_mode(self.agent_name)
+        self.prompt_layout = prompt_layout or default_prompt_layout()
+        if self.prompt_layout not in PROMPT_LAYOUTS:
+            raise ValueError(f"Unknown prompt layout {self.prompt_layout!r}, expected one of {PROMPT_LAYOUTS}")
+        settings = settings_for(client, self.agent_name)
+        self.model = settings.model
+        self.max_tokens = settings.max_tokens
+        if settings.temperature is not None:
+            self.temperature = settings.temperature
+        budget = TokenBudget(output_tokens=self.max_tokens)
+        if settings.context_window:
+            budget.context_window = settings.context_window
+        self.packer = ContextPacker(kb, budget)
+        self.last_token_report: Optional[TokenReport] = None
+
+    @traced("build_context")
+    def _prepare(
+        self,
+        query: str,
+        system_prompt: str,
+        question_text: str,
+        conversation_history: Optional[List[Dict]],
+        top_k: int,
+        max_chars: int,
+    ) -> Tuple[str, List[Dict], str]:
+        """Returns (context, trimmed history, effective context mode) within the token budget."""
+        context, history, report = self.packer.pack(
+            query,
+            system_prompt=system_prompt,
+            question_text=question_text,
+            history=conversation_history,
+            top_k=top_k,
+            max_chars=max_chars,
+            mode=self.context_mode,
+        )
+        self.last_token_report = report
+        annotate(agent=self.agent_name, context_mode=report.context_mode, prompt_tokens=report.total,
+                 chunks=report.chunks, history_messages=report.history_messages)
+        print(f"[Tokens] {self.agent_name}: {report.summary()}")
+        for note in report.notes:
+            print(f"[Tokens] {self.agent_name}: {note}")
+        return context, history, report.context_mode
+
+    def _compose(
+        self,
+        system_prompt: str,
+        full_header: str,
+        context: str,
+        mode: str,
+        question_parts: List[str],
+    ) -> Tuple[str, str]:
+        """Lay out (system_prompt, user_message) according to self.prompt_layout."""
+        if self.prompt_layout == "prefix" and mode == "full" and context:
+            return self.kb.prompt_prefix() + system_prompt, "\n".join(question_parts)
 
         prompt_parts = []
         if context:
-            prompt_parts.append("Below is the [Complete Knowledge Graph/Course Materials] for this course (grouped by lecture/chapter), please strictly refer to it:\n")
+            prompt_parts.append(context_header(mode, full_header))
             prompt_parts.append(context)
             prompt_parts.append("\n---\n")
-            print("\n[Debug] Current course knowledge graph context passed to LLM (first 500 chars):\n")
-            print(context[:500])
-            print("\n[Debug] ---- End ----\n")
+        prompt_parts.extend(question_parts)
+        return system_prompt, "\n".join(prompt_parts)
 
-        if is_lab_like:
-            prompt_parts.append(
-                "The above likely already contains the description or related examples for this lab/homework.\n"
-                "Please first, based on the materials, **restate the lab's task requirements in your own words**, then provide step-by-step problem-solving ideas,"
-                "explain the correspondence with class examples/pseudocode, and finally point out common mistakes."
-                "Please do not directly provide complete code or final answers that can be copied.\n"
-            )
+    def prompt_version(self) -> str:
+        """Digest of everything besides the question that shapes this agent's answers."""
+        return prompt_version(self.system_prompt, self.context_mode, self.prompt_layout, str(self.temperature),
+                              self.model, str(self.max_tokens))
 
-        prompt_parts.append(f"The student's question is:\n{question}\n")
+    @abc.abstractmethod
+    def _build(self, question: str, conversation_history: Optional[List[Dict]]) -> Tuple[str, str, List[Dict]]:
+        """(system_prompt, user_prompt, conversation_history) for one question."""
 
-        user_message = "\n".join(prompt_parts)
-        
+    def stream(self, question: str, conversation_history: List[Dict] = None) -> Iterator[str]:
+        """The agent's answer as text deltas, whatever the subclass calls it (answer / generate / review)."""
+        return self._send_stream(*self._build(question, conversation_history))
+
+    def stream_async(self, question: str, conversation_history: List[Dict] = None) -> AsyncIterator[str]:
+        return self._send_stream_async(*self._build(question, conversation_history))
+
+    @traced("agent")
+    def _send(self, system_prompt: str, user_message: str, conversation_history: List[Dict]) -> str:
+        annotate(agent=self.agent_name)
+        tag_usage(agent=self.agent_name)
         # If there is history, build the complete conversation context
         if conversation_history:
             messages = conversation_history + [{"role": "user", "content": user_message}]
             return self.client.chat_with_history(
-                system_prompt=CONCEPT_SYSTEM_PROMPT,
+                system_prompt=system_prompt,
                 messages=messages,
-                temperature=0.5,
+                temperature=self.temperature,
+                model=self.model,
+                max_tokens=self.max_tokens,
             )
         else:
             return self.client.chat(
-                system_prompt=CONCEPT_SYSTEM_PROMPT,
+                system_prompt=system_prompt,
                 user_message=user_message,
-                temperature=0.5,
+                temperature=self.temperature,
+                model=self.model,
+                max_tokens=self.max_tokens,
             )
 
-
-class CodeAgent:
-    def __init__(self, client: DeepSeekClient, kb: CourseKnowledgeBase):
-        self.client = client
-        self.kb = kb
-
-    def answer(self, question: str, conversation_history: List[Dict] = None) -> str:
-        # Also pass the entire knowledge graph to help the LLM compare with pseudocode/implementation style in the materials
-        context = self.kb.build_context(question, top_k=2, max_chars=1500)
-        prompt_parts = []
-        if context:
-            prompt_parts.append("Below is the [Complete Knowledge Graph/Course Materials] for this course (grouped by lecture/chapter), for reference:\n")
-            prompt_parts.append(context)
-            prompt_parts.append("\n---\n")
-        prompt_parts.append(f"The student's posted code or question is as follows:\n{question}\n\nPlease analyze and answer as a code debugging TA.")
-
-        user_message = "\n".join(prompt_parts)
-        
-        # If there is history, build the complete conversation context
+    @traced("agent")
+    async def _send_async(self, system_prompt: str, user_message: str, conversation_history: List[Dict]) -> str:
+        """Same as _send, awaiting the async client."""
+        annotate(agent=self.agent_name)
+        tag_usage(agent=self.agent_name)
+        if self.async_client is None:
+            raise RuntimeError(f"{self.agent_name} has no async client")
         if conversation_history:
             messages = conversation_history + [{"role": "user", "content": user_message}]
-            return self.client.chat_with_history(
-                system_prompt=CODE_SYSTEM_PROMPT,
+            return await self.async_client.chat_with_history(
+                system_prompt=system_prompt,
                 messages=messages,
-                temperature=0.4,
+                temperature=self.temperature,
+                model=self.model,
+                max_tokens=self.max_tokens,
             )
         else:
-            return self.client.chat(
-                system_prompt=CODE_SYSTEM_PROMPT,
+            return await self.async_client.chat(
+                system_prompt=system_prompt,
                 user_message=user_message,
-                temperature=0.4,
+                temperature=self.temperature,
+                model=self.model,
+                max_tokens=self.max_tokens,
             )
 
+    def _send_stream(self, system_prompt: str, user_message: str, conversation_history: List[Dict]) -> Iterator[str]:
+        """Same as _send, but yields the answer as text deltas while it is generated."""
+        if conversation_history:
+            messages = conversation_history + [{"role": "user", "content": user_message}]
+            return self._traced_stream(self.client.chat_with_history_stream(
+                system_prompt=system_prompt,
+                messages=messages,
+                temperature=self.temperature,
+                model=self.model,
+                max_tokens=self.max_tokens,
+            ))
+        else:
+            return self._traced_stream(self.client.chat_stream(
+                system_prompt=system_prompt,
+                user_message=user_message,
+                temperature=self.temperature,
+                model=self.model,
+                max_tokens=self.max_tokens,
+            ))
+
+    def _send_stream_async(self, system_prompt: str, user_message: str, conversation_history: List[Dict]) -> AsyncIterator[str]:
+        """Same as _send_stream, as an async iterator over the async client's stream."""
+        if self.async_client is None:
+            raise RuntimeError(f"{self.agent_name} has no async client")
+        if conversation_history:
+            messages = conversation_history + [{"role": "user", "content": user_message}]
+            return self._traced_stream_async(self.async_client.chat_with_history_stream(
+                system_prompt=system_prompt,
+                messages=messages,
+                temperature=self.temperature,
+                model=self.model,
+                max_tokens=self.max_tokens,
+            ))
+        else:
+            return self._traced_stream_async(self.async_client.chat_stream(
+                system_prompt=system_prompt,
+                user_message=user_message,
+                temperature=self.temperature,
+                model=self.model,
+                max_tokens=self.max_tokens,
+            ))
+
+    @traced("agent", stream=True)
+    def _traced_stream(self, deltas: Iterator[str]) -> Iterator[str]:
+        """The agent call's deltas inside an "agent" trace span (open until the stream ends)."""
+        annotate(agent=self.agent_name)
+        tag_usage(agent=self.agent_name)
+        yield from deltas
+
+    @traced("agent", stream=True)
+    async def _traced_stream_async(self, deltas: AsyncIterator[str]) -> AsyncIterator[str]:
+        annotate(agent=self.agent_name)
+        tag_usage(agent=self.agent_name)
+        async for delta in deltas:
+            yield delta
+
+
+class ConceptAgent(_MaterialAgent):
+    agent_name = "ConceptAgent"
+    system_prompt = CONCEPT_SYSTEM_PROMPT
+    temperature = 0.5
 
-class PracticeAgent:
-    def __init__(self, client: DeepSeekClient, kb: CourseKnowledgeBase):
-        self.client = client
-        self.kb = kb
+    def answer(self, question: str, conversation_history: List[Dict] = None) -> str:
+        return self._send(*self._build(question, conversation_history))
+
+    def answer_stream(self, question: str, conversation_history: List[Dict] = None) -> Iterator[str]:
+        return self._send_stream(*self._build(question, conversation_history))
+
+    async def answer_async(self, question: str, conversation_history: List[Dict] = None) -> str:
+        return await self._send_async(*self._build(question, conversation_history))
+
+    def answer_stream_async(self, question: str, conversation_history: List[Dict] = None) -> AsyncIterator[str]:
+        return self._send_stream_async(*self._build(question, conversation_history))
+
+    def _build(self, question: str, conversation_history: Optional[List[Dict]]) -> Tuple[str, str, List[Dict]]:
+        # Simple check if it's lab / homework explanation
+        lower_q = question.lower()
+        is_lab_like = any(k in lower_q for k in LAB_KEYWORDS)
+
+        question_parts = []
+        if is_lab_like:
+            question_parts.append(
+                "The above likely already contains the description or related examples for this lab/homework.\n"
+                "Please first, based on the materials, **restate the lab's task requirements in your own words**, then provide step-by-step problem-solving ideas,"
+                "explain the correspondence with class examples/pseudocode, and finally point out common mistakes."
+                "Please do not directly provide complete code or final answers that can be copied.\n"
+            )
+        question_parts.append(f"The student's question is:\n{question}\n")
+
+        # In "full" mode the context is the entire course knowledge graph (if it fits the token budget)
+        context, conversation_history, mode = self._prepare(
+            question, self.system_prompt, "\n".join(question_parts), conversation_history, top_k=4, max_chars=2400
+        )
+        if context:
+            print("\n[Debug] Current course knowledge graph context passed to LLM (first 500 chars):\n")
+            print(context[:500])
+            print("\n[Debug] ---- End ----\n")
+
+        system_prompt, user_message = self._compose(
+            self.system_prompt,
+            "Below is the [Complete Knowledge Graph/Course Materials] for this course (grouped by lecture/chapter), please strictly refer to it:\n",
+            context, mode, question_parts,
+        )
+        return system_prompt, user_message, conversation_history
+
+
+class CodeAgent(_MaterialAgent):
+    agent_name = "CodeAgent"
+    system_prompt = CODE_SYSTEM_PROMPT
+    temperature = 0.4
+
+    def answer(self, question: str, conversation_history: List[Dict] = None) -> str:
+        return self._send(*self._build(question, conversation_history))
+
+    def answer_stream(self, question: str, conversation_history: List[Dict] = None) -> Iterator[str]:
+        return self._send_stream(*self._build(question, conversation_history))
+
+    async def answer_async(self, question: str, conversation_history: List[Dict] = None) -> str:
+        return await self._send_async(*self._build(question, conversation_history))
+
+    def answer_stream_async(self, question: str, conversation_history: List[Dict] = None) -> AsyncIterator[str]:
+        return self._send_stream_async(*self._build(question, conversation_history))
+
+    def _build(self, question: str, conversation_history: Optional[List[Dict]]) -> Tuple[str, str, List[Dict]]:
+        question_text = f"The student's posted code or question is as follows:\n{question}\n\nPlease analyze and answer as a code debugging TA."
+        # Also pass the knowledge graph to help the LLM compare with pseudocode/implementation style in the materials
+        context, conversation_history, mode = self._prepare(
+            question, self.system_prompt, question_text, conversation_history, top_k=2, max_chars=1500
+        )
+        system_prompt, user_message = self._compose(
+            self.system_prompt,
+            "Below is the [Complete Knowledge Graph/Course Materials] for this course (grouped by lecture/chapter), for reference:\n",
+            context, mode, [question_text],
+        )
+        return system_prompt, user_message, conversation_history
+
+
+class PracticeAgent(_MaterialAgent):
+    agent_name = "PracticeAgent"
+    system_prompt = PRACTICE_SYSTEM_PROMPT
+    temperature = 0.6
 
     def generate(self, request: str, conversation_history: List[Dict] = None) -> str:
         """
@@ -557,78 +1097,196 @@ class PracticeAgent:
         - "Want to practice binary tree traversal, 5 medium difficulty problems, with explanations"
         - "Please generate 10 comprehensive multiple-choice questions for the first three chapters of my course, no answers yet"
         """
-        # Generate problems directly based on the complete course knowledge graph
-        context = self.kb.build_context(request, top_k=5, max_chars=2500)
-        prompt_parts = []
-        if context:
-            prompt_parts.append("Below is the [Complete Knowledge Graph/Course Materials] for this course (grouped by lecture/chapter), please generate problems based on this content:\n")
-            prompt_parts.append(context)
-            prompt_parts.append("\n---\n")
-        prompt_parts.append(f"Student's practice request:\n{request}\n\nPlease generate suitable practice problems (pay attention to follow the rules in the system prompt).")
+        return self._send(*self._build(request, conversation_history))
 
-        user_message = "\n".join(prompt_parts)
-        
-        # If there is history, build the complete conversation context
-        if conversation_history:
-            messages = conversation_history + [{"role": "user", "content": user_message}]
-            return self.client.chat_with_history(
-                system_prompt=PRACTICE_SYSTEM_PROMPT,
-                messages=messages,
-                temperature=0.6,
-            )
-        else:
-            return self.client.chat(
-                system_prompt=PRACTICE_SYSTEM_PROMPT,
-                user_message=user_message,
-                temperature=0.6,
-            )
+    def generate_stream(self, request: str, conversation_history: List[Dict] = None) -> Iterator[str]:
+        return self._send_stream(*self._build(request, conversation_history))
+
+    async def generate_async(self, request: str, conversation_history: List[Dict] = None) -> str:
+        return await self._send_async(*self._build(request, conversation_history))
 
+    def generate_stream_async(self, request: str, conversation_history: List[Dict] = None) -> AsyncIterator[str]:
+        return self._send_stream_async(*self._build(request, conversation_history))
 
-class ReviewAgent:
+    def _build(self, request: str, conversation_history: Optional[List[Dict]]) -> Tuple[str, str, List[Dict]]:
+        question_text = f"Student's practice request:\n{request}\n\nPlease generate suitable practice problems (pay attention to follow the rules in the system prompt)."
+        # Generate problems based on the course knowledge graph (or the retrieved fragments)
+        context, conversation_history, mode = self._prepare(
+            request, self.system_prompt, question_text, conversation_history, top_k=5, max_chars=2500
+        )
+        system_prompt, user_message = self._compose(
+            self.system_prompt,
+            "Below is the [Complete Knowledge Graph/Course Materials] for this course (grouped by lecture/chapter), please generate problems based on this content:\n",
+            context, mode, [question_text],
+        )
+        return system_prompt, user_message, conversation_history
+
+
+class ReviewAgent(_MaterialAgent):
     """
     Review / Summary Teaching Assistant:
     - Generates review outlines, key point lists for a certain part based on student request + course materials.
     """
 
-    def __init__(self, client: DeepSeekClient, kb: CourseKnowledgeBase):
-        self.client = client
-        self.kb = kb
+    agent_name = "ReviewAgent"
+    system_prompt = REVIEW_SYSTEM_PROMPT
+    temperature = 0.5
 
     def review(self, request: str, conversation_history: List[Dict] = None) -> str:
-        # No longer "retrieve based on request", but give the entire course materials to the LLM,
-        # letting it choose the corresponding parts to summarize based on keywords like "chapters 1-10 / all".
-        context = self.kb.build_context(request, top_k=6, max_chars=2600)
+        return self._send(*self._build(request, conversation_history))
+
+    def review_stream(self, request: str, conversation_history: List[Dict] = None) -> Iterator[str]:
+        return self._send_stream(*self._build(request, conversation_history))
+
+    async def review_async(self, request: str, conversation_history: List[Dict] = None) -> str:
+        return await self._send_async(*self._build(request, conversation_history))
+
+    def review_stream_async(self, request: str, conversation_history: List[Dict] = None) -> AsyncIterator[str]:
+        return self._send_stream_async(*self._build(request, conversation_history))
+
+    def _build(self, request: str, conversation_history: Optional[List[Dict]]) -> Tuple[str, str, List[Dict]]:
+        question_parts = [
+            "The student's review needs are as follows (may include chapter names, knowledge points, exam time, etc.):\n",
+            request,
+            "\n\nPlease generate a structured review guide based on the above course materials and needs.",
+        ]
+        # In "full" mode give the entire course materials to the LLM, letting it choose the
+        # corresponding parts to summarize based on keywords like "chapters 1-10 / all".
+        context, conversation_history, mode = self._prepare(
+            request, self.system_prompt, "\n".join(question_parts), conversation_history, top_k=6, max_chars=2600
+        )
+        system_prompt, user_message = self._compose(
+            self.system_prompt,
+            "Below is the [Complete Knowledge Graph/Course Materials] for this course (grouped by lecture/chapter), please perform review summary based on this content:\n",
+            context, mode, question_parts,
+        )
+        return system_prompt, user_message, conversation_history
 
-        prompt_parts = []
-        if context:
-            prompt_parts.append("Below is the [Complete Knowledge Graph/Course Materials] for this course (grouped by lecture/chapter), please perform review summary based on this content:\n")
-            prompt_parts.append(context)
-            prompt_parts.append("\n---\n")
 
-        prompt_parts.append(
-            "The student's review needs are as follows (may include chapter names, knowledge points, exam time, etc.):\n"
+class CombinedAgent(_MaterialAgent):
+    """
+    Single-call mode: one streamed reply carries the routing header (the RouterDecision fields as
+    JSON) and the answer, separated by ANSWER_MARKER, saving the router round trip.
+    start / start_async return the decision as soon as the header has arrived, plus the rest of
+    the stream (the answer deltas). TeachingAssistant still applies the assignment fallback and
+    the human-TA gate to the decision before any of the answer is used.
+    """
+
+    agent_name = "CombinedAgent"
+    system_prompt = COMBINED_SYSTEM_PROMPT
+    temperature = 0.4
+
+    def start(self, question: str, conversation_history: List[Dict] = None) -> Tuple[RouterDecision, Iterator[str]]:
+        deltas = self.stream(question, conversation_history)
+        buffer = ""
+        try:
+            for delta in deltas:
+                buffer += delta
+                split = split_combined_output(buffer)
+                if split is not None:
+                    break
+            else:
+                split = split_combined_output(buffer, final=True)
+            header, rest = split
+            decision = self._decision(header)
+        except Exception:
+            deltas.close()
+            raise
+        return decision, self._answer(rest, deltas)
+
+    async def start_async(self, question: str, conversation_history: List[Dict] = None) -> Tuple[RouterDecision, AsyncIterator[str]]:
+        deltas = self.stream_async(question, conversation_history)
+        buffer = ""
+        try:
+            split = None
+            async for delta in deltas:
+                buffer += delta
+                split = split_combined_output(buffer)
+                if split is not None:
+                    break
+            if split is None:
+                split = split_combined_output(buffer, final=True)
+            header, rest = split
+            decision = self._decision(header)
+        except Exception:
+            await deltas.aclose()
+            raise
+        return decision, self._answer_async(rest, deltas)
+
+    @staticmethod
+    def _decision(header: str) -> RouterDecision:
+        decision = RouterAgent._parse(header)
+        decision.source = "combined"
+        return decision
+
+    @staticmethod
+    def _answer(rest: str, deltas: Iterator[str]) -> Iterator[str]:
+        # The line break after the marker may only arrive with a later delta
+        rest = rest.lstrip("\r\n")
+        if rest:
+            yield rest
+        try:
+            for delta in deltas:
+                if not rest:
+                    delta = rest = delta.lstrip("\r\n")
+                if delta:
+                    yield delta
+        finally:
+            deltas.close()
+
+    @staticmethod
+    async def _answer_async(rest: str, deltas: AsyncIterator[str]) -> AsyncIterator[str]:
+        rest = rest.lstrip("\r\n")
+        if rest:
+            yield rest
+        try:
+            async for delta in deltas:
+                if not rest:
+                    delta = rest = delta.lstrip("\r\n")
+                if delta:
+                    yield delta
+        finally:
+            await deltas.aclose()
+
+    def _build(self, question: str, conversation_history: Optional[List[Dict]]) -> Tuple[str, str, List[Dict]]:
+        question_parts = [f"The student's question is:\n{question}\n"]
+        context, conversation_history, mode = self._prepare(
+            question, self.system_prompt, "\n".join(question_parts), conversation_history, top_k=4, max_chars=2400
         )
-        prompt_parts.append(request)
-        prompt_parts.append(
-            "\n\nPlease generate a structured review guide based on the above course materials and needs."
+        system_prompt, user_message = self._compose(
+            self.system_prompt,
+            "Below is the [Complete Knowledge Graph/Course Materials] for this course (grouped by lecture/chapter), please strictly refer to it:\n",
+            context, mode, question_parts,
         )
+        return system_prompt, user_message, conversation_history
 
-        user_message = "\n".join(prompt_parts)
-        
-        # If there is history, build the complete conversation context
-        if conversation_history:
-            messages = conversation_history + [{"role": "user", "content": user_message}]
-            return self.client.chat_with_history(
-                system_prompt=REVIEW_SYSTEM_PROMPT,
-                messages=messages,
-                temperature=0.5,
-            )
-        else:
-            return self.client.chat(
-                system_prompt=REVIEW_SYSTEM_PROMPT,
-                user_message=user_message,
-                temperature=0.5,
-            )
+
+class CombinedAnswer:
+    """
+    The answer part of a combined reply, shaped like speculation.SpeculativeCall so that
+    TeachingAssistant consumes both the same way (deltas / agent / usage / started).
+    """
+
+    # Written under the combined prompt, so not reusable as the routed agent's answer
+    cacheable = False
+
+    def __init__(self, agent: CombinedAgent, deltas, started: float):
+        self.agent = agent
+        self._deltas = deltas
+        self.started = started
+        # The stream is consumed in the caller's thread / task, so the client's last_usage applies
+        self.usage: Optional[Dict] = None
+
+    def deltas(self):
+        return self._deltas
+
+    def head_start(self) -> float:
+        return time.perf_counter() - self.started
+
+
+def default_combined_mode() -> bool:
+    """Single-call route + answer mode from TA_COMBINED_MODE ("on" / "off"), default off."""
+    return os.getenv("TA_COMBINED_MODE", "off").lower() in ("on", "1", "true")
 
 
 # =======================
@@ -636,6 +1294,10 @@ class ReviewAgent:
 # =======================
 
 PENDING_FILE = "pending_for_human.jsonl"
+NO_AI_ANSWER_MESSAGE = (
+    "This question is more suitable for direct answering by the course instructor or a human TA, "
+    "the AI TA will not provide a specific answer for now."
+)
 HISTORY_FILE = "conversation_history.json"
 
 class TeachingAssistant:
@@ -645,48 +1307,98 @@ class TeachingAssistant:
     - CLI demo: Command line mode simulating student questions
     """
 
-    def __init__(self, materials_folder: str = "course_materials", session_id: str = "default"):
-        self.client = DeepSeekClient()
-        self.kb = CourseKnowledgeBase(materials_folder)
+    def __init__(
+        self,
+        materials_folder: str = "course_materials",
+        session_id: str = "default",
+        client: Optional[DeepSeekClient] = None,
+        kb: Optional[CourseKnowledgeBase] = None,
+        context_modes: Optional[Dict[str, str]] = None,
+        prompt_layout: Optional[str] = None,
+        async_client: Optional[AsyncDeepSeekClient] = None,
+        fast_router: Optional[FastRouter] = None,
+        router_cache: Optional[RouterCache] = None,
+        answer_cache: Optional[AnswerCache] = None,
+        speculative: Optional[bool] = None,
+        speculation_stats: Optional[SpeculationStats] = None,
+        combined: Optional[bool] = None,
+        history_persister: Optional[HistoryPersister] = None,
+        usage_ledger: Optional[UsageLedger] = None,
+    ):
+        # context_modes: optional per-agent build_context mode, e.g. {"ConceptAgent": "retrieval"};
+        # agents not listed use default_context_mode (env TA_CONTEXT_MODE[_<AGENT>], else "full").
+        # prompt_layout: "inline" or "prefix" (see _MaterialAgent), default env TA_PROMPT_LAYOUT or "inline".
+        # client / kb can be injected so that many sessions share one process-wide
+        # knowledge base and API client (see session_registry.SessionRegistry).
+        # In that case constructing a TeachingAssistant only loads the session history.
+        # async_client: optional AsyncDeepSeekClient used by handle_question_async.
+        # fast_router: local classifier tried before the LLM router (default: the process-wide one).
+        # router_cache: cache of earlier LLM router decisions (default: the process-wide one, unless
+        # disabled with TA_ROUTER_CACHE=off).
+        # answer_cache: cache of first-turn agent answers (default: the process-wide one, unless
+        # disabled with TA_ANSWER_CACHE=off).
+        # speculative: start the locally predicted agent while the LLM router runs (default env
+        # TA_SPECULATIVE, off); speculation_stats: where hits / waste are counted (default process-wide).
+        # combined: route and answer in one LLM call when the LLM router would be needed
+        # (default env TA_COMBINED_MODE, off; see CombinedAgent).
+        # history_persister: write-behind writer of history_<session> files (default: the process-wide
+        # one, format / flush interval from TA_HISTORY_FORMAT / TA_HISTORY_FLUSH_SECONDS).
+        # usage_ledger: where the session's token usage is counted against its quota (default: the
+        # client's ledger); over quota, the agents answer with retrieval-only context.
+        self.client = client if client is not None else DeepSeekClient()
+        self.async_client = async_client
+        self.kb = kb if kb is not None else CourseKnowledgeBase(materials_folder)
         self.session_id = session_id
         
         # Add conversation history management
         self.conversation_history: List[Dict] = []
-        self.history_file = f"history_{session_id}.json"
+        self.history_persister = history_persister if history_persister is not None else default_history_persister()
+        self.history_file = self.history_persister.path_for(session_id)
         self._load_history()
 
-        self.router = RouterAgent(self.client)
-        self.concept_agent = ConceptAgent(self.client, self.kb)
-        self.code_agent = CodeAgent(self.client, self.kb)
-        self.practice_agent = PracticeAgent(self.client, self.kb)
-        self.review_agent = ReviewAgent(self.client, self.kb)
+        modes = context_modes or {}
+        self.router = RouterAgent(self.client, async_client)
+        self.fast_router = fast_router if fast_router is not None else default_fast_router(CourseKnowledgeBase._tokenize)
+        self.router_cache = (
+            router_cache if router_cache is not None
+            else default_router_cache(CourseKnowledgeBase._tokenize, self.router.prompt_version())
+        )
+        self.answer_cache = (
+            answer_cache if answer_cache is not None
+            else default_answer_cache(CourseKnowledgeBase._tokenize)
+        )
+        self.speculative = speculative_enabled() if speculative is None else speculative
+        self.speculation_stats = speculation_stats if speculation_stats is not None else default_speculation_stats()
+        self.combined = default_combined_mode() if combined is None else combined
+        self.concept_agent = ConceptAgent(self.client, self.kb, modes.get("ConceptAgent"), prompt_layout, async_client)
+        self.code_agent = CodeAgent(self.client, self.kb, modes.get("CodeAgent"), prompt_layout, async_client)
+        self.practice_agent = PracticeAgent(self.client, self.kb, modes.get("PracticeAgent"), prompt_layout, async_client)
+        self.review_agent = ReviewAgent(self.client, self.kb, modes.get("ReviewAgent"), prompt_layout, async_client)
+        self.combined_agent = CombinedAgent(self.client, self.kb, modes.get("CombinedAgent"), prompt_layout, async_client)
+        self.usage_ledger = usage_ledger if usage_ledger is not None else self.client.ledger
+        # Context modes replaced by "retrieval" while the session is over its token quota
+        self._modes_before_quota: Optional[Dict[_MaterialAgent, str]] = None
 
     def _load_history(self):
         """Load conversation history from file"""
-        try:
-            if os.path.exists(self.history_file):
-                with open(self.history_file, "r", encoding="utf-8") as f:
-                    self.conversation_history = json.load(f)
-                print(f"[History] Loaded {len(self.conversation_history)} history records")
-        except Exception as e:
-            print(f"[History] Failed to load history: {e}")
-            self.conversation_history = []
+        self.conversation_history = self.history_persister.load(self.history_file)
+        if self.conversation_history:
+            print(f"[History] Loaded {len(self.conversation_history)} history records")
 
     def _save_history(self):
-        """Save conversation history to file"""
-        try:
-            with open(self.history_file, "w", encoding="utf-8") as f:
-                json.dump(self.conversation_history, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"[History] Failed to save history: {e}")
+        """Save the whole conversation history (written by the persister's next flush)"""
+        self.history_persister.replace(self.history_file, self.conversation_history)
 
+    @traced("save_history")
     def _add_to_history(self, role: str, content: str):
         """Add a message to history"""
-        self.conversation_history.append({"role": role, "content": content})
+        message = {"role": role, "content": content}
+        self.conversation_history.append(message)
         # Limit history length to avoid too many tokens
-        if len(self.conversation_history) > 20:  # Keep last 10 turns of conversation (20 messages)
-            self.conversation_history = self.conversation_history[-20:]
-        self._save_history()
+        if len(self.conversation_history) > HISTORY_WINDOW:  # Keep last 10 turns of conversation (20 messages)
+            self.conversation_history = self.conversation_history[-HISTORY_WINDOW:]
+        # Buffered: only the new message is written, on the persister's next flush
+        self.history_persister.append(self.history_file, message, self.conversation_history)
 
     def clear_history(self):
         """Clear conversation history"""
@@ -716,33 +1428,270 @@ class TeachingAssistant:
         with open(PENDING_FILE, "a", encoding="utf-8") as f:
             f.write(json.dumps(record, ensure_ascii=False) + "\n")
 
-    def handle_question(self, question: str) -> Dict:
+    @traced("route")
+    def _route(self, question: str, history: List[Dict]):
         """
-        External call:
-        - First use Router to determine type, difficulty, need for human;
-        - If human needed: record in pending_for_human.jsonl, AI gives no formal answer;
-        - Otherwise call the corresponding Agent based on route_to.
+        Router decision plus the local assignment fallback strategy. The decision comes from the
+        local fast path, else a cached earlier LLM decision for the same (or a near-identical)
+        question, else the LLM router (or, in combined mode, the header of a combined reply).
+        Also returns the answer call already in flight, if any: the combined reply's answer, or
+        the speculative agent call started while the LLM router ran, if the router agreed with
+        it (see speculation.py). Otherwise None and the handler calls the agent itself.
         """
-        # Add user question to history
-        self._add_to_history("user", question)
-
-        decision = self.router.route(question)
+        decision = self._fast_route(question) or self._cached_route(question)
+        if decision is None and self.combined:
+            return self._route_combined(question, history)
+        speculation = None
+        if decision is None:
+            if self.speculative:
+                speculation = self._speculate(question, history)
+            try:
+                decision = self.router.route(question)
+            except Exception:
+                self._abandon_speculation(speculation)
+                raise
+            self._remember_route(question, decision)
+        decision = self._apply_assignment_fallback(question, decision)
+        return decision, self._resolve_speculation(speculation, decision)
+
+    @traced("route")
+    async def _route_async(self, question: str, history: List[Dict]):
+        decision = self._fast_route(question) or self._cached_route(question)
+        if decision is None and self.combined:
+            return await self._route_combined_async(question, history)
+        speculation = None
+        if decision is None:
+            if self.speculative:
+                speculation = self._speculate(question, history, use_async=True)
+            try:
+                decision = await self.router.route_async(question)
+            except BaseException:
+                # Also when the request itself is cancelled while the router runs
+                self._abandon_speculation(speculation)
+                raise
+            self._remember_route(question, decision)
+        decision = self._apply_assignment_fallback(question, decision)
+        return decision, self._resolve_speculation(speculation, decision)
+
+    def _route_combined(self, question: str, history: List[Dict]) -> Tuple[RouterDecision, Optional[CombinedAnswer]]:
+        started = time.perf_counter()
+        decision, deltas = self.combined_agent.start(question, history)
+        decision, keep = self._gate_combined(question, decision)
+        if not keep:
+            deltas.close()
+            return decision, None
+        return decision, CombinedAnswer(self.combined_agent, deltas, started)
+
+    async def _route_combined_async(self, question: str, history: List[Dict]) -> Tuple[RouterDecision, Optional[CombinedAnswer]]:
+        started = time.perf_counter()
+        decision, deltas = await self.combined_agent.start_async(question, history)
+        decision, keep = self._gate_combined(question, decision)
+        if not keep:
+            await deltas.aclose()
+            return decision, None
+        return decision, CombinedAnswer(self.combined_agent, deltas, started)
+
+    def _gate_combined(self, question: str, decision: RouterDecision) -> Tuple[RouterDecision, bool]:
+        """
+        The human-TA gate, enforced on the combined header after the fact. Returns the final
+        decision and whether the combined answer may be used: the answer written alongside a
+        need_human_TA decision is dropped unread, and if the assignment fallback clears
+        need_human_TA the model wrote no answer, so the routed agent is called as usual.
+        The header is not kept in the router cache or the fast-router log: it comes from the
+        combined prompt (and its model), not the RouterAgent whose decisions those replay.
+        """
+        print(f"[Router] Combined call: {decision.route_to} (need_human_TA={decision.need_human_TA})")
+        flagged = decision.need_human_TA
+        decision = self._apply_assignment_fallback(question, decision)
+        return decision, not (flagged or decision.need_human_TA or decision.route_to == "None")
+
+    def _speculate(self, question: str, history: List[Dict], use_async: bool = False):
+        """Start the agent the local classifier predicts, or None when it has no usable guess."""
+        guess = self.fast_router.classify(question)
+        if guess is None or guess.need_human_TA or guess.confidence < speculative_min_confidence():
+            return None
+        agent = self._agent_for(guess.route_to)
+        if agent is None:
+            return None
+        print(f"[Speculation] Starting {agent.agent_name} while the router decides (confidence {guess.confidence:.2f})")
+        self.speculation_stats.record_start()
+        # The call runs in a copy of this context (thread / task), so the tag stays with it
+        with usage_tags(route="speculative"):
+            if use_async:
+                return AsyncSpeculativeCall(agent, lambda: agent.stream_async(question, history), self.async_client)
+            return SpeculativeCall(agent, lambda: agent.stream(question, history), self.client)
+
+    def _resolve_speculation(self, speculation, decision: RouterDecision):
+        """Keep the speculative call if the router agrees with it, otherwise cancel it and count the waste."""
+        if speculation is None:
+            return None
+        if decision.need_human_TA or decision.route_to != speculation.route_to:
+            speculation.cancel()
+            wasted = speculation.wasted_tokens()
+            self.speculation_stats.record_miss(wasted, human=decision.need_human_TA)
+            print(f"[Speculation] Discarded {speculation.route_to} (router: {decision.route_to}, "
+                  f"need_human_TA={decision.need_human_TA}), ~{wasted} tokens wasted")
+            return None
+        head_start = speculation.head_start()
+        self.speculation_stats.record_hit(head_start)
+        print(f"[Speculation] Hit: {speculation.route_to} had a {head_start:.2f}s head start")
+        return speculation
+
+    def _abandon_speculation(self, speculation):
+        """Cancel the speculative call of a question whose router call failed, and count the waste."""
+        if speculation is None:
+            return
+        speculation.cancel()
+        wasted = speculation.wasted_tokens()
+        self.speculation_stats.record_miss(wasted)
+        print(f"[Speculation] Discarded {speculation.route_to} (router failed), ~{wasted} tokens wasted")
+
+    def _cached_route(self, question: str) -> Optional[RouterDecision]:
+        if self.router_cache is None:
+            return None
+        cached, kind = self.router_cache.lookup(question)
+        if cached is None:
+            return None
+        print(f"[Router] Cache hit ({kind}): {cached.get('route_to')}")
+        return RouterDecision(**dict(cached, source="cache"))
+
+    def _remember_route(self, question: str, decision: RouterDecision):
+        """Keep a RouterAgent decision (before the assignment fallback edits it) for next time."""
+        self.fast_router.record(question, decision.__dict__)
+        if self.router_cache is not None:
+            self.router_cache.put(question, dict(decision.__dict__))
+
+    def _fast_route(self, question: str) -> Optional[RouterDecision]:
+        """RouterDecision from the local classifier, or None when it is not confident enough."""
+        fast = self.fast_router.route(question)
+        if fast is None:
+            return None
+        print(f"[Router] Fast path: {fast.route_to} ({fast.reason}, confidence {fast.confidence:.2f})")
+        return RouterDecision(
+            type=fast.type,
+            difficulty=fast.difficulty,
+            need_human_TA=fast.need_human_TA,
+            route_to=fast.route_to,
+            notes_for_TA=f"Routed locally ({fast.reason})",
+            confidence=round(fast.confidence, 4),
+            source="fast_path",
+        )
 
+    @staticmethod
+    def _apply_assignment_fallback(question: str, decision: RouterDecision) -> RouterDecision:
         # --- Assignment fallback strategy: Labs/Homework prioritized for AI to explain 'ideas', exams go to human ---
         if decision.type == "assignment":
             lower_q = question.lower()
-            exam_keywords = ["exam", "midterm", "final", "quiz", "test", "考试", "期中", "期末", "小测", "考卷", "试卷"]
-            is_exam_like = any(k in lower_q for k in exam_keywords)
+            is_exam_like = any(k in lower_q for k in EXAM_KEYWORDS)
 
             if not is_exam_like:
                 # Non-exam assignments, default to allowing AI to give idea guidance first
                 decision.need_human_TA = False
                 # Choose routing: if mentions "code/C++/Python" etc. go to CodeAgent, otherwise ConceptAgent
-                code_keywords = ["code", "c++", "java", "python", "implementation", "compile", "error", "代码", "实现", "报错"]
-                if any(k in lower_q for k in code_keywords):
+                if any(k in lower_q for k in CODE_KEYWORDS):
                     decision.route_to = "CodeAgent"
                 else:
                     decision.route_to = "ConceptAgent"
+        return decision
+
+    def _agent_for(self, route_to: str) -> Optional[_MaterialAgent]:
+        return {
+            "ConceptAgent": self.concept_agent,
+            "CodeAgent": self.code_agent,
+            "PracticeAgent": self.practice_agent,
+            "ReviewAgent": self.review_agent,
+        }.get(route_to)
+
+    def _answer_cache_scope(self, agent: Optional[_MaterialAgent], question: str, history: List[Dict]) -> Optional[str]:
+        """
+        Answer cache scope for this question, or None when the answer must not be reused:
+        follow-up questions (the answer depends on the conversation), agents the cache is not
+        configured for, and anything that looks like code to debug.
+        """
+        if self.answer_cache is None or agent is None or history:
+            return None
+        if not self.answer_cache.caches(agent.agent_name) or CODE_RE.search(question):
+            return None
+        return AnswerCache.scope(agent.agent_name, self.kb.materials_version(), agent.prompt_version())
+
+    def _cached_answer(self, question: str, scope: Optional[str]) -> Optional[Tuple[str, str]]:
+        if scope is None:
+            return None
+        cached, kind = self.answer_cache.lookup(question, scope)
+        if cached is None:
+            return None
+        print(f"[Answer Cache] Hit ({kind}) for {scope.split('|', 1)[0]}")
+        return cached["answer"], kind
+
+    def _store_answer(self, question: str, scope: Optional[str], answer: str, seconds: float, client=None,
+                      usage: Optional[Dict] = None):
+        if scope is None or not answer:
+            return
+        if usage is None:
+            usage = getattr(client or self.client, "last_usage", {}) or {}
+        tokens = int(usage.get("prompt_tokens", 0)) + int(usage.get("completion_tokens", 0))
+        self.answer_cache.put(question, {"answer": answer, "tokens": tokens, "seconds": round(seconds, 3)}, scope)
+
+    def _finish(self, result: Dict, agent: Optional[_MaterialAgent], answer: str, client=None,
+                usage: Optional[Dict] = None) -> Dict:
+        """Record the answer in history and attach token accounting to the result."""
+        # Add AI answer to history
+        self._add_to_history("assistant", answer)
+
+        result["ai_answer"] = answer
+        # Token breakdown of the agent prompt (system / history / materials / question)
+        if agent is not None and agent.last_token_report is not None:
+            result["tokens"] = agent.last_token_report.__dict__
+            # Token usage reported by the API for the agent call (incl. prompt cache hits)
+            result["usage"] = usage if usage is not None else getattr(client or self.client, "last_usage", {})
+        return result
+
+    def _begin_question(self):
+        """
+        Tag this question's LLM calls with the session (usage ledger) and apply the session's
+        token quota: once it is used up, every agent falls back to retrieval-only context.
+        """
+        tag_usage(session_id=self.session_id, agent=None, route=None)
+        over = self.usage_ledger.over_quota(self.session_id)
+        if over and self._modes_before_quota is None:
+            agents = [self.concept_agent, self.code_agent, self.practice_agent, self.review_agent, self.combined_agent]
+            self._modes_before_quota = {agent: agent.context_mode for agent in agents}
+            for agent in agents:
+                agent.context_mode = "retrieval"
+            print(f"[Usage] Session {self.session_id} used its token quota "
+                  f"({self.usage_ledger.quota(self.session_id)}), answering with retrieval-only context")
+        elif not over and self._modes_before_quota is not None:
+            for agent, mode in self._modes_before_quota.items():
+                agent.context_mode = mode
+            self._modes_before_quota = None
+        annotate(session_id=self.session_id, quota_exceeded=over)
+
+    def _annotate_route(self, decision: RouterDecision, prefetched):
+        """Record the route decision on the handle_question trace span and in the usage tags."""
+        tag_usage(route=decision.source)
+        annotate(
+            route_to=decision.route_to,
+            route_source=decision.source,
+            need_human_TA=decision.need_human_TA,
+            prefetched=type(prefetched).__name__ if prefetched is not None else "none",
+        )
+
+    @traced("handle_question")
+    def handle_question(self, question: str) -> Dict:
+        """
+        External call:
+        - First use Router to determine type, difficulty, need for human;
+        - If human needed: record in pending_for_human.jsonl, AI gives no formal answer;
+        - Otherwise call the corresponding Agent based on route_to.
+        """
+        self._begin_question()
+        # Add user question to history
+        self._add_to_history("user", question)
+        # History passed to the agent excludes the current question, as it's already in history
+        history_for_agent = self.conversation_history[:-1]
+
+        decision, prefetched = self._route(question, history_for_agent)
+        self._annotate_route(decision, prefetched)
 
         result = {
             "router": decision.__dict__,
@@ -756,9 +1705,22 @@ class TeachingAssistant:
             result["message"] = "This question has been marked as requiring a human TA, added to the pending list."
             return result
 
-        # Call the corresponding Agent, pass history (excluding the current question, as it's already in history)
-        history_for_agent = self.conversation_history[:-1]  # Excludes current user question
-        
+        # Call the corresponding Agent
+        agent = self._agent_for(decision.route_to)
+        scope = self._answer_cache_scope(agent, question, history_for_agent)
+        if prefetched is not None:
+            answer = "".join(prefetched.deltas())
+            if prefetched.cacheable:
+                self._store_answer(question, scope, answer, prefetched.head_start(), usage=prefetched.usage)
+            return self._finish(result, prefetched.agent, answer, usage=prefetched.usage)
+
+        cached = self._cached_answer(question, scope)
+        if cached is not None:
+            result["cache"] = cached[1]
+            annotate(answer_cache=cached[1])
+            return self._finish(result, None, cached[0])
+
+        started = time.perf_counter()
         if decision.route_to == "ConceptAgent":
             answer = self.concept_agent.answer(question, history_for_agent)
         elif decision.route_to == "CodeAgent":
@@ -768,16 +1730,205 @@ class TeachingAssistant:
         elif decision.route_to == "ReviewAgent":
             answer = self.review_agent.review(question, history_for_agent)
         else:
-            answer = (
-                "This question is more suitable for direct answering by the course instructor or a human TA, "
-                "the AI TA will not provide a specific answer for now."
-            )
+            answer = NO_AI_ANSWER_MESSAGE
 
-        # Add AI answer to history
-        self._add_to_history("assistant", answer)
+        self._store_answer(question, scope, answer, time.perf_counter() - started)
+        return self._finish(result, agent, answer)
 
-        result["ai_answer"] = answer
-        return result
+    @traced("handle_question")
+    async def handle_question_async(self, question: str) -> Dict:
+        """
+        Same as handle_question, but the router and agent calls are awaited on the
+        AsyncDeepSeekClient so one event loop can serve many questions at once.
+        """
+        if self.async_client is None:
+            raise RuntimeError("handle_question_async requires a TeachingAssistant built with async_client")
+        self._begin_question()
+        self._add_to_history("user", question)
+        history_for_agent = self.conversation_history[:-1]  # Excludes current user question
+
+        decision, prefetched = await self._route_async(question, history_for_agent)
+        self._annotate_route(decision, prefetched)
+        result = {
+            "router": decision.__dict__,
+            "ai_answer": None,
+            "message": "",
+        }
+
+        if decision.need_human_TA:
+            self.save_pending(question, decision, ai_answer=None)
+            result["message"] = "This question has been marked as requiring a human TA, added to the pending list."
+            return result
+
+        agent = self._agent_for(decision.route_to)
+        scope = self._answer_cache_scope(agent, question, history_for_agent)
+        if prefetched is not None:
+            answer = "".join([delta async for delta in prefetched.deltas()])
+            if prefetched.cacheable:
+                self._store_answer(question, scope, answer, prefetched.head_start(), self.async_client, prefetched.usage)
+            return self._finish(result, prefetched.agent, answer, client=self.async_client, usage=prefetched.usage)
+
+        cached = self._cached_answer(question, scope)
+        if cached is not None:
+            result["cache"] = cached[1]
+            annotate(answer_cache=cached[1])
+            return self._finish(result, None, cached[0])
+
+        started = time.perf_counter()
+        if decision.route_to == "ConceptAgent":
+            answer = await self.concept_agent.answer_async(question, history_for_agent)
+        elif decision.route_to == "CodeAgent":
+            answer = await self.code_agent.answer_async(question, history_for_agent)
+        elif decision.route_to == "PracticeAgent":
+            answer = await self.practice_agent.generate_async(question, history_for_agent)
+        elif decision.route_to == "ReviewAgent":
+            answer = await self.review_agent.review_async(question, history_for_agent)
+        else:
+            answer = NO_AI_ANSWER_MESSAGE
+
+        self._store_answer(question, scope, answer, time.perf_counter() - started, self.async_client)
+        return self._finish(result, agent, answer, client=self.async_client)
+
+    @traced("handle_question", stream=True)
+    def handle_question_stream(self, question: str) -> Iterator[Dict]:
+        """
+        Streaming variant of handle_question. Yields events:
+        - {"type": "router", "router": {...}}           once the route is known
+        - {"type": "delta", "content": "..."}          answer text as it is generated
+        - {"type": "done", "result": {...}, "ttft": s}  the same result dict handle_question returns;
+                                                        ttft = seconds from the call to the first answer text
+        History is only updated with the answer once the stream has completed.
+        """
+        start = time.perf_counter()
+        self._begin_question()
+        self._add_to_history("user", question)
+        history_for_agent = self.conversation_history[:-1]  # Excludes current user question
+
+        decision, prefetched = self._route(question, history_for_agent)
+        self._annotate_route(decision, prefetched)
+        result = {
+            "router": decision.__dict__,
+            "ai_answer": None,
+            "message": "",
+        }
+        yield {"type": "router", "router": result["router"]}
+
+        if decision.need_human_TA:
+            self.save_pending(question, decision, ai_answer=None)
+            result["message"] = "This question has been marked as requiring a human TA, added to the pending list."
+            yield {"type": "done", "result": result, "ttft": None}
+            return
+
+        agent = self._agent_for(decision.route_to)
+        scope = self._answer_cache_scope(agent, question, history_for_agent)
+        cached = None if prefetched is not None else self._cached_answer(question, scope)
+        if cached is not None:
+            result["cache"] = cached[1]
+            annotate(answer_cache=cached[1])
+            yield {"type": "delta", "content": cached[0]}
+            yield {"type": "done", "result": self._finish(result, None, cached[0]), "ttft": time.perf_counter() - start}
+            return
+
+        started = time.perf_counter()
+        if prefetched is not None:
+            agent = prefetched.agent
+            started = prefetched.started
+            deltas = prefetched.deltas()
+            if not prefetched.cacheable:
+                scope = None
+        elif decision.route_to == "ConceptAgent":
+            deltas = self.concept_agent.answer_stream(question, history_for_agent)
+        elif decision.route_to == "CodeAgent":
+            deltas = self.code_agent.answer_stream(question, history_for_agent)
+        elif decision.route_to == "PracticeAgent":
+            deltas = self.practice_agent.generate_stream(question, history_for_agent)
+        elif decision.route_to == "ReviewAgent":
+            deltas = self.review_agent.review_stream(question, history_for_agent)
+        else:
+            deltas = iter([NO_AI_ANSWER_MESSAGE])
+
+        parts: List[str] = []
+        ttft = None
+        for delta in deltas:
+            if ttft is None:
+                ttft = time.perf_counter() - start
+            parts.append(delta)
+            yield {"type": "delta", "content": delta}
+
+        usage = prefetched.usage if prefetched is not None else None
+        self._store_answer(question, scope, "".join(parts), time.perf_counter() - started, usage=usage)
+        result = self._finish(result, agent, "".join(parts), usage=usage)
+        yield {"type": "done", "result": result, "ttft": ttft}
+
+    @traced("handle_question", stream=True)
+    async def handle_question_stream_async(self, question: str) -> AsyncIterator[Dict]:
+        """Async variant of handle_question_stream (same events), awaiting the AsyncDeepSeekClient."""
+        if self.async_client is None:
+            raise RuntimeError("handle_question_stream_async requires a TeachingAssistant built with async_client")
+        start = time.perf_counter()
+        self._begin_question()
+        self._add_to_history("user", question)
+        history_for_agent = self.conversation_history[:-1]  # Excludes current user question
+
+        decision, prefetched = await self._route_async(question, history_for_agent)
+        self._annotate_route(decision, prefetched)
+        result = {
+            "router": decision.__dict__,
+            "ai_answer": None,
+            "message": "",
+        }
+        yield {"type": "router", "router": result["router"]}
+
+        if decision.need_human_TA:
+            self.save_pending(question, decision, ai_answer=None)
+            result["message"] = "This question has been marked as requiring a human TA, added to the pending list."
+            yield {"type": "done", "result": result, "ttft": None}
+            return
+
+        agent = self._agent_for(decision.route_to)
+        scope = self._answer_cache_scope(agent, question, history_for_agent)
+        cached = None if prefetched is not None else self._cached_answer(question, scope)
+        if cached is not None:
+            result["cache"] = cached[1]
+            annotate(answer_cache=cached[1])
+            yield {"type": "delta", "content": cached[0]}
+            yield {"type": "done", "result": self._finish(result, None, cached[0]), "ttft": time.perf_counter() - start}
+            return
+
+        started = time.perf_counter()
+        parts: List[str] = []
+        ttft = None
+        if prefetched is not None:
+            agent = prefetched.agent
+            started = prefetched.started
+            deltas = prefetched.deltas()
+            if not prefetched.cacheable:
+                scope = None
+        elif decision.route_to == "ConceptAgent":
+            deltas = self.concept_agent.answer_stream_async(question, history_for_agent)
+        elif decision.route_to == "CodeAgent":
+            deltas = self.code_agent.answer_stream_async(question, history_for_agent)
+        elif decision.route_to == "PracticeAgent":
+            deltas = self.practice_agent.generate_stream_async(question, history_for_agent)
+        elif decision.route_to == "ReviewAgent":
+            deltas = self.review_agent.review_stream_async(question, history_for_agent)
+        else:
+            deltas = None
+            ttft = time.perf_counter() - start
+            parts.append(NO_AI_ANSWER_MESSAGE)
+            yield {"type": "delta", "content": NO_AI_ANSWER_MESSAGE}
+
+        if deltas is not None:
+            async for delta in deltas:
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                parts.append(delta)
+                yield {"type": "delta", "content": delta}
+
+        usage = prefetched.usage if prefetched is not None else None
+        self._store_answer(question, scope, "".join(parts), time.perf_counter() - started, self.async_client, usage)
+        result = self._finish(result, agent, "".join(parts), client=self.async_client, usage=usage)
+        yield {"type": "done", "result": result, "ttft": ttft}
 
 
 # =======================
@@ -0,0 +1,47 @@
+from caching import AnswerCache, RouterCache
+from ta_agents_history import CourseKnowledgeBase
+
+INSERTION = ("Can you explain in detail what the average and worst case time complexity of insertion "
+             "into a binary search tree is and why that is the case")
+
+
+def test_answer_cache_rejects_one_word_swap():
+    cache = AnswerCache(CourseKnowledgeBase._tokenize)
+    cache.put(INSERTION, {"answer": "insertion"}, "scope")
+    cache.put("build a min heap from the array 5 3 8 1 and show each step", {"answer": "min"}, "scope")
+
+    assert cache.lookup(INSERTION.replace("insertion", "deletion"), "scope") == (None, "miss")
+    assert cache.lookup("build a max heap from the array 5 3 8 1 and show each step", "scope") == (None, "miss")
+
+
+def test_answer_cache_reuses_same_tokens():
+    cache = AnswerCache(CourseKnowledgeBase._tokenize)
+    cache.put(INSERTION, {"answer": "insertion"}, "scope")
+
+    assert cache.lookup(INSERTION.upper() + "?", "scope") == ({"answer": "insertion"}, "exact")
+    assert cache.lookup(INSERTION.replace(" the case", " the the case"), "scope") == ({"answer": "insertion"}, "near")
+
+
+EXAM = ("please do not just give me the full answer to question 3 of the final exam, "
+        "I want to understand how the dynamic programming table is filled")
+
+
+def decision(need_human_TA):
+    return {"type": "exam", "route_to": "ConceptAgent", "need_human_TA": need_human_TA}
+
+
+def test_router_cache_never_reuses_a_near_no_human_decision():
+    cache = RouterCache(CourseKnowledgeBase._tokenize)
+    cache.put(EXAM, decision(False))
+
+    assert cache.lookup(EXAM.replace("do not just ", "just "))[1] == "miss"
+    assert cache.lookup(EXAM.replace("the final", "the the final"))[1] == "miss"
+    assert cache.lookup(EXAM.upper())[1] == "exact"
+
+
+def test_router_cache_near_human_decision_needs_same_guard_words():
+    cache = RouterCache(CourseKnowledgeBase._tokenize)
+    cache.put(EXAM.replace("do not just ", "just "), decision(True))
+
+    assert cache.lookup(EXAM)[1] == "miss"
+    assert cache.lookup(EXAM.replace("do not just ", "just ").replace("the final", "the the final"))[1] == "near"
@@ -0,0 +1,16 @@
+from conversation_store import ConversationStore
+
+
+def test_owner_scopes_reads(tmp_path):
+    store = ConversationStore(str(tmp_path / "conversations.db"), legacy_json=None)
+    store.init(default_conversation=False)
+    store.create("a1", owner="alice")
+    store.create("b1", owner="bob")
+
+    assert store.exists("a1", "alice")
+    assert not store.exists("a1", "bob")
+    assert store.version("a1", owner="alice") is not None
+    assert store.version("a1", owner="bob") is None
+    assert store.version(owner="alice")[1] == 1
+    assert [c["id"] for c in store.summaries(owner="bob")[0]] == ["b1"]
+    store.close()
@@ -0,0 +1,35 @@
+import json
+import os
+
+from history_store import HistoryPersister
+
+
+def write_lines(path, messages, tail=""):
+    with open(path, "w", encoding="utf-8") as f:
+        for m in messages:
+            f.write(json.dumps(m, ensure_ascii=False) + "\n")
+        f.write(tail)
+
+
+def test_clean_jsonl_is_not_rewritten(tmp_path):
+    path = str(tmp_path / "history_s.jsonl")
+    messages = [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello"}]
+    write_lines(path, messages)
+    mtime = os.stat(path).st_mtime_ns
+    persister = HistoryPersister(flush_interval=0)
+
+    assert persister.load(path) == messages
+    assert persister.stats()["file_writes"] == 0
+    assert os.stat(path).st_mtime_ns == mtime
+
+
+def test_torn_jsonl_is_cut_off(tmp_path):
+    path = str(tmp_path / "history_s.jsonl")
+    messages = [{"role": "user", "content": "hi"}]
+    write_lines(path, messages, tail='{"role": "assis')
+    persister = HistoryPersister(flush_interval=0)
+
+    assert persister.load(path) == messages
+    assert persister.stats()["file_writes"] == 1
+    with open(path, encoding="utf-8") as f:
+        assert f.read() == json.dumps(messages[0]) + "\n"
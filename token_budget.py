@@ -0,0 +1,177 @@
+"""
+Token-budgeted prompt assembly.
+
+Counts tokens locally and splits the model's context window between:
+    system prompt | conversation history | course materials | question | reserved output
+The system prompt and question are fixed costs; history keeps its most recent messages
+up to a share of the remaining budget; course materials get everything that is left
+and are packed greedily from the highest-ranked chunks.
+
+Token counting uses the ratios DeepSeek documents for its tokenizer
+(~0.3 token per English character, ~0.6 token per Chinese character), which is close
+enough for budgeting; set TA_TOKENIZER=tiktoken to count with tiktoken's cl100k_base
+instead when that package is installed.
+"""
+
+import math
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+CJK_RE = re.compile(r"[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]")
+
+# Chat format overhead per message (role markers etc.)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_tiktoken_encoding = None
+if os.getenv("TA_TOKENIZER", "").lower() == "tiktoken":
+    try:
+        import tiktoken
+
+        _tiktoken_encoding = tiktoken.get_encoding("cl100k_base")
+    except ImportError:
+        print("[Token Budget] tiktoken not installed (pip install tiktoken), using the character estimate")
+
+
+def count_tokens(text: str) -> int:
+    """Approximate number of tokens text occupies in a DeepSeek / OpenAI-compatible prompt."""
+    if not text:
+        return 0
+    if _tiktoken_encoding is not None:
+        return len(_tiktoken_encoding.encode(text))
+    cjk = len(CJK_RE.findall(text))
+    return math.ceil(cjk * 0.6 + (len(text) - cjk) * 0.3)
+
+
+def count_message_tokens(messages: List[Dict]) -> int:
+    return sum(count_tokens(m.get("content", "")) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+
+@dataclass
+class TokenBudget:
+    """
+    context_window: total tokens the model accepts (prompt + completion)
+    output_tokens:  tokens reserved for the completion (the client's max_tokens)
+    history_share:  max fraction of the input budget (after system + question) given to history
+    """
+    context_window: int = int(os.getenv("TA_CONTEXT_WINDOW", "64000"))
+    output_tokens: int = 1500
+    history_share: float = float(os.getenv("TA_HISTORY_TOKEN_SHARE", "0.25"))
+
+
+@dataclass
+class TokenReport:
+    """Token breakdown of one assembled prompt."""
+    system: int = 0
+    history: int = 0
+    materials: int = 0
+    question: int = 0
+    total: int = 0
+    budget: int = 0
+    context_mode: str = "full"
+    chunks: int = 0
+    history_messages: int = 0
+    history_dropped: int = 0
+    notes: List[str] = field(default_factory=list)
+
+    def summary(self) -> str:
+        return (
+            f"system={self.system} history={self.history} materials={self.materials} "
+            f"question={self.question} total={self.total}/{self.budget} ({self.context_mode}, {self.chunks} chunks)"
+        )
+
+
+def trim_history(history: List[Dict], max_tokens: int) -> Tuple[List[Dict], int]:
+    """Keep the most recent messages that fit in max_tokens; returns (kept, tokens used)."""
+    kept: List[Dict] = []
+    used = 0
+    for msg in reversed(history or []):
+        cost = count_tokens(msg.get("content", "")) + MESSAGE_OVERHEAD_TOKENS
+        if used + cost > max_tokens:
+            break
+        kept.append(msg)
+        used += cost
+    kept.reverse()
+    return kept, used
+
+
+class ContextPacker:
+    """
+    Assembles the course context + history for one agent call within a TokenBudget.
+
+    pack() returns (context, history, report):
+    - mode "full": the whole global_context if it fits the materials budget, otherwise it
+      degrades to retrieval and packs as many ranked chunks as fit (noted in the report)
+    - mode "retrieval": the top_k ranked chunks, within both max_chars and the token budget
+    """
+
+    def __init__(self, kb, budget: Optional[TokenBudget] = None):
+        self.kb = kb
+        self.budget = budget or TokenBudget()
+
+    def pack(
+        self,
+        query: str,
+        system_prompt: str,
+        question_text: str,
+        history: Optional[List[Dict]] = None,
+        top_k: int = 4,
+        max_chars: int = 2400,
+        mode: str = "full",
+    ) -> Tuple[str, List[Dict], TokenReport]:
+        """
+        query:         text used for retrieval (usually the student's question)
+        question_text: everything the user message contains besides the course context
+        """
+        budget = self.budget
+        report = TokenReport(context_mode=mode)
+        report.system = count_tokens(system_prompt) + MESSAGE_OVERHEAD_TOKENS
+        report.question = count_tokens(question_text) + MESSAGE_OVERHEAD_TOKENS
+        report.budget = max(0, budget.context_window - budget.output_tokens)
+        available = max(0, report.budget - report.system - report.question)
+
+        history = history or []
+        kept, report.history = trim_history(history, int(available * budget.history_share))
+        report.history_messages = len(kept)
+        report.history_dropped = len(history) - len(kept)
+        available -= report.history
+
+        context = ""
+        if mode == "full":
+            full = self.kb.build_context(query, top_k=top_k, max_chars=max_chars, mode="full")
+            # Counted once per knowledge base: a pass over the whole corpus is too slow per request
+            full_tokens = self.kb.context_tokens()
+            if full_tokens <= available:
+                context, report.materials = full, full_tokens
+                report.chunks = len(self.kb.chunks)
+            else:
+                report.notes.append(
+                    f"global_context ({full_tokens} tokens) exceeds the {available} token materials budget; "
+                    f"packed retrieved chunks instead"
+                )
+                report.context_mode = "retrieval"
+                context, report.materials, report.chunks = self._pack_chunks(
+                    query, len(self.kb.chunks), None, available
+                )
+        else:
+            context, report.materials, report.chunks = self._pack_chunks(query, top_k, max_chars, available)
+
+        report.total = report.system + report.history + report.materials + report.question
+        return context, kept, report
+
+    def _pack_chunks(self, query: str, top_k: int, max_chars: Optional[int], max_tokens: int) -> Tuple[str, int, int]:
+        """Greedy best-first packing of ranked chunks; returns (context, tokens, number of chunks)."""
+        parts: List[str] = []
+        used_tokens = 0
+        used_chars = 0
+        for _, chunk in self.kb.retrieve(query, top_k):
+            block = self.kb.format_chunk(chunk)
+            cost = count_tokens(block) + 1
+            if used_tokens + cost > max_tokens or (max_chars is not None and used_chars + len(block) > max_chars):
+                # Skip, a later (shorter) chunk may still fit
+                continue
+            parts.append(block)
+            used_tokens += cost
+            used_chars += len(block) + 2
+        return "\n\n".join(parts), used_tokens, len(parts)
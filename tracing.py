@@ -0,0 +1,399 @@
+"""
+Per-request latency tracing: nested spans for the stages of a question
+(add_message -> handle_question -> route -> router -> build_context -> agent -> llm.chat ->
+save_history -> save_conversation), with durations, token counts and route decisions.
+
+- spans nest through a contextvar, so they follow the request across function calls,
+  generators (streaming answers), asyncio tasks and speculative threads (see speculation.py)
+- @traced("stage") wraps functions, coroutines, generators and async generators in a span;
+  annotate(**attrs) adds attributes (tokens, route_to, ...) to the innermost open span
+- every finished span feeds a per-stage window of durations: summary() returns count, error
+  count and p50 / p95 / p99 / mean / max in milliseconds per stage (GET /api/traces/summary)
+- finished spans of sampled traces are exported in the background as JSON lines
+  (TA_TRACE_FILE) and/or OTLP/HTTP JSON to a local OpenTelemetry collector
+
+Environment:
+    TA_TRACE                 "off" disables tracing entirely (default on)
+    TA_TRACE_EXPORT          comma-separated exporters: "jsonl", "otlp" (default none: summary only)
+    TA_TRACE_FILE            JSON lines file (default traces.jsonl)
+    TA_TRACE_OTLP_ENDPOINT   OTLP/HTTP traces endpoint (default http://127.0.0.1:4318/v1/traces)
+    TA_TRACE_SAMPLE          fraction of traces exported (default 1.0; the summary sees all)
+    TA_TRACE_WINDOW          durations kept per stage for the percentiles (default 2048)
+"""
+
+import asyncio
+import atexit
+import contextvars
+import functools
+import inspect
+import json
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+SERVICE_NAME = "ai-teaching-assistant"
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("ta_current_span", default=None)
+
+
+class Span:
+    __slots__ = ("tracer", "name", "trace_id", "span_id", "parent", "start_ns", "end_ns", "_t0",
+                 "duration_ms", "attributes", "error", "sampled")
+
+    def __init__(self, tracer: "Tracer", name: str, parent: Optional["Span"], attributes: Dict):
+        self.tracer = tracer
+        self.name = name
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent is not None else os.urandom(16).hex()
+        self.sampled = parent.sampled if parent is not None else random.random() < tracer.sample_rate
+        self.span_id = os.urandom(8).hex()
+        self.start_ns = time.time_ns()
+        self._t0 = time.perf_counter()
+        self.end_ns: Optional[int] = None
+        self.duration_ms: Optional[float] = None
+        self.attributes = attributes
+        self.error: Optional[str] = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self, error: Optional[BaseException] = None):
+        if self.end_ns is not None:
+            return
+        self.duration_ms = (time.perf_counter() - self._t0) * 1000
+        self.end_ns = self.start_ns + int(self.duration_ms * 1e6)
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        # Back to the closest ancestor still open (spans of an interleaved stream may end out of order)
+        if _current_span.get() is self:
+            parent = self.parent
+            while parent is not None and parent.end_ns is not None:
+                parent = parent.parent
+            _current_span.set(parent)
+        self.tracer._finished(self)
+
+    def to_dict(self) -> Dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent.span_id if self.parent is not None else None,
+            "name": self.name,
+            "start": self.start_ns / 1e9,
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+    def __enter__(self) -> "Span":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end(exc if exc_type is not None and not issubclass(exc_type, GeneratorExit) else None)
+        return False
+
+
+class _NoopSpan:
+    def set(self, **attributes):
+        pass
+
+    def end(self, error=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+class JsonlExporter:
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, spans: List[Span]):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(s.to_dict(), ensure_ascii=False, default=str) + "\n" for s in spans))
+
+
+def _otlp_value(value) -> Dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class OtlpExporter:
+    """OTLP/HTTP with the JSON encoding (an OpenTelemetry collector's otlp receiver, port 4318)."""
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+
+    def payload(self, spans: List[Span]) -> Dict:
+        return {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+            "scopeSpans": [{
+                "scope": {"name": "tracing"},
+                "spans": [{
+                    "traceId": s.trace_id,
+                    "spanId": s.span_id,
+                    "parentSpanId": s.parent.span_id if s.parent is not None else "",
+                    "name": s.name,
+                    "kind": 1,
+                    "startTimeUnixNano": str(s.start_ns),
+                    "endTimeUnixNano": str(s.end_ns),
+                    "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in s.attributes.items()],
+                    "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+                } for s in spans],
+            }],
+        }]}
+
+    def export(self, spans: List[Span]):
+        import httpx
+
+        httpx.post(self.endpoint, json=self.payload(spans), timeout=5.0).raise_for_status()
+
+
+class Tracer:
+    """
+    Usage:
+        tracer = default_tracer()
+        with tracer.span("route", question_chars=len(q)) as span:
+            ...
+            span.set(route_to="ConceptAgent")
+        tracer.summary()   # {"route": {"count", "errors", "p50_ms", "p95_ms", "p99_ms", ...}}
+    """
+
+    def __init__(self, enabled: bool = True, exporters: Optional[List] = None, sample_rate: float = 1.0,
+                 window: int = 2048, flush_interval: float = 1.0):
+        self.enabled = enabled
+        self.exporters = exporters or []
+        self.sample_rate = sample_rate
+        self.window = window
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._durations: Dict[str, deque] = {}
+        self._counts: Dict[str, List[int]] = {}  # stage -> [count, errors]
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self.dropped = 0
+        if self.exporters:
+            atexit.register(self.flush)
+
+    @classmethod
+    def from_env(cls) -> "Tracer":
+        exporters = []
+        for name in filter(None, (n.strip().lower() for n in os.getenv("TA_TRACE_EXPORT", "").split(","))):
+            if name == "jsonl":
+                exporters.append(JsonlExporter(os.getenv("TA_TRACE_FILE", "traces.jsonl")))
+            elif name == "otlp":
+                exporters.append(OtlpExporter(os.getenv("TA_TRACE_OTLP_ENDPOINT", "http://127.0.0.1:4318/v1/traces")))
+            else:
+                print(f"[Tracing] Unknown exporter {name!r} in TA_TRACE_EXPORT, ignored")
+        return cls(
+            enabled=os.getenv("TA_TRACE", "on").lower() not in ("off", "0", "false"),
+            exporters=exporters,
+            sample_rate=float(os.getenv("TA_TRACE_SAMPLE", "1.0")),
+            window=int(os.getenv("TA_TRACE_WINDOW", "2048")),
+        )
+
+    # ---------- spans ----------
+
+    def span(self, name: str, **attributes):
+        """Start a span as a child of the current one; use as a context manager (or call .end())."""
+        if not self.enabled:
+            return _NOOP
+        span = Span(self, name, _current_span.get(), attributes)
+        _current_span.set(span)
+        return span
+
+    def start(self, name: str, **attributes) -> Span:
+        """A child span of the current one that is not made current (see traced() on generators)."""
+        return Span(self, name, _current_span.get(), attributes)
+
+    @staticmethod
+    def current() -> Optional[Span]:
+        return _current_span.get()
+
+    def _finished(self, span: Span):
+        with self._lock:
+            if span.name not in self._durations:
+                self._durations[span.name] = deque(maxlen=self.window)
+                self._counts[span.name] = [0, 0]
+            self._durations[span.name].append(span.duration_ms)
+            self._counts[span.name][0] += 1
+            if span.error:
+                self._counts[span.name][1] += 1
+        if self.exporters and span.sampled:
+            self._queue.put(span)
+            if self._thread is None:
+                with self._lock:
+                    if self._thread is None:
+                        self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                        self._thread.start()
+
+    # ---------- export ----------
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        spans = []
+        while True:
+            try:
+                spans.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if not spans:
+            return
+        for exporter in self.exporters:
+            try:
+                exporter.export(spans)
+            except Exception as e:
+                self.dropped += len(spans)
+                print(f"[Tracing] {type(exporter).__name__} failed, {len(spans)} spans dropped: {e}")
+
+    # ---------- summary ----------
+
+    def reset(self):
+        """Forget the recorded durations (e.g. between benchmark runs)."""
+        with self._lock:
+            self._durations.clear()
+            self._counts.clear()
+
+    def summary(self) -> Dict:
+        with self._lock:
+            snapshot = {name: (sorted(d), list(self._counts[name])) for name, d in self._durations.items()}
+        stages = {}
+        for name, (durations, (count, errors)) in snapshot.items():
+            stages[name] = {
+                "count": count,
+                "errors": errors,
+                "p50_ms": round(_percentile(durations, 50), 2),
+                "p95_ms": round(_percentile(durations, 95), 2),
+                "p99_ms": round(_percentile(durations, 99), 2),
+                "mean_ms": round(sum(durations) / len(durations), 2) if durations else 0.0,
+                "max_ms": round(durations[-1], 2) if durations else 0.0,
+            }
+        return {"enabled": self.enabled, "window": self.window, "dropped_spans": self.dropped, "stages": stages}
+
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+
+_default_tracer: Optional[Tracer] = None
+_default_lock = threading.Lock()
+
+
+def default_tracer() -> Tracer:
+    """Process-wide Tracer built from the environment."""
+    global _default_tracer
+    if _default_tracer is None:
+        with _default_lock:
+            if _default_tracer is None:
+                _default_tracer = Tracer.from_env()
+    return _default_tracer
+
+
+def annotate(**attributes):
+    """Add attributes to the innermost open span (no-op outside a span)."""
+    span = _current_span.get()
+    if span is not None:
+        span.set(**attributes)
+
+
+def traced(name: str, **attributes):
+    """
+    Decorator: run the function (coroutine, generator, async generator) inside a span `name`.
+    A generator's span is only current while the generator runs, so spans the consumer opens
+    between two items are not nested under it.
+    """
+
+    def decorate(fn):
+        if inspect.isasyncgenfunction(fn):
+            @functools.wraps(fn)
+            async def agen_wrapper(*args, **kwargs):
+                tracer = default_tracer()
+                if not tracer.enabled:
+                    async for item in fn(*args, **kwargs):
+                        yield item
+                    return
+                span = tracer.start(name, **attributes)
+                agen = fn(*args, **kwargs)
+                error = None
+                try:
+                    while True:
+                        outer = _current_span.get()
+                        _current_span.set(span)
+                        try:
+                            item = await agen.__anext__()
+                        except StopAsyncIteration:
+                            break
+                        finally:
+                            _current_span.set(outer)
+                        yield item
+                except BaseException as e:
+                    error = e
+                    raise
+                finally:
+                    await agen.aclose()
+                    span.end(error if not isinstance(error, (GeneratorExit, asyncio.CancelledError)) else None)
+            return agen_wrapper
+
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def gen_wrapper(*args, **kwargs):
+                tracer = default_tracer()
+                if not tracer.enabled:
+                    return (yield from fn(*args, **kwargs))
+                span = tracer.start(name, **attributes)
+                gen = fn(*args, **kwargs)
+                error = None
+                try:
+                    while True:
+                        outer = _current_span.get()
+                        _current_span.set(span)
+                        try:
+                            item = next(gen)
+                        except StopIteration as stop:
+                            return stop.value
+                        finally:
+                            _current_span.set(outer)
+                        yield item
+                except BaseException as e:
+                    error = e
+                    raise
+                finally:
+                    gen.close()
+                    span.end(error if not isinstance(error, GeneratorExit) else None)
+            return gen_wrapper
+
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def coro_wrapper(*args, **kwargs):
+                with default_tracer().span(name, **attributes):
+                    return await fn(*args, **kwargs)
+            return coro_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with default_tracer().span(name, **attributes):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    return decorate
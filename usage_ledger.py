@@ -0,0 +1,291 @@
+"""
+Token usage ledger: every LLM call's prompt / completion / cached-prompt tokens (response.usage),
+tagged with the session, the agent that made the call and the question's route, and summed per
+(day, session, agent, route) in memory.
+
+- tags travel in a contextvar: TeachingAssistant sets the session at the start of a question
+  and the route once it is decided, RouterAgent / the answering agents set the agent; the
+  client's _record_usage reads them when the usage arrives (also on speculative threads, which
+  run in a copy of the caller's context)
+- route is the routing path of the question: fast_path | cache | llm | combined, "router" for
+  the LLM router call itself and "speculative" for calls started before the route was known
+- a background thread appends the changes since the last flush to TA_USAGE_LEDGER_FILE every
+  TA_USAGE_FLUSH_SECONDS (and at exit) as JSON lines of deltas; on start the file is summed up
+  again, and rewritten in compact form once it has more than twice as many lines as entries
+- quotas: a session whose total tokens reach its quota (TA_SESSION_TOKEN_QUOTA, or one set with
+  set_quota) is answered with retrieval-only course context (see TeachingAssistant)
+
+Environment:
+    TA_USAGE_LEDGER_FILE      ledger file (default usage_ledger.jsonl; "" keeps it in memory only)
+    TA_USAGE_FLUSH_SECONDS    flush interval (default 5)
+    TA_SESSION_TOKEN_QUOTA    tokens per session before the downgrade (default 0: no quota)
+"""
+
+import atexit
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from kb_cache import _atomic_write
+
+# calls, prompt_tokens, completion_tokens, cached_tokens
+FIELDS = ("calls", "prompt_tokens", "completion_tokens", "cached_tokens")
+UNTAGGED = "-"
+
+_tags: contextvars.ContextVar = contextvars.ContextVar("ta_usage_tags", default={})
+
+
+def tag_usage(**tags):
+    """Tag the LLM calls made from here on in this thread / task (None removes a tag)."""
+    merged = dict(_tags.get())
+    merged.update(tags)
+    _tags.set({k: v for k, v in merged.items() if v is not None})
+
+
+@contextmanager
+def usage_tags(**tags):
+    """Tag the LLM calls made inside the block."""
+    previous = _tags.get()
+    tag_usage(**tags)
+    try:
+        yield
+    finally:
+        _tags.set(previous)
+
+
+def current_tags() -> Dict[str, str]:
+    return _tags.get()
+
+
+def _day(ts: Optional[float] = None) -> str:
+    return time.strftime("%Y-%m-%d", time.gmtime(ts))
+
+
+def _totals(values: List[int]) -> Dict[str, int]:
+    totals = dict(zip(FIELDS, values))
+    totals["total_tokens"] = totals["prompt_tokens"] + totals["completion_tokens"]
+    return totals
+
+
+def _add(into: Dict, key, values):
+    current = into.get(key)
+    if current is None:
+        into[key] = list(values)
+    else:
+        for i, v in enumerate(values):
+            current[i] += v
+
+
+class UsageLedger:
+    """
+    Usage (see deepseek_client / TeachingAssistant):
+        ledger = default_usage_ledger()
+        ledger.record(usage)                 # tags from the current context
+        ledger.session_usage("web_abc")      # totals, by day / agent / route, quota
+        ledger.daily_usage("2024-05-01")     # totals, by session / agent / route
+        ledger.over_quota("web_abc")
+    """
+
+    def __init__(self, path: Optional[str] = "usage_ledger.jsonl", flush_interval: float = 5.0,
+                 default_quota: int = 0):
+        self.path = path or None
+        self.flush_interval = flush_interval
+        self.default_quota = default_quota
+        self._quotas: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        # (day, session, agent, route) -> [calls, prompt, completion, cached]
+        self._entries: Dict[Tuple[str, str, str, str], List[int]] = {}
+        self._pending: Dict[Tuple[str, str, str, str], List[int]] = {}
+        # session -> prompt + completion tokens, for the quota check
+        self._session_tokens: Dict[str, int] = {}
+        self._thread: Optional[threading.Thread] = None
+        self.flushes = 0
+        if self.path:
+            self._load()
+            atexit.register(self.flush)
+
+    @classmethod
+    def from_env(cls) -> "UsageLedger":
+        return cls(
+            path=os.getenv("TA_USAGE_LEDGER_FILE", "usage_ledger.jsonl"),
+            flush_interval=float(os.getenv("TA_USAGE_FLUSH_SECONDS", "5")),
+            default_quota=int(os.getenv("TA_SESSION_TOKEN_QUOTA", "0")),
+        )
+
+    # ---------- recording ----------
+
+    def record(self, usage: Dict[str, int], **tags):
+        """Add one call's usage (extract_usage format); tags default to the current context's."""
+        if not usage:
+            return
+        tags = dict(current_tags(), **tags)
+        key = (_day(), tags.get("session_id", UNTAGGED), tags.get("agent", UNTAGGED), tags.get("route", UNTAGGED))
+        values = (1, int(usage.get("prompt_tokens", 0)), int(usage.get("completion_tokens", 0)),
+                  int(usage.get("cache_hit_tokens", 0)))
+        with self._lock:
+            _add(self._entries, key, values)
+            if self.path:
+                _add(self._pending, key, values)
+            self._session_tokens[key[1]] = self._session_tokens.get(key[1], 0) + values[1] + values[2]
+        if self.path:
+            self._schedule()
+
+    # ---------- quotas ----------
+
+    def set_quota(self, session_id: str, tokens: Optional[int]):
+        """Quota for one session (0: unlimited, None: back to the default)."""
+        with self._lock:
+            if tokens is None:
+                self._quotas.pop(session_id, None)
+            else:
+                self._quotas[session_id] = int(tokens)
+
+    def quota(self, session_id: str) -> int:
+        return self._quotas.get(session_id, self.default_quota)
+
+    def over_quota(self, session_id: str) -> bool:
+        quota = self.quota(session_id)
+        return quota > 0 and self._session_tokens.get(session_id, 0) >= quota
+
+    # ---------- queries ----------
+
+    def _group(self, match, group_index: int) -> Tuple[List[int], Dict[str, List[int]]]:
+        total = [0] * len(FIELDS)
+        groups: Dict[str, List[int]] = {}
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._entries.items() if match(k)]
+        for key, values in items:
+            _add(groups, key[group_index], values)
+            for i, v in enumerate(values):
+                total[i] += v
+        return total, groups
+
+    def session_usage(self, session_id: str) -> Dict:
+        total, by_day = self._group(lambda k: k[1] == session_id, 0)
+        _, by_agent = self._group(lambda k: k[1] == session_id, 2)
+        _, by_route = self._group(lambda k: k[1] == session_id, 3)
+        return {
+            "session_id": session_id,
+            "total": _totals(total),
+            "by_day": {k: _totals(v) for k, v in sorted(by_day.items())},
+            "by_agent": {k: _totals(v) for k, v in sorted(by_agent.items())},
+            "by_route": {k: _totals(v) for k, v in sorted(by_route.items())},
+            "quota": self.quota(session_id),
+            "over_quota": self.over_quota(session_id),
+        }
+
+    def daily_usage(self, day: Optional[str] = None) -> Dict:
+        """Totals of one day (YYYY-MM-DD, UTC) by session / agent / route, or of every day."""
+        if day is None:
+            total, by_day = self._group(lambda k: True, 0)
+            return {"total": _totals(total), "by_day": {k: _totals(v) for k, v in sorted(by_day.items())}}
+        total, by_session = self._group(lambda k: k[0] == day, 1)
+        _, by_agent = self._group(lambda k: k[0] == day, 2)
+        _, by_route = self._group(lambda k: k[0] == day, 3)
+        return {
+            "day": day,
+            "total": _totals(total),
+            "by_session": {k: _totals(v) for k, v in sorted(by_session.items())},
+            "by_agent": {k: _totals(v) for k, v in sorted(by_agent.items())},
+            "by_route": {k: _totals(v) for k, v in sorted(by_route.items())},
+        }
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "sessions": len(self._session_tokens),
+                "pending_entries": len(self._pending),
+                "flushes": self.flushes,
+                "default_quota": self.default_quota,
+                "sessions_over_quota": sum(1 for s in self._session_tokens if self.over_quota(s)),
+            }
+
+    # ---------- persistence ----------
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        lines = 0
+        torn = False
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    torn = not line.endswith("\n")
+                    try:
+                        rec = json.loads(line)
+                        key = (rec["day"], rec["session_id"], rec["agent"], rec["route"])
+                        values = [int(rec[name]) for name in FIELDS]
+                    except (ValueError, KeyError, TypeError):
+                        # Torn line from an interrupted append
+                        continue
+                    _add(self._entries, key, values)
+                    self._session_tokens[key[1]] = self._session_tokens.get(key[1], 0) + values[1] + values[2]
+                    lines += 1
+        except OSError as e:
+            print(f"[Usage] Failed to load ledger {self.path}: {e}")
+            return
+        print(f"[Usage] Loaded {len(self._entries)} ledger entries ({lines} lines) from {self.path}")
+        # A torn last line is rewritten too, or the next append would continue it
+        if torn or lines > 2 * len(self._entries):
+            _atomic_write(self.path, (self._line(k, v) for k, v in self._entries.items()))
+            print(f"[Usage] Compacted {self.path} to {len(self._entries)} lines")
+
+    @staticmethod
+    def _line(key, values) -> str:
+        rec = dict(zip(("day", "session_id", "agent", "route"), key))
+        rec.update(zip(FIELDS, values))
+        return json.dumps(rec, ensure_ascii=False) + "\n"
+
+    def _schedule(self):
+        if self.flush_interval <= 0:
+            self.flush()
+            return
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="usage-ledger-flusher", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """Append the usage recorded since the last flush to the ledger file."""
+        if not self.path:
+            return
+        with self._io_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write("".join(self._line(k, v) for k, v in pending.items()))
+                self.flushes += 1
+            except OSError as e:
+                print(f"[Usage] Failed to write ledger {self.path}: {e}")
+                with self._lock:
+                    for key, values in pending.items():
+                        _add(self._pending, key, values)
+
+
+_default_ledger: Optional[UsageLedger] = None
+_default_lock = threading.Lock()
+
+
+def default_usage_ledger() -> UsageLedger:
+    """Process-wide UsageLedger built from the environment, shared by all clients and sessions."""
+    global _default_ledger
+    if _default_ledger is None:
+        with _default_lock:
+            if _default_ledger is None:
+                _default_ledger = UsageLedger.from_env()
+    return _default_ledger